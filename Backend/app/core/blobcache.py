@@ -0,0 +1,110 @@
+import asyncio
+from collections import OrderedDict
+
+from app.core.config import settings
+
+# Cache nội dung file nhỏ, hay mở (ảnh gần đây...) trong RAM của process: /content trả thẳng
+# từ bộ nhớ thay vì đọc ổ cứng mỗi lần (ổ quay chậm khi nhiều người mở cùng lúc).
+# - Key: blob là SHA-256 nội dung, file cũ là ETag (id + mtime + size)
+#   -> nội dung đổi thì key đổi, không bao giờ trả bản cũ.
+# - Chỉ nhận file <= BLOB_CACHE_MAX_BLOB_BYTES và đã được mở ít nhất BLOB_CACHE_MIN_HITS lần
+#   (file mở 1 lần rồi thôi không đẩy các file hay mở ra khỏi cache).
+# - Tổng dung lượng <= BLOB_CACHE_BYTES, đầy thì bỏ phần tử lâu chưa dùng nhất (LRU).
+# Chỉ dùng trong event loop (1 thread) nên không cần lock.
+
+# Số key được nhớ số lần mở (kể cả chưa vào cache)
+SEEN_MAX_SIZE = 10000
+
+_data: OrderedDict[str, bytes] = OrderedDict()
+_seen: OrderedDict[str, int] = OrderedDict()
+_inflight: dict[str, asyncio.Future] = {}
+_stats = {"hits": 0, "misses": 0, "admitted": 0, "evicted": 0, "bytes": 0, "bytes_served": 0}
+
+
+def enabled() -> bool:
+    return settings.BLOB_CACHE_BYTES > 0
+
+
+def cacheable(size: int) -> bool:
+    return enabled() and 0 < size <= min(settings.BLOB_CACHE_MAX_BLOB_BYTES, settings.BLOB_CACHE_BYTES)
+
+
+def _touch(key: str) -> int:
+    count = _seen.get(key, 0) + 1
+    _seen[key] = count
+    _seen.move_to_end(key)
+    while len(_seen) > SEEN_MAX_SIZE:
+        _seen.popitem(last=False)
+    return count
+
+
+def _put(key: str, data: bytes):
+    old = _data.pop(key, None)
+    if old is not None:
+        _stats["bytes"] -= len(old)
+    _data[key] = data
+    _stats["bytes"] += len(data)
+    _stats["admitted"] += 1
+    while _stats["bytes"] > settings.BLOB_CACHE_BYTES:
+        _, evicted = _data.popitem(last=False)
+        _stats["bytes"] -= len(evicted)
+        _stats["evicted"] += 1
+
+
+# Nội dung đã cache (chính object bytes trong cache, không copy) hoặc None. Mở đủ số lần thì
+# đọc nội dung qua load() (hàm async trả về bytes) rồi đưa vào cache; nhiều request cùng lúc chỉ đọc 1 lần.
+async def get_or_load(key: str, size: int, load) -> bytes | None:
+    data = _data.get(key)
+    if data is not None:
+        _data.move_to_end(key)
+        _stats["hits"] += 1
+        return data
+    _stats["misses"] += 1
+    if not cacheable(size) or _touch(key) < settings.BLOB_CACHE_MIN_HITS:
+        return None
+
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(load())
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+        data = await asyncio.shield(future)
+        # File bị sửa giữa lúc stat và lúc đọc -> không cache
+        if len(data) != size:
+            return None
+        _seen.pop(key, None)
+        _put(key, data)
+    else:
+        data = await asyncio.shield(future)
+        if len(data) != size:
+            return None
+    return data
+
+
+# Ghi nhận số byte đã gửi từ RAM (không phải đọc đĩa)
+def record_served(nbytes: int):
+    _stats["bytes_served"] += nbytes
+
+
+def discard(keys):
+    for key in keys:
+        data = _data.pop(key, None)
+        if data is not None:
+            _stats["bytes"] -= len(data)
+        _seen.pop(key, None)
+
+
+def clear():
+    _data.clear()
+    _seen.clear()
+    _stats["bytes"] = 0
+
+
+def stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "entries": len(_data),
+        "max_bytes": settings.BLOB_CACHE_BYTES,
+        "hit_ratio": _stats["hits"] / total if total else 0.0,
+    }
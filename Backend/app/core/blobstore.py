@@ -0,0 +1,475 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import partial
+
+import uuid6
+from sqlalchemy import text
+
+from app.core import compression, metrics
+from app.core.config import settings
+from app.core.diskio import run_io
+from app.core.storage import backend
+
+# Dữ liệu mới: lưu theo nội dung trong storage backend (app.core.storage), key = sha256
+# Dữ liệu cũ (trước khi có blob): storage/completed/<owner_id>/<file_id>
+# (chuyển sang blob bằng: python -m app.core.migrate_storage legacy)
+COMPLETED_BASE = "storage/completed"
+TEMP_BASE = "storage/temp"
+
+
+def legacy_path(owner_id, file_id) -> str:
+    return os.path.join(COMPLETED_BASE, str(owner_id), str(file_id))
+
+
+# Đường dẫn đọc trực tiếp trên đĩa (blob nguyên bản ở backend local, hoặc file cũ);
+# None nếu blob nằm ở backend từ xa (S3). Blob đã nén thì đường dẫn này không tồn tại.
+def physical_path(owner_id, file_id, blob_hash: str | None) -> str | None:
+    if blob_hash:
+        return backend.local_path(blob_hash)
+    return legacy_path(owner_id, file_id)
+
+
+# Blob nén (app.core.compression) nằm ở key <sha256>.zst
+def blob_key(sha256: str, encoding: str | None) -> str:
+    return sha256 + compression.KEY_SUFFIX if encoding == compression.ENCODING else sha256
+
+
+# Các key có thể có của blob (xóa blob thì xóa hết, bản nào không có thì bỏ qua)
+def blob_keys(sha256: str) -> list[str]:
+    return [sha256, sha256 + compression.KEY_SUFFIX]
+
+
+@dataclass(frozen=True)
+class BlobLocation:
+    key: str
+    encoding: str | None # None = nguyên bản, "zstd" = zstd seekable
+    size: int # Kích thước nội dung gốc
+    stored_size: int
+    mtime: float
+
+
+# Các hàm đọc dưới đây là hàm đồng bộ, gọi qua run_io.
+# Không cần DB: bản nguyên (nếu còn, VD ngay sau khi vừa nén lại) được ưu tiên, không có thì tìm bản nén.
+# FileNotFoundError nếu không có bản nào.
+def locate_blob(sha256: str) -> BlobLocation:
+    try:
+        stored_size, mtime = backend.stat(sha256)
+        return BlobLocation(sha256, None, stored_size, stored_size, mtime)
+    except FileNotFoundError:
+        pass
+    key = blob_key(sha256, compression.ENCODING)
+    stored_size, mtime = backend.stat(key)
+    table = compression.seek_table(key, partial(backend.read_at, key), stored_size)
+    return BlobLocation(key, compression.ENCODING, compression.content_size(table), stored_size, mtime)
+
+
+# Đọc đoạn [start, end] nội dung gốc của blob: bản nén chỉ giải nén các frame cần thiết
+def read_blob_range(sha256: str, start: int, end: int):
+    location = locate_blob(sha256)
+    if location.encoding is None:
+        yield from backend.read_range(location.key, start, end)
+        return
+    with backend.open_random(location.key) as read_at:
+        table = compression.seek_table(location.key, read_at, location.stored_size)
+        yield from compression.read_range(table, read_at, start, end)
+
+
+# Mở nội dung file để đọc tuần tự (nén ZIP...): (size, mtime, file-like)
+def open_content(owner_id, file_id, blob_hash: str | None):
+    if not blob_hash:
+        path = legacy_path(owner_id, file_id)
+        st = os.stat(path)
+        return st.st_size, st.st_mtime, open(path, "rb")
+    location = locate_blob(blob_hash)
+    f = backend.open(location.key)
+    if location.encoding is not None:
+        f = compression.open_reader(f)
+    return location.size, location.mtime, f
+
+
+def _save_stream(src, dest_path: str):
+    with src, open(dest_path, "wb") as out:
+        shutil.copyfileobj(src, out, settings.UPLOAD_BUFFER_SIZE)
+
+
+# Cho code cần 1 file thật trên đĩa (Pillow tạo thumbnail ở process khác):
+# blob ở backend từ xa / đã nén được tải về (giải nén) ra file tạm, xóa khi xong
+@asynccontextmanager
+async def local_copy(owner_id, file_id, blob_hash: str | None):
+    path = physical_path(owner_id, file_id, blob_hash)
+    if path is not None and os.path.exists(path):
+        yield path
+        return
+    if not blob_hash:
+        raise FileNotFoundError(path)
+    temp_path = new_temp_path()
+    try:
+        _, mtime, src = await run_io(open_content, owner_id, file_id, blob_hash)
+        await run_io(_save_stream, src, temp_path)
+        os.utime(temp_path, (mtime, mtime))
+        yield temp_path
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def new_temp_path() -> str:
+    os.makedirs(TEMP_BASE, exist_ok=True)
+    return os.path.join(TEMP_BASE, f"{uuid6.uuid7()}.upload")
+
+
+# Các hàm ghi đĩa dưới đây là hàm đồng bộ, gọi qua app.core.diskio.run_io
+# để chạy trên thread pool.
+
+def _copy_into(src, out, hasher) -> int:
+    size = 0
+    buffer_size = settings.UPLOAD_BUFFER_SIZE
+    while True:
+        chunk = src.read(buffer_size)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        out.write(chunk)
+        size += len(chunk)
+    return size
+
+
+# Ghi src (file-like) ra dest_path, đồng thời tính SHA-256 và kích thước
+# (không cần stat lại file sau khi ghi)
+def copy_and_hash(src, dest_path: str) -> tuple[int, str]:
+    hasher = hashlib.sha256()
+    with open(dest_path, "wb") as out:
+        size = _copy_into(src, out, hasher)
+    return size, hasher.hexdigest()
+
+
+# Ghi 1 chunk ra file riêng (không cần hash)
+def write_file(src, dest_path: str) -> int:
+    size = 0
+    buffer_size = settings.UPLOAD_BUFFER_SIZE
+    with open(dest_path, "wb") as out:
+        while True:
+            chunk = src.read(buffer_size)
+            if not chunk:
+                break
+            out.write(chunk)
+            size += len(chunk)
+    return size
+
+
+# Ghi tiếp 1 khúc vào file đang mở, cập nhật hash (dữ liệu nhận dần từ request.stream())
+def append_and_hash(out, hasher, data) -> int:
+    hasher.update(data)
+    return out.write(data)
+
+
+# Gộp các file <i>.part trong temp_dir theo thứ tự vào dest_path, xóa temp_dir khi xong
+def merge_parts(temp_dir: str, total_chunks: int, dest_path: str) -> tuple[int, str]:
+    hasher = hashlib.sha256()
+    size = 0
+    with open(dest_path, "wb") as out:
+        for i in range(total_chunks):
+            with open(os.path.join(temp_dir, f"{i}.part"), "rb") as part:
+                size += _copy_into(part, out, hasher)
+    shutil.rmtree(temp_dir)
+    return size, hasher.hexdigest()
+
+
+# Tạo trước file đích đủ kích thước để các chunk ghi thẳng vào đúng offset
+def preallocate(path: str, size: int):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if size > 0:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                # Hệ file không hỗ trợ fallocate -> file thưa
+                os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+# Ghi data vào path tại offset (pwrite, an toàn khi nhiều chunk ghi song song)
+def write_at(path: str, offset: int, data) -> int:
+    view = memoryview(data)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    finally:
+        os.close(fd)
+    return len(data)
+
+
+def hash_file(path: str) -> tuple[int, str]:
+    hasher = hashlib.sha256()
+    size = 0
+    buffer_size = settings.UPLOAD_BUFFER_SIZE
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(buffer_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+    return size, hasher.hexdigest()
+
+
+# ioctl FICLONE (Linux): reflink trên btrfs/xfs, 2 file dùng chung extent, không copy byte nào
+FICLONE = 0x40049409
+
+
+# Nhân bản file vật lý mà không kéo dữ liệu qua Python:
+# reflink -> os.copy_file_range (kernel copy) -> copy có buffer nếu FS không hỗ trợ.
+# progress(nbytes) được gọi sau mỗi đoạn đã copy.
+def copy_file(src_path: str, dest_path: str, progress=None) -> int:
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    size = os.path.getsize(src_path)
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            if progress:
+                progress(size)
+            return size
+        except OSError:
+            pass
+
+        copied = 0
+        step = settings.UPLOAD_BUFFER_SIZE * 8
+        try:
+            while copied < size:
+                n = os.copy_file_range(src.fileno(), dest.fileno(), min(step, size - copied))
+                if n == 0:
+                    break
+                copied += n
+                if progress:
+                    progress(n)
+            return copied
+        except (AttributeError, OSError) as e:
+            # Khác filesystem / kernel cũ -> copy thường từ vị trí đang dở
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+
+        src.seek(copied)
+        dest.seek(copied)
+        while True:
+            chunk = src.read(settings.UPLOAD_BUFFER_SIZE)
+            if not chunk:
+                break
+            dest.write(chunk)
+            copied += len(chunk)
+            if progress:
+                progress(len(chunk))
+        return copied
+
+
+# Đưa file tạm (đã ghi đủ) vào chỗ: os.replace nguyên tử, không ai thấy file ghi dở
+def move_file(src_path: str, dest_path: str):
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    os.replace(src_path, dest_path)
+
+
+# Khóa advisory theo hash tới hết transaction: ghi blob (upload) và xóa blob (storage_gc)
+# cùng nội dung không chạy xen nhau. Khóa theo thứ tự hash để không deadlock.
+async def lock_blob_hashes(db, hashes):
+    await db.execute(text("""
+        SELECT pg_advisory_xact_lock(hashtextextended(h, 0)) FROM unnest(CAST(:hashes AS varchar[])) AS h
+    """), {"hashes": sorted(set(hashes))})
+
+
+# Nội dung đã được đưa vào kho trước transaction (prepare_blob), chờ ghi dòng blobs (store_blob)
+@dataclass
+class PreparedBlob:
+    temp_path: str # Bản nguyên, giữ tới khi store_blob xong (ghi lại nếu file trong kho bị mất)
+    sha256: str
+    size: int
+    key: str | None # Key vừa ghi vào kho, None = nội dung đã có sẵn trong kho
+    encoding: str | None = None # Giá trị cột blobs.encoding nếu đây là blob mới
+    stored_size: int | None = None
+    level: int | None = None
+
+
+def _existing_key(sha256: str) -> str | None:
+    for key in blob_keys(sha256):
+        if backend.exists(key):
+            return key
+    return None
+
+
+# Bước 1, gọi TRƯỚC khi mở transaction: nén (tốn CPU) và ghi vào storage backend (S3: upload
+# qua mạng). Nội dung được đặt tên theo hash nên ghi trước khi có dòng blobs vẫn an toàn;
+# transaction lỗi thì file thừa được reconcile của storage_gc dọn. Nội dung đã có thì không ghi gì.
+# mime_type quyết định có nén khi lưu hay không (app.core.compression).
+async def prepare_blob(temp_path: str, sha256: str, size: int, mime_type: str | None = None) -> PreparedBlob:
+    blob = PreparedBlob(temp_path, sha256, size, None)
+    if await run_io(_existing_key, sha256) is not None:
+        return blob
+    src_path = temp_path
+    if compression.should_compress(mime_type, size):
+        packed_path = new_temp_path() + compression.KEY_SUFFIX
+        with metrics.stage("blob.compress"):
+            stored_size = await run_io(compression.compress_file, temp_path, packed_path, settings.COMPRESSION_LEVEL)
+        metrics.stage_bytes.inc("blob.compress", amount=size)
+        if compression.worth_it(stored_size, size):
+            st = os.stat(temp_path)
+            os.utime(packed_path, (st.st_atime, st.st_mtime))
+            blob.encoding, blob.stored_size, blob.level = compression.ENCODING, stored_size, settings.COMPRESSION_LEVEL
+            src_path = packed_path
+        else:
+            os.remove(packed_path)
+            blob.encoding = "identity"
+    blob.key = blob_key(sha256, blob.encoding)
+    # Bản nguyên được giữ lại (keep) cho store_blob
+    await run_io(partial(backend.put, blob.key, src_path, keep=src_path == temp_path))
+    return blob
+
+
+# Bước 2, trong transaction (sau lock_blob_hashes và upsert dòng blobs): file của blob phải còn
+# trong kho. GC có thể đã xóa nó giữa lúc prepare_blob ghi và lúc khóa (blob vừa được giải phóng),
+# hoặc file vật lý bị mất (hiếm) -> ghi lại bản nguyên. Bản prepare_blob vừa ghi khác dạng
+# với dòng blobs đã có thì là bản thừa. File tạm được xóa.
+async def _settle_blob(db, blob: PreparedBlob, encoding):
+    key = blob_key(blob.sha256, encoding)
+    if not await run_io(backend.exists, key):
+        await run_io(backend.put, blob.sha256, blob.temp_path)
+        if key != blob.sha256:
+            await set_blob_encoding(db, blob.sha256, None)
+    elif blob.key is not None and blob.key != key:
+        await run_io(backend.delete, blob.key)
+    if os.path.exists(blob.temp_path):
+        os.remove(blob.temp_path)
+
+
+# Tăng ref_count (thêm dòng blobs nếu là nội dung mới) cho blob đã prepare_blob.
+# Không commit: caller commit cùng transaction với dòng FileItem.
+# Trả về True nếu đây là blob mới, False nếu nội dung đã có.
+async def store_blob(db, blob: PreparedBlob) -> bool:
+    return blob.sha256 in await store_blobs(db, [blob])
+
+
+# Nhiều file một lúc (upload hàng loạt): 1 câu INSERT cho cả batch, cùng sha256 xuất hiện
+# n lần -> thêm n tham chiếu. Mọi file tạm đều được xóa. Trả về các sha256 là blob mới.
+async def store_blobs(db, blobs: list[PreparedBlob]) -> set[str]:
+    firsts = {}
+    counts = Counter()
+    for blob in blobs:
+        counts[blob.sha256] += 1
+        # Đại diện cho mỗi hash: bản đã ghi vào kho (nếu có)
+        if blob.sha256 not in firsts or (firsts[blob.sha256].key is None and blob.key is not None):
+            firsts[blob.sha256] = blob
+    # Khóa theo thứ tự cố định: 2 batch trùng nội dung không deadlock
+    hashes = sorted(firsts)
+    await lock_blob_hashes(db, hashes)
+    result = await db.execute(text("""
+        INSERT INTO blobs (sha256, size_bytes, ref_count, encoding, stored_bytes, compression_level, compressed_at)
+        SELECT b.sha256, b.size_bytes, b.ref_count, b.encoding, b.stored_bytes, b.compression_level,
+            CASE WHEN b.encoding = :zstd THEN now() END
+        FROM unnest(
+            CAST(:hashes AS varchar[]), CAST(:sizes AS bigint[]), CAST(:counts AS integer[]),
+            CAST(:encodings AS varchar[]), CAST(:stored AS bigint[]), CAST(:levels AS smallint[])
+        ) AS b(sha256, size_bytes, ref_count, encoding, stored_bytes, compression_level)
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + EXCLUDED.ref_count
+        RETURNING sha256, (xmax = 0) AS inserted, encoding
+    """), {
+        "zstd": compression.ENCODING,
+        "hashes": hashes,
+        "sizes": [firsts[h].size for h in hashes],
+        "counts": [counts[h] for h in hashes],
+        "encodings": [firsts[h].encoding if firsts[h].key else None for h in hashes],
+        "stored": [firsts[h].stored_size if firsts[h].key else None for h in hashes],
+        "levels": [firsts[h].level if firsts[h].key else None for h in hashes],
+    })
+    created = set()
+    for sha256, inserted, encoding in result.all():
+        await _settle_blob(db, firsts[sha256], encoding)
+        if inserted:
+            created.add(sha256)
+    for blob in blobs:
+        if os.path.exists(blob.temp_path):
+            os.remove(blob.temp_path)
+    return created
+
+
+async def set_blob_encoding(db, sha256: str, encoding: str | None, stored_size: int | None = None, level: int | None = None):
+    await db.execute(text("""
+        UPDATE blobs SET encoding = CAST(:encoding AS varchar), stored_bytes = :stored, compression_level = :level,
+            compressed_at = CASE WHEN CAST(:encoding AS varchar) IS NULL THEN NULL ELSE now() END
+        WHERE sha256 = :sha256
+    """), {"sha256": sha256, "encoding": encoding, "stored": stored_size, "level": level})
+
+
+# Nén src_path (nội dung gốc) vào kho dưới key <sha256>.zst và ghi nhận vào dòng blobs (không commit).
+# Nén không đáng (tiết kiệm < COMPRESSION_MIN_SAVINGS) thì đánh dấu "identity" để không thử lại
+# và trả về False. src_path được giữ nguyên, caller tự dọn.
+async def compress_into_store(db, src_path: str, sha256: str, size: int, level: int) -> bool:
+    packed_path = new_temp_path() + compression.KEY_SUFFIX
+    try:
+        with metrics.stage("blob.compress"):
+            stored_size = await run_io(compression.compress_file, src_path, packed_path, level)
+        metrics.stage_bytes.inc("blob.compress", amount=size)
+        if not compression.worth_it(stored_size, size):
+            # Blob đã nén sẵn (job nén lại) thì giữ nguyên bản nén cũ
+            await db.execute(text("""
+                UPDATE blobs SET encoding = 'identity' WHERE sha256 = :sha256 AND encoding IS NULL
+            """), {"sha256": sha256})
+            return False
+        # Giữ mtime của nội dung gốc (Last-Modified của /content không đổi khi nén lại)
+        st = os.stat(src_path)
+        os.utime(packed_path, (st.st_atime, st.st_mtime))
+        await run_io(backend.put, blob_key(sha256, compression.ENCODING), packed_path)
+        await set_blob_encoding(db, sha256, compression.ENCODING, stored_size, level)
+        return True
+    finally:
+        if os.path.exists(packed_path):
+            os.remove(packed_path)
+
+
+# Thêm 1 tham chiếu tới blob đã có (upload tức thì). None nếu hash chưa tồn tại.
+async def acquire_blob(db, sha256: str) -> int | None:
+    result = await db.execute(text("""
+        UPDATE blobs SET ref_count = ref_count + 1
+        WHERE sha256 = :sha256
+        RETURNING size_bytes
+    """), {"sha256": sha256})
+    return result.scalar_one_or_none()
+
+
+# Tăng ref_count theo {sha256: số tham chiếu mới} (copy file/folder). Không commit.
+async def add_blob_refs(db, counts: dict[str, int]):
+    if not counts:
+        return
+    hashes = list(counts.keys())
+    await db.execute(text("""
+        UPDATE blobs b SET ref_count = b.ref_count + d.n
+        FROM unnest(CAST(:hashes AS varchar[]), CAST(:counts AS integer[])) AS d(sha256, n)
+        WHERE b.sha256 = d.sha256
+    """), {"hashes": hashes, "counts": [counts[h] for h in hashes]})
+
+
+# Giảm ref_count theo {sha256: số tham chiếu bị bỏ}. Blob về 0 thì xóa dòng DB.
+# Trả về danh sách key (bản nguyên + bản nén) cần xóa khỏi backend SAU khi commit thành công.
+# Phải gọi sau khi các dòng files tham chiếu đã bị xóa (khóa ngoại).
+async def release_blobs(db, counts: dict[str, int]) -> list[str]:
+    if not counts:
+        return []
+    hashes = list(counts.keys())
+    await db.execute(text("""
+        UPDATE blobs b SET ref_count = b.ref_count - d.n
+        FROM unnest(CAST(:hashes AS varchar[]), CAST(:counts AS integer[])) AS d(sha256, n)
+        WHERE b.sha256 = d.sha256
+    """), {"hashes": hashes, "counts": [counts[h] for h in hashes]})
+    result = await db.execute(text("""
+        DELETE FROM blobs
+        WHERE sha256 = ANY(CAST(:hashes AS varchar[])) AND ref_count <= 0
+        RETURNING sha256
+    """), {"hashes": hashes})
+    return [key for sha256 in result.scalars().all() for key in blob_keys(sha256)]
+
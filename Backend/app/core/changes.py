@@ -0,0 +1,186 @@
+import asyncio
+import uuid
+
+from sqlalchemy import text
+
+from app.core.config import settings
+
+# Nhật ký thay đổi (bảng changes): client đồng bộ bằng "các thay đổi sau cursor" thay vì
+# /list lại mọi folder. Mỗi thao tác ghi thêm 1 dòng cho mỗi item gốc bị ảnh hưởng, cùng
+# transaction với thay đổi trên bảng files:
+# - "upsert": item được tạo / đổi tên / di chuyển (client đọc trạng thái hiện tại trong kết quả)
+# - "delete": item bị xóa, folder thì cả cây con (không ghi từng item con)
+# seq lấy từ users.change_seq bằng UPDATE: dòng user bị khóa tới khi commit nên seq của mỗi user
+# liên tục và đúng thứ tự commit -> đọc "seq > cursor" không bao giờ bỏ sót thay đổi nào.
+#
+# Báo có thay đổi mới (long-poll / WebSocket): NOTIFY trong transaction, Postgres chỉ gửi khi
+# commit và gửi tới mọi worker đang LISTEN, kể cả worker khác process.
+
+CHANNEL = "file_changes"
+# Trigger trên bảng users (create_table.sql) gửi id user bị sửa/khóa/xóa -> bỏ khỏi cache xác thực
+USER_CHANNEL = "user_changes"
+# Mất kết nối LISTEN (DB restart...) thì các request đang chờ vẫn tự kiểm tra lại sau mỗi khoảng này
+FALLBACK_POLL_SECONDS = 15
+PRUNE_INTERVAL_SECONDS = 3600
+
+_waiters: dict[str, set[asyncio.Event]] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+# Không commit: caller commit cùng transaction với thay đổi trên files.
+# Gọi ngay trước commit (sau các lệnh khóa dòng files) để mọi transaction khóa dòng user sau cùng.
+async def record_changes(db, owner_id, upserts=(), deletes=()):
+    entries = [(file_id, "upsert") for file_id in upserts] + [(file_id, "delete") for file_id in deletes]
+    if not entries:
+        return
+    result = await db.execute(text("""
+        UPDATE users SET change_seq = change_seq + :n WHERE id = :owner_id RETURNING change_seq
+    """), {"owner_id": owner_id, "n": len(entries)})
+    last_seq = result.scalar_one()
+    await db.execute(text("""
+        INSERT INTO changes (owner_id, seq, file_id, action)
+        SELECT :owner_id, :first_seq + e.n - 1, e.file_id, e.action
+        FROM unnest(CAST(:ids AS uuid[]), CAST(:actions AS varchar[])) WITH ORDINALITY AS e(file_id, action, n)
+    """), {
+        "owner_id": owner_id,
+        "first_seq": last_seq - len(entries) + 1,
+        "ids": [file_id for file_id, _ in entries],
+        "actions": [action for _, action in entries],
+    })
+    await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": f"{owner_id}:{last_seq}"})
+
+
+class CursorExpired(Exception):
+    pass
+
+
+# (seq mới nhất của user, [(seq, file_id, action)] sau cursor), 1 query.
+# CursorExpired nếu đoạn sau cursor đã bị dọn (hoặc cursor lớn hơn seq hiện tại).
+async def read_changes(db, owner_id, cursor: int, limit: int) -> tuple[int, list]:
+    result = await db.execute(text("""
+        SELECT u.change_seq, c.seq, c.file_id, c.action
+        FROM users u
+        LEFT JOIN LATERAL (
+            SELECT seq, file_id, action FROM changes
+            WHERE owner_id = u.id AND seq > :cursor
+            ORDER BY seq LIMIT :limit
+        ) c ON true
+        WHERE u.id = :owner_id
+    """), {"owner_id": owner_id, "cursor": cursor, "limit": limit})
+    rows = result.all()
+    latest = rows[0].change_seq
+    entries = [(row.seq, row.file_id, row.action) for row in rows if row.seq is not None]
+    if cursor > latest or (cursor < latest and (not entries or entries[0][0] != cursor + 1)):
+        raise CursorExpired()
+    return latest, entries
+
+
+async def latest_seq(db, owner_id) -> int:
+    result = await db.execute(text("SELECT change_seq FROM users WHERE id = :owner_id"), {"owner_id": owner_id})
+    return result.scalar_one()
+
+
+# Chỉ giữ thay đổi mới nhất của mỗi item, theo thứ tự seq: [(file_id, action)]
+def compact(entries) -> list[tuple[uuid.UUID, str]]:
+    last = {}
+    for seq, file_id, action in entries:
+        last[file_id] = (seq, action)
+    return [(file_id, action) for file_id, (_, action) in sorted(last.items(), key=lambda item: item[1][0])]
+
+
+# --- Chờ thay đổi mới ---
+
+# Đăng ký TRƯỚC khi đọc DB: thay đổi commit giữa lúc đọc và lúc chờ vẫn đánh thức được
+def subscribe(owner_id) -> asyncio.Event:
+    event = asyncio.Event()
+    _waiters.setdefault(str(owner_id), set()).add(event)
+    return event
+
+
+def unsubscribe(owner_id, event: asyncio.Event):
+    events = _waiters.get(str(owner_id))
+    if events is not None:
+        events.discard(event)
+        if not events:
+            del _waiters[str(owner_id)]
+
+
+async def wait_for_change(event: asyncio.Event, timeout: float) -> bool:
+    try:
+        await asyncio.wait_for(event.wait(), timeout=min(timeout, FALLBACK_POLL_SECONDS))
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def _on_notify(connection, pid, channel, payload):
+    owner_id = payload.split(":", 1)[0]
+    for event in _waiters.get(owner_id, ()):
+        event.set()
+
+
+def _on_user_notify(connection, pid, channel, payload):
+    from app.core.deps import invalidate_user
+
+    invalidate_user(payload)
+
+
+async def _listen_loop():
+    from app.core.deps import clear_user_cache
+
+    from app.db.base import engine
+
+    while True:
+        try:
+            # Giữ riêng 1 kết nối của pool cho LISTEN
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                driver = raw.driver_connection
+                await driver.add_listener(CHANNEL, _on_notify)
+                await driver.add_listener(USER_CHANNEL, _on_user_notify)
+                # Lúc mất kết nối có thể đã lỡ NOTIFY -> bỏ hết user trong cache
+                clear_user_cache()
+                try:
+                    while not driver.is_closed():
+                        await asyncio.sleep(FALLBACK_POLL_SECONDS)
+                finally:
+                    if not driver.is_closed():
+                        await driver.remove_listener(CHANNEL, _on_notify)
+                        await driver.remove_listener(USER_CHANNEL, _on_user_notify)
+        except Exception as e:
+            print(f"Changes listener error: {e}")
+        await asyncio.sleep(FALLBACK_POLL_SECONDS)
+
+
+async def prune(db) -> int:
+    result = await db.execute(text("""
+        DELETE FROM changes WHERE created_at < now() - make_interval(days => :days)
+    """), {"days": settings.CHANGES_RETENTION_DAYS})
+    await db.commit()
+    return result.rowcount
+
+
+async def _prune_loop():
+    from app.db.base import AsyncSessionLocal
+
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await prune(db)
+        except Exception as e:
+            print(f"Changes prune error: {e}")
+
+
+# Gọi trong lifespan của app
+def start():
+    for loop in (_listen_loop(), _prune_loop()):
+        task = asyncio.create_task(loop)
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+async def stop():
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
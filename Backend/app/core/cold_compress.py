@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+
+from sqlalchemy import text
+
+from app.core import compression, storage_gc
+from app.core.blobstore import local_copy, compress_into_store
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal
+
+# Nén lại dữ liệu "nguội" dưới nền (khi compression.available()):
+# - blob nguyên bản (upload trước khi bật nén) có MIME nén được -> nén ở COMPRESSION_COLD_LEVEL
+# - blob đã nén nhanh lúc upload (COMPRESSION_LEVEL) -> nén lại ở mức cao hơn
+# Mỗi blob 1 transaction ngắn, CPU nén chạy trên thread pool disk-io. Bản nguyên được giữ thêm
+# CONTENT_CACHE_TTL_SECONDS (cache /content của các worker có thể còn trỏ tới) rồi mới xóa;
+# nếu process dừng trước đó thì GC reconcile dọn (xem storage_gc._reconcile_blobs).
+#
+#   python -m app.core.cold_compress --dry-run
+
+_tasks: set[asyncio.Task] = set()
+
+
+async def _candidates(db, after: str) -> list:
+    result = await db.execute(text("""
+        SELECT b.sha256, b.size_bytes, b.encoding FROM blobs b
+        WHERE b.sha256 > :after
+          AND b.created_at < now() - make_interval(days => :days)
+          AND b.size_bytes >= :min_size
+          AND (
+            (b.encoding IS NULL AND EXISTS (
+                SELECT 1 FROM files f
+                WHERE f.blob_hash = b.sha256
+                  AND (f.mime_type = ANY(CAST(:types AS varchar[]))
+                       OR f.mime_type LIKE ANY(CAST(:prefixes AS varchar[])))
+            ))
+            OR (b.encoding = :encoding AND b.compression_level < :level)
+          )
+        ORDER BY b.sha256
+        LIMIT :limit
+    """), {
+        "after": after,
+        "days": settings.COMPRESSION_COLD_DAYS,
+        "min_size": settings.COMPRESSION_MIN_SIZE,
+        "types": sorted(compression.COMPRESSIBLE_TYPES),
+        "prefixes": [prefix + "%" for prefix in compression.COMPRESSIBLE_PREFIXES],
+        "encoding": compression.ENCODING,
+        "level": settings.COMPRESSION_COLD_LEVEL,
+        "limit": settings.COMPRESSION_COLD_BATCH,
+    })
+    rows = result.all()
+    await db.commit()
+    return rows
+
+
+# Chờ hết TTL cache rồi xóa bản nguyên, nếu blob vẫn đang ở dạng nén
+async def _drop_raw_later(hashes: list[str]):
+    await asyncio.sleep(settings.CONTENT_CACHE_TTL_SECONDS)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(text("""
+            SELECT sha256 FROM blobs WHERE sha256 = ANY(CAST(:hashes AS varchar[])) AND encoding = :encoding
+        """), {"hashes": hashes, "encoding": compression.ENCODING})
+        storage_gc.enqueue_blob_delete(result.scalars().all(), delay=0)
+
+
+async def run(dry_run: bool = False, drop_raw: bool = True) -> dict:
+    stats = {"compressed": 0, "recompressed": 0, "skipped": 0, "missing": 0, "bytes_before": 0, "bytes_after": 0}
+    superseded = []
+    after = ""
+    async with AsyncSessionLocal() as db:
+        while rows := await _candidates(db, after):
+            after = rows[-1].sha256
+            for row in rows:
+                if dry_run:
+                    stats["recompressed" if row.encoding else "compressed"] += 1
+                    continue
+                try:
+                    async with local_copy(None, None, row.sha256) as src_path:
+                        done = await compress_into_store(
+                            db, src_path, row.sha256, row.size_bytes, settings.COMPRESSION_COLD_LEVEL
+                        )
+                    await db.commit()
+                except FileNotFoundError:
+                    await db.rollback()
+                    stats["missing"] += 1
+                    continue
+                except Exception:
+                    await db.rollback()
+                    raise
+                if not done:
+                    stats["skipped"] += 1
+                    continue
+                result = await db.execute(text("SELECT stored_bytes FROM blobs WHERE sha256 = :sha256"),
+                                          {"sha256": row.sha256})
+                await db.commit()
+                stats["recompressed" if row.encoding else "compressed"] += 1
+                stats["bytes_before"] += row.size_bytes
+                stats["bytes_after"] += result.scalar_one_or_none() or 0
+                if not row.encoding:
+                    superseded.append(row.sha256)
+    if superseded and drop_raw:
+        task = asyncio.create_task(_drop_raw_later(superseded))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+    return stats
+
+
+async def _loop():
+    while True:
+        await asyncio.sleep(settings.COMPRESSION_COLD_INTERVAL_SECONDS)
+        try:
+            stats = await run()
+            if stats["compressed"] or stats["recompressed"]:
+                print(f"Cold compression: {stats}")
+        except Exception as e:
+            print(f"Cold compression error: {e}")
+
+
+# Gọi trong lifespan của app
+def start():
+    if not compression.available() or settings.COMPRESSION_COLD_INTERVAL_SECONDS <= 0:
+        return
+    task = asyncio.create_task(_loop())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+# Bản nguyên chưa kịp xóa khi tắt server thì GC reconcile dọn sau
+async def stop():
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+
+
+async def _main(args):
+    from app.db.base import engine
+    try:
+        if not compression.available():
+            raise SystemExit("Cần COMPRESSION_ENABLED=true và cài zstandard")
+        # Chạy tay: bản nguyên được GC reconcile xóa sau CONTENT_CACHE_TTL_SECONDS
+        stats = await run(dry_run=args.dry_run, drop_raw=False)
+        print(json.dumps({"dry_run": args.dry_run, **stats}, indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nén lại các blob cũ ở mức nén cao")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm, không nén")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,146 @@
+import bisect
+import struct
+import threading
+from collections import OrderedDict
+
+from app.core.config import settings
+
+# Nén blob khi lưu (COMPRESSION_ENABLED), định dạng zstd seekable
+# (https://github.com/facebook/zstd/blob/dev/contrib/seekable_format/zstd_seekable_compression_format.md):
+#   [frame zstd độc lập, mỗi frame COMPRESSION_FRAME_SIZE byte gốc] ... [seek table]
+# Seek table là 1 skippable frame nên file vẫn giải nén được bằng `zstd -d` thông thường,
+# và Range request chỉ cần giải nén các frame chứa đoạn được hỏi.
+# Cần cài zstandard; chưa cài thì blob được lưu nguyên bản như cũ.
+
+ENCODING = "zstd"
+KEY_SUFFIX = ".zst"
+
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+FOOTER = struct.Struct("<IBI") # số frame, descriptor, magic
+ENTRY = struct.Struct("<II") # kích thước nén, kích thước gốc
+CHECKSUM_FLAG = 0x80
+
+# Các loại nội dung nén tốt. Ảnh/video/âm thanh/zip... đã nén sẵn thì bỏ qua.
+COMPRESSIBLE_PREFIXES = ("text/",)
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/xml", "application/javascript", "application/x-ndjson",
+    "application/sql", "application/x-sh", "application/rtf", "application/x-tex",
+    "application/pdf", "application/postscript", "application/x-tar",
+    "application/msword", "application/vnd.ms-excel", "application/vnd.ms-powerpoint",
+    "application/vnd.oasis.opendocument.text-flat-xml",
+    "image/svg+xml", "image/bmp", "image/tiff", "image/x-portable-pixmap",
+}
+
+# Seek table của các blob vừa đọc (LRU): tua video / tải tiếp không phải đọc lại cuối file.
+# Được đọc từ các thread của disk-io/threadpool nên cần lock (khác TTLCache chỉ dùng trong event loop).
+SEEK_TABLE_CACHE_SIZE = 1024
+_seek_tables: OrderedDict = OrderedDict()
+_seek_lock = threading.Lock()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def available() -> bool:
+    return settings.COMPRESSION_ENABLED and _zstd() is not None
+
+
+def is_compressible(mime_type: str | None) -> bool:
+    if not mime_type:
+        return False
+    return mime_type in COMPRESSIBLE_TYPES or mime_type.startswith(COMPRESSIBLE_PREFIXES)
+
+
+def should_compress(mime_type: str | None, size: int) -> bool:
+    return available() and size >= settings.COMPRESSION_MIN_SIZE and is_compressible(mime_type)
+
+
+# Nén đáng giá khi tiết kiệm được ít nhất COMPRESSION_MIN_SAVINGS
+def worth_it(stored_size: int, size: int) -> bool:
+    return stored_size <= size * (1 - settings.COMPRESSION_MIN_SAVINGS)
+
+
+# Các hàm dưới đây đồng bộ (đọc/ghi + nén tốn CPU, zstandard nhả GIL), gọi qua run_io
+
+# Nén src (file-like) ra dest_path dạng seekable, trả về kích thước sau nén
+def compress_stream(src, dest_path: str, level: int) -> int:
+    cctx = _zstd().ZstdCompressor(level=level, write_checksum=True)
+    frame_size = settings.COMPRESSION_FRAME_SIZE
+    entries = []
+    with open(dest_path, "wb") as out:
+        while True:
+            chunk = src.read(frame_size)
+            if not chunk:
+                break
+            frame = cctx.compress(chunk)
+            out.write(frame)
+            entries.append((len(frame), len(chunk)))
+        table = b"".join(ENTRY.pack(c, d) for c, d in entries) + FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC)
+        out.write(struct.pack("<II", SKIPPABLE_MAGIC, len(table)))
+        out.write(table)
+        return out.tell()
+
+
+def compress_file(src_path: str, dest_path: str, level: int) -> int:
+    with open(src_path, "rb") as src:
+        return compress_stream(src, dest_path, level)
+
+
+# [(offset nén, size nén, offset gốc, size gốc)] của từng frame.
+# read_at(offset, length) -> bytes đọc từ blob đã nén (file local hoặc Range của S3)
+def seek_table(cache_key, read_at, stored_size: int) -> list[tuple[int, int, int, int]]:
+    # Nén lại (cùng key) thì kích thước đổi -> không dùng nhầm seek table cũ
+    key = (cache_key, stored_size)
+    with _seek_lock:
+        table = _seek_tables.get(key)
+        if table is not None:
+            _seek_tables.move_to_end(key)
+            return table
+
+    count, descriptor, magic = FOOTER.unpack(read_at(stored_size - FOOTER.size, FOOTER.size))
+    if magic != SEEKABLE_MAGIC:
+        raise ValueError(f"{cache_key}: không phải định dạng zstd seekable")
+    entry_size = ENTRY.size + (4 if descriptor & CHECKSUM_FLAG else 0)
+    raw = read_at(stored_size - FOOTER.size - count * entry_size, count * entry_size)
+    table = []
+    c_offset = d_offset = 0
+    for i in range(count):
+        c_size, d_size = ENTRY.unpack_from(raw, i * entry_size)
+        table.append((c_offset, c_size, d_offset, d_size))
+        c_offset += c_size
+        d_offset += d_size
+    with _seek_lock:
+        _seek_tables[key] = table
+        while len(_seek_tables) > SEEK_TABLE_CACHE_SIZE:
+            _seek_tables.popitem(last=False)
+    return table
+
+
+def content_size(table) -> int:
+    if not table:
+        return 0
+    _, _, d_offset, d_size = table[-1]
+    return d_offset + d_size
+
+
+# Giải nén đoạn [start, end] (tính cả end): chỉ đọc + giải nén các frame chứa đoạn này
+def read_range(table, read_at, start: int, end: int):
+    dctx = _zstd().ZstdDecompressor()
+    i = bisect.bisect_right([d_offset for _, _, d_offset, _ in table], start) - 1
+    for c_offset, c_size, d_offset, d_size in table[max(i, 0):]:
+        if d_offset > end:
+            break
+        data = dctx.decompress(read_at(c_offset, c_size), max_output_size=d_size)
+        yield data[max(0, start - d_offset):end - d_offset + 1]
+
+
+# File-like đọc tuần tự nội dung gốc (nén ZIP, tải về để tạo thumbnail).
+# Decoder của zstd tự bỏ qua skippable frame chứa seek table.
+def open_reader(fileobj):
+    return _zstd().ZstdDecompressor().stream_reader(fileobj, read_across_frames=True, closefd=True)
@@ -5,10 +5,107 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "Family Storage"
     API_V1_STR: str = "/api/v1"
     DATABASE_URL: str
+    # Replica chỉ đọc (streaming replication). Rỗng = mọi truy vấn vào DATABASE_URL.
+    # Các đường chỉ đọc (/list, /content, xác thực token) dùng replica, ghi luôn vào primary.
+    DATABASE_REPLICA_URL: str = ""
+
+    # Connection pool (mỗi process/worker 1 pool cho primary, 1 pool cho replica)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10 # Số kết nối mở thêm khi pool đã hết
+    DB_POOL_TIMEOUT: int = 30 # Chờ lấy kết nối quá số giây này thì lỗi
+    DB_POOL_RECYCLE: int = 1800 # Đóng kết nối đã mở quá số giây này (-1 = không), tránh bị proxy/firewall cắt
+    DB_POOL_PRE_PING: bool = True # Kiểm tra kết nối trước khi dùng (DB restart / failover)
+    # Cache prepared statement của asyncpg mỗi kết nối. Đặt 0 cả hai khi đi qua PgBouncer transaction mode.
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100 # Cache của SQLAlchemy
+    DB_STATEMENT_CACHE_SIZE: int = 100 # Cache nội bộ của asyncpg
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7 
 
+    # Mật khẩu: bcrypt chạy trên thread pool riêng, không chặn event loop
+    BCRYPT_ROUNDS: int = 12 # Đổi giá trị này thì hash cũ được tạo lại ở lần đăng nhập kế tiếp
+    PASSWORD_HASH_WORKERS: int = 2 # Số thread bcrypt chạy song song (mỗi lần ~100-300 ms CPU)
+    PASSWORD_HASH_QUEUE: int = 32 # Số job được xếp hàng thêm, vượt quá thì request phải chờ
+    LOGIN_MAX_CONCURRENT_PER_ACCOUNT: int = 2 # Đăng nhập song song vào cùng 1 tài khoản, vượt quá -> 429
+
+    # Cache user đã xác thực trong process (giảm truy vấn users trên mỗi request).
+    # Sửa/khóa/xóa user được báo qua LISTEN user_changes; TTL là giới hạn trên khi NOTIFY bị lỡ
+    # (listener mất kết nối, DB chưa có trigger) -> user bị khóa vẫn vào được tối đa TTL giây, giữ ngắn.
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_MAX_SIZE: int = 10000
+
+    # Cache metadata của /content (đường dẫn vật lý, ETag...) để request lặp lại không cần DB
+    CONTENT_CACHE_TTL_SECONDS: int = 300
+    CONTENT_CACHE_MAX_SIZE: int = 10000
+
+    # Cache nội dung file nhỏ hay mở của /content trong RAM (app.core.blobcache), mỗi worker 1 bản
+    BLOB_CACHE_BYTES: int = 128 * 1024 * 1024 # Tổng dung lượng tối đa (0 = tắt)
+    BLOB_CACHE_MAX_BLOB_BYTES: int = 4 * 1024 * 1024 # File lớn hơn không được cache
+    BLOB_CACHE_MIN_HITS: int = 2 # Số lần mở trước khi đưa vào cache
+
+    # Quota mặc định cho user chưa đặt users.quota_bytes (0 = không giới hạn)
+    DEFAULT_QUOTA_BYTES: int = 0
+
+    # Nơi lưu nội dung file (app.core.storage): "local" (storage/blobs) hoặc "s3"
+    STORAGE_BACKEND: str = "local"
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = "blobs/"
+    S3_ENDPOINT_URL: str = "" # Để trống = AWS; MinIO/dịch vụ tương thích: http://host:9000
+    S3_REGION: str = ""
+    S3_ACCESS_KEY: str = ""
+    S3_SECRET_KEY: str = ""
+
+    # Nén blob khi lưu (app.core.compression, cần cài zstandard), chọn theo MIME type lúc upload
+    COMPRESSION_ENABLED: bool = False
+    COMPRESSION_LEVEL: int = 3 # Mức nén lúc upload (nhanh)
+    COMPRESSION_FRAME_SIZE: int = 1024 * 1024 # Mỗi frame độc lập: Range chỉ giải nén tối đa thêm 1 frame mỗi đầu
+    COMPRESSION_MIN_SIZE: int = 4096 # File nhỏ hơn thì lưu nguyên
+    COMPRESSION_MIN_SAVINGS: float = 0.1 # Tiết kiệm dưới 10% thì lưu nguyên
+    # Job nén lại dữ liệu "nguội" (blob cũ hơn COLD_DAYS, kể cả blob có trước khi bật nén) ở mức nén cao hơn
+    COMPRESSION_COLD_LEVEL: int = 19
+    COMPRESSION_COLD_DAYS: int = 30
+    COMPRESSION_COLD_INTERVAL_SECONDS: int = 6 * 3600 # 0 = tắt
+    COMPRESSION_COLD_BATCH: int = 100 # Số blob mỗi lô query
+
+    # Upload: ghi đĩa chạy trên thread pool riêng, không chặn event loop
+    UPLOAD_BUFFER_SIZE: int = 1024 * 1024 # Kích thước mỗi lần đọc/ghi
+    UPLOAD_IO_WORKERS: int = 4 # Số thread ghi đĩa song song
+    UPLOAD_IO_QUEUE: int = 16 # Số job được xếp hàng thêm, vượt quá thì request phải chờ
+    UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024 # Chunk mặc định của upload session
+    UPLOAD_MAX_CHUNK_SIZE: int = 64 * 1024 * 1024
+    BULK_UPLOAD_MAX_FILES: int = 10000 # Số file tối đa trong 1 request upload hàng loạt (tar)
+    DELTA_WORKERS: int = 1 # Số process chia block (upload delta) cho file upload thường
+    FILE_VERSIONS_KEEP: int = 10 # Số bản cũ giữ lại cho mỗi file (upload delta / khôi phục)
+
+    # Copy file/folder: tổng dung lượng cần copy vật lý vượt ngưỡng này thì chạy job nền
+    COPY_INLINE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # API batch (đổi tên / di chuyển / xóa nhiều item): số thao tác tối đa mỗi request
+    BATCH_MAX_ITEMS: int = 1000
+
+    # Nhật ký thay đổi cho client đồng bộ delta (app.core.changes, GET /changes)
+    CHANGES_BATCH_SIZE: int = 500 # Số thay đổi tối đa mỗi lần đọc
+    CHANGES_MAX_WAIT_SECONDS: int = 60 # Long-poll: giữ request tối đa bấy nhiêu giây khi chưa có gì mới
+    CHANGES_RETENTION_DAYS: int = 30 # Cursor cũ hơn thì client phải /list lại từ đầu (410)
+
+    # GET /files/tree: cả cây con trong 1 request
+    TREE_MAX_ITEMS: int = 20000 # Số item tối đa mỗi lần, nhiều hơn thì đọc tiếp bằng next_cursor
+
+    # Thumbnail: số process tạo ảnh thu nhỏ, chất lượng JPEG
+    THUMBNAIL_WORKERS: int = 2
+    THUMBNAIL_QUALITY: int = 80
+
+    # Dọn rác ổ cứng chạy nền (app.core.storage_gc)
+    GC_UNLINK_RATE: int = 200 # Số file tối đa xóa mỗi giây
+    GC_UNLINK_BATCH: int = 100 # Số file mỗi lô xóa trên thread pool
+    GC_INTERVAL_SECONDS: int = 3600 # Chu kỳ đối soát đĩa với DB, 0 = tắt
+    GC_GRACE_SECONDS: int = 3600 # Chỉ dọn file cũ hơn ngưỡng này (tránh file đang ghi)
+    GC_TEMP_TTL_HOURS: int = 24 # Phiên upload / file tạm bỏ dở quá thời gian này thì xóa
+    GC_DRY_RUN: bool = False # Chỉ báo cáo, không xóa khi đối soát định kỳ
+
+    # Metrics (GET /metrics, định dạng Prometheus)
+    METRICS_ENABLED: bool = True
+
     model_config = ConfigDict(env_file=".env")
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import text
+
+from app.core.blobstore import local_copy, read_blob_range
+from app.core.config import settings
+
+# Upload delta: sửa vài trang của file 500 MB chỉ gửi lại các block bị đổi.
+# Nội dung được chia thành block theo nội dung (content-defined chunking, gear hash kiểu FastCDC),
+# nên chèn/xóa vài byte giữa file chỉ làm đổi 1-2 block quanh chỗ sửa, các block sau giữ nguyên
+# ranh giới (chia theo kích thước cố định thì mọi block sau chỗ chèn đều bị lệch).
+#
+# Thuật toán (client phải chia giống hệt, xem params()):
+#   GEAR[i] = 4 byte đầu (little-endian) của sha256(bytes([i])), lấy 30 bit thấp
+#   h = ((h << 1) + GEAR[byte]) & (2^30 - 1)   -> h chỉ phụ thuộc 30 byte gần nhất
+#   Mỗi block dài ít nhất MIN_SIZE byte; từ byte thứ MIN_SIZE trở đi, cắt ngay sau byte làm
+#   h < THRESHOLD; đủ MAX_SIZE byte thì cắt luôn. Block cuối file có thể ngắn hơn MIN_SIZE.
+#   Mã block = SHA-256 (hex) của nội dung block.
+#
+# Danh sách block của mỗi blob được lưu ở bảng blob_blocks: bản client upload delta thì lấy
+# luôn từ manifest client gửi, bản upload thường thì server tự chia (lần đầu có người hỏi tới).
+
+HASH_BITS = 30
+HASH_MASK = (1 << HASH_BITS) - 1
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") & HASH_MASK for i in range(256)]
+
+MIN_SIZE = 256 * 1024
+AVG_SIZE = 1024 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+THRESHOLD = (1 << HASH_BITS) // (AVG_SIZE - MIN_SIZE)
+
+READ_SIZE = 8 * 1024 * 1024
+
+_pool: ProcessPoolExecutor | None = None
+_inflight: dict[str, asyncio.Future] = {}
+
+
+# Tham số chia block cho client (GET /uploads/delta/params)
+def params() -> dict:
+    return {
+        "algorithm": "gear30",
+        "min_size": MIN_SIZE,
+        "avg_size": AVG_SIZE,
+        "max_size": MAX_SIZE,
+        "threshold": THRESHOLD,
+        "gear": GEAR,
+        "block_hash": "sha256",
+    }
+
+
+# Điểm cắt của block bắt đầu tại data[start], không vượt quá end
+def _next_cut(data: bytes, start: int, end: int) -> int:
+    first = start + MIN_SIZE - 1 # Byte cuối của block ngắn nhất
+    if first >= end:
+        return end
+    gear = GEAR
+    h = 0
+    # h chỉ phụ thuộc 30 byte gần nhất: bỏ qua phần đầu block, chỉ cần băm 29 byte trước `first`
+    for b in data[first - (HASH_BITS - 1):first]:
+        h = (h + h + gear[b]) & HASH_MASK
+    pos = first
+    for b in data[first:end]:
+        h = (h + h + gear[b]) & HASH_MASK
+        pos += 1
+        if h < THRESHOLD:
+            return pos
+    return end
+
+
+# Chia nội dung đọc tuần tự từ src: [(size, sha256)]. Tốn CPU (vòng lặp Python ~6 MB/s),
+# chạy trong process con (chunk_file)
+def chunk_stream(src) -> list[tuple[int, str]]:
+    blocks = []
+    buffer = b""
+    eof = False
+    while True:
+        if not eof and len(buffer) < MAX_SIZE:
+            data = src.read(READ_SIZE)
+            if data:
+                buffer += data
+            else:
+                eof = True
+            continue
+        if not buffer:
+            return blocks
+        cut = _next_cut(buffer, 0, min(len(buffer), MAX_SIZE))
+        blocks.append((cut, hashlib.sha256(buffer[:cut]).hexdigest()))
+        buffer = buffer[cut:]
+
+
+def chunk_file(path: str) -> list[tuple[int, str]]:
+    with open(path, "rb") as src:
+        return chunk_stream(src)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: không fork cả process server (đang có nhiều thread)
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.DELTA_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# [(offset, size, block_hash)] theo thứ tự, None nếu blob chưa được chia block
+async def get_manifest(db, blob_hash: str) -> list[tuple[int, int, str]] | None:
+    result = await db.execute(text("""
+        SELECT offset_bytes, size_bytes, block_hash FROM blob_blocks WHERE blob_hash = :blob_hash ORDER BY idx
+    """), {"blob_hash": blob_hash})
+    rows = [tuple(row) for row in result.all()]
+    return rows or None
+
+
+# Lưu danh sách block [(size, block_hash)] của blob (không commit). Đã có thì giữ bản cũ.
+async def save_manifest(db, blob_hash: str, blocks: list[tuple[int, str]]):
+    if not blocks:
+        return
+    # Khóa dòng blob: 2 lần lưu song song (ranh giới block có thể khác nhau) không bị trộn lẫn
+    result = await db.execute(text("SELECT 1 FROM blobs WHERE sha256 = :blob_hash FOR UPDATE"), {"blob_hash": blob_hash})
+    if result.first() is None:
+        return
+    offsets = []
+    offset = 0
+    for size, _ in blocks:
+        offsets.append(offset)
+        offset += size
+    await db.execute(text("""
+        INSERT INTO blob_blocks (blob_hash, idx, offset_bytes, size_bytes, block_hash)
+        SELECT CAST(:blob_hash AS varchar), b.n - 1, b.offset_bytes, b.size_bytes, b.block_hash
+        FROM unnest(CAST(:offsets AS bigint[]), CAST(:sizes AS integer[]), CAST(:hashes AS varchar[]))
+            WITH ORDINALITY AS b(offset_bytes, size_bytes, block_hash, n)
+        WHERE NOT EXISTS (SELECT 1 FROM blob_blocks WHERE blob_hash = CAST(:blob_hash AS varchar))
+    """), {
+        "blob_hash": blob_hash,
+        "offsets": offsets,
+        "sizes": [size for size, _ in blocks],
+        "hashes": [block_hash for _, block_hash in blocks],
+    })
+
+
+async def _compute_manifest(blob_hash: str):
+    from app.db.base import AsyncSessionLocal
+
+    # Blob nén / ở backend từ xa được giải nén ra file tạm trước
+    async with local_copy(None, None, blob_hash) as src_path:
+        loop = asyncio.get_running_loop()
+        blocks = await loop.run_in_executor(_get_pool(), chunk_file, src_path)
+    async with AsyncSessionLocal() as db:
+        await save_manifest(db, blob_hash, blocks)
+        await db.commit()
+
+
+# Danh sách block của blob, tự chia nếu chưa có (file lớn lần đầu mất vài chục giây).
+# Nhiều request cùng lúc cho cùng blob chỉ chia 1 lần. FileNotFoundError nếu mất blob.
+async def ensure_manifest(db, blob_hash: str) -> list[tuple[int, int, str]]:
+    manifest = await get_manifest(db, blob_hash)
+    if manifest is not None:
+        return manifest
+    await db.commit() # Không giữ kết nối trong lúc chờ chia block
+
+    future = _inflight.get(blob_hash)
+    if future is None:
+        future = asyncio.ensure_future(_compute_manifest(blob_hash))
+        _inflight[blob_hash] = future
+        future.add_done_callback(lambda _: _inflight.pop(blob_hash, None))
+    await asyncio.shield(future)
+    return await get_manifest(db, blob_hash) or []
+
+
+# {block_hash: (blob_hash, offset, size)} của các block đã có trong những blob này.
+# Block có ở nhiều blob thì lấy từ blob đứng trước trong blob_hashes (bản hiện tại: đọc liền mạch hơn).
+async def find_blocks(db, blob_hashes: list[str], block_hashes: list[str]) -> dict[str, tuple[str, int, int]]:
+    if not blob_hashes or not block_hashes:
+        return {}
+    result = await db.execute(text("""
+        SELECT DISTINCT ON (block_hash) block_hash, blob_hash, offset_bytes, size_bytes FROM blob_blocks
+        WHERE blob_hash = ANY(CAST(:blob_hashes AS varchar[])) AND block_hash = ANY(CAST(:block_hashes AS varchar[]))
+        ORDER BY block_hash, array_position(CAST(:blob_hashes AS varchar[]), blob_hash)
+    """), {"blob_hashes": blob_hashes, "block_hashes": list(set(block_hashes))})
+    return {block_hash: (blob_hash, offset, size) for block_hash, blob_hash, offset, size in result.all()}
+
+
+# Kế hoạch ghép bản mới: [(nguồn, offset, size, block_hash)]
+# nguồn = sha256 blob đã có (đọc đoạn [offset, offset + size)), None = file dữ liệu client gửi lên.
+# Block có trong blob cũ nằm liền nhau được gộp thành 1 lần đọc. Block chưa có được gửi 1 lần
+# (lần xuất hiện đầu tiên, theo thứ tự manifest), các lần lặp lại đọc lại từ file dữ liệu.
+# Kích thước client khai cho block đã có phải khớp blob_blocks (ValueError nếu sai), block gửi lên
+# được assemble() kiểm tra SHA-256. Trả về (kế hoạch, số byte client phải gửi, danh sách block
+# [(size, block_hash)] của bản mới để lưu làm manifest, chỉ dùng kích thước đã kiểm tra).
+def plan_assembly(blocks: list[tuple[str, int]], available: dict[str, tuple[str, int, int]]) -> tuple[list, int, list]:
+    plan = []
+    layout = []
+    uploaded = {}
+    data_size = 0
+    for block_hash, size in blocks:
+        if block_hash in available:
+            source, offset, known_size = available[block_hash]
+            if size != known_size:
+                raise ValueError(f"Block {block_hash} dài {known_size} byte, không phải {size}")
+            last = plan[-1] if plan else None
+            if last and last[0] == source and last[3] is None and last[1] + last[2] == offset:
+                plan[-1] = (source, last[1], last[2] + size, None)
+            else:
+                plan.append((source, offset, size, None))
+        elif block_hash in uploaded:
+            offset, known_size = uploaded[block_hash]
+            if size != known_size:
+                raise ValueError(f"Block {block_hash} dài {known_size} byte, không phải {size}")
+            plan.append((None, offset, size, None))
+        else:
+            uploaded[block_hash] = (data_size, size)
+            plan.append((None, data_size, size, block_hash))
+            data_size += size
+        layout.append((size, block_hash))
+    return plan, data_size, layout
+
+
+# Ghép bản mới vào dest_path theo kế hoạch, kiểm tra SHA-256 từng block client gửi.
+# Hàm đồng bộ, gọi qua run_io. Trả về (size, sha256 cả file).
+def assemble(plan: list, data, dest_path: str) -> tuple[int, str]:
+    hasher = hashlib.sha256()
+    size = 0
+    with open(dest_path, "wb") as out:
+        for source, offset, length, block_hash in plan:
+            if source is None:
+                data.seek(offset)
+                block = data.read(length)
+                if len(block) != length:
+                    raise ValueError("Dữ liệu block gửi lên bị thiếu")
+                if block_hash is not None and hashlib.sha256(block).hexdigest() != block_hash:
+                    raise ValueError(f"Block {block_hash} không khớp SHA-256")
+                pieces = (block,)
+            else:
+                pieces = read_blob_range(source, offset, offset + length - 1)
+            written = 0
+            for piece in pieces:
+                hasher.update(piece)
+                out.write(piece)
+                written += len(piece)
+            if written != length:
+                raise ValueError(f"Blob {source} thiếu dữ liệu block")
+            size += written
+    return size, hasher.hexdigest()
@@ -1,35 +1,88 @@
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
 from fastapi import Depends, HTTPException, status, Request # <-- Thêm Request
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, event
 
 from app.core.config import settings
-from app.db.base import get_db
+from app.core.cache import TTLCache
+from app.db.base import has_replica, AsyncSessionLocal, ReadSessionLocal
 from app.db.models import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/token", auto_error=False)
 
+# Thông tin user gọn nhẹ, không gắn với session DB (an toàn khi cache giữa các request)
+@dataclass(frozen=True)
+class CurrentUser:
+    id: UUID
+    email: str
+    username: str
+    root_folder_id: UUID | None
+    is_active: bool
+
+    @classmethod
+    def from_model(cls, user: User) -> "CurrentUser":
+        return cls(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            root_folder_id=user.root_folder_id,
+            is_active=user.is_active,
+        )
+
+# Cache token đã xác thực -> CurrentUser. Video player gửi hàng chục Range request
+# tới /content: chỉ request đầu tiên phải decode JWT + SELECT users.
+_user_cache = TTLCache(maxsize=settings.AUTH_CACHE_MAX_SIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+
+def invalidate_user(user_id):
+    user_id = str(user_id)
+    _user_cache.delete_where(lambda _, user: str(user.id) == user_id)
+
+def clear_user_cache():
+    _user_cache.clear()
+
+def auth_cache_stats() -> dict:
+    return _user_cache.stats()
+
+# User bị sửa/khóa/xóa qua ORM -> bỏ khỏi cache ngay trong worker này. Worker khác, SQL tay...
+# nhận qua NOTIFY user_changes (trigger trên users, xem app/core/changes.py).
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _on_user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
+def _get_token(request: Request, token_in_header: str | None) -> str | None:
+    # 1. Ưu tiên lấy Token từ Header (Authorization: Bearer ...)
+    # 2. Nếu không có, lấy từ URL Query (?token=...)
+    return token_in_header or request.query_params.get("token")
+
 async def get_current_user(
     request: Request, # <-- Thêm biến request
     token_in_header: str | None = Depends(oauth2_scheme), # Cho phép Null
-    db: AsyncSession = Depends(get_db)
-) -> User:
-    
-    credentials_exception = HTTPException(
+) -> CurrentUser:
+    token = _get_token(request, token_in_header)
+
+    if not token:
+        raise _credentials_exception()
+    return await authenticate_token(token)
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    # --- LOGIC MỚI ---
-    # 1. Ưu tiên lấy Token từ Header (Authorization: Bearer ...)
-    # 2. Nếu không có, lấy từ URL Query (?token=...)
-    token = token_in_header or request.query_params.get("token")
+# Dùng chung cho HTTP và WebSocket (không có Request): HTTPException 401 nếu token không hợp lệ
+async def authenticate_token(token: str) -> CurrentUser:
+    credentials_exception = _credentials_exception()
 
-    if not token:
-        raise credentials_exception
-    # -----------------
+    cached = _user_cache.get(token)
+    if cached is not None:
+        return cached
 
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
@@ -38,10 +91,22 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-        
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
-    
-    if user is None:
+
+    # Cache miss: chỉ lúc này mới mở session DB (replica nếu có)
+    async with ReadSessionLocal() as db:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+    if user is None and has_replica():
+        # User vừa đăng ký có thể chưa sang tới replica
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(User).where(User.id == user_id))
+            user = result.scalar_one_or_none()
+
+    if user is None or not user.is_active:
         raise credentials_exception
-    return user
\ No newline at end of file
+
+    current_user = CurrentUser.from_model(user)
+    # Không giữ trong cache lâu hơn thời hạn của token
+    expires_in = payload.get("exp", 0) - time.time() if payload.get("exp") else settings.AUTH_CACHE_TTL_SECONDS
+    _user_cache.set(token, current_user, ttl=expires_in)
+    return current_user
@@ -0,0 +1,33 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+
+# Thread pool riêng cho việc đọc/ghi file lớn (upload, gộp chunk...)
+_executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_IO_WORKERS, thread_name_prefix="disk-io")
+
+# Backpressure: khi ổ cứng quá tải, job mới phải chờ (await) ở đây thay vì
+# dồn hàng vô hạn trong executor. Event loop vẫn phục vụ các request khác.
+_slots = asyncio.Semaphore(settings.UPLOAD_IO_WORKERS + settings.UPLOAD_IO_QUEUE)
+
+# Cho /metrics: số job đã vào executor (đang chạy + xếp hàng) và số job đang chờ slot
+_stats = {"admitted": 0, "waiting": 0}
+
+
+def io_stats() -> dict:
+    return dict(_stats)
+
+
+async def run_io(fn, *args):
+    _stats["waiting"] += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _stats["waiting"] -= 1
+    _stats["admitted"] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, fn, *args)
+    finally:
+        _stats["admitted"] -= 1
+        _slots.release()
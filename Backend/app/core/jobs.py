@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+
+import uuid6
+
+# Job nền chạy trong process (copy folder lớn...), client hỏi tiến độ qua job_id.
+# Job đã xong được giữ lại JOB_RETENTION_SECONDS để client kịp đọc kết quả.
+# Danh sách job nằm trong RAM của từng worker: chạy nhiều worker (uvicorn --workers N) thì
+# GET /files/jobs/{id} chỉ thấy job nếu rơi đúng worker đã tạo -> API job cần 1 worker
+# (hoặc sticky session theo user). Job dừng giữa chừng khi restart không để lại dữ liệu dở:
+# copy chỉ commit khi mọi file đã nằm trên đĩa.
+JOB_RETENTION_SECONDS = 3600
+
+
+@dataclass
+class Job:
+    owner_id: str
+    kind: str
+    total_bytes: int = 0
+    total_items: int = 0
+    id: str = field(default_factory=lambda: str(uuid6.uuid7()))
+    status: str = "running" # running | completed | failed
+    done_bytes: int = 0
+    done_items: int = 0
+    result: dict | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    # advance() được gọi từ thread disk-io (callback tiến độ của copy_file)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def advance(self, nbytes: int = 0, items: int = 0):
+        with self._lock:
+            self.done_bytes += nbytes
+            self.done_items += items
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            done_bytes, done_items = self.done_bytes, self.done_items
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total_bytes": self.total_bytes,
+            "done_bytes": done_bytes,
+            "total_items": self.total_items,
+            "done_items": done_items,
+            "progress": done_bytes / self.total_bytes if self.total_bytes else (1.0 if self.status == "completed" else 0.0),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+_jobs: dict[str, Job] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def _prune():
+    now = time.time()
+    for job_id in [j.id for j in _jobs.values() if j.finished_at and now - j.finished_at > JOB_RETENTION_SECONDS]:
+        del _jobs[job_id]
+
+
+def create_job(owner_id, kind: str, total_bytes: int = 0, total_items: int = 0) -> Job:
+    _prune()
+    job = Job(owner_id=str(owner_id), kind=kind, total_bytes=total_bytes, total_items=total_items)
+    _jobs[job.id] = job
+    return job
+
+
+def get_job(job_id: str, owner_id) -> Job | None:
+    job = _jobs.get(job_id)
+    if job is None or job.owner_id != str(owner_id):
+        return None
+    return job
+
+
+# Chạy coroutine work(job) dưới nền, cập nhật trạng thái job khi xong/lỗi
+def start_job(job: Job, work):
+    async def runner():
+        try:
+            await work(job)
+            job.status = "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    task = asyncio.create_task(runner())
+    # Giữ tham chiếu để task không bị garbage collect giữa chừng
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
@@ -0,0 +1,268 @@
+import bisect
+import contextvars
+import time
+from contextlib import contextmanager
+
+# Metrics kiểu Prometheus (text exposition format 0.0.4), tự cài đặt cho gọn nhẹ:
+# mỗi lần ghi chỉ là vài phép cộng trên dict. Chỉ cập nhật từ thread của event loop
+# (middleware, event của SQLAlchemy async, code trong handler) nên không cần lock.
+#   GET /metrics -> render()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    # callback: hàm trả về {labels tuple: giá trị}, gọi lúc scrape (VD đọc trạng thái pool)
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> list[str]:
+        values = self._callback() if self._callback else self._values
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple, list] = {} # labels -> [đếm theo bucket..., +Inf, sum]
+
+    def observe(self, *labels, value: float):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        # Lưu số đếm riêng từng bucket, lúc render mới cộng dồn
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*labels, value=time.perf_counter() - start)
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, entry in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(entry[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+_registry: list[_Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Các metric của app ---
+
+http_requests = Counter("http_requests_total", "Số request HTTP", ("method", "route", "status"))
+http_duration = Histogram("http_request_duration_seconds", "Thời gian xử lý request (tới byte cuối)", ("method", "route"))
+http_request_bytes = Counter("http_request_bytes_total", "Số byte body nhận vào", ("route",))
+http_response_bytes = Counter("http_response_bytes_total", "Số byte body gửi ra", ("route",))
+http_in_flight = Gauge("http_requests_in_flight", "Số request đang xử lý")
+
+db_query_duration = Histogram("db_query_duration_seconds", "Thời gian mỗi câu SQL", ("operation",))
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "Số câu SQL trong 1 request", ("route",), buckets=COUNT_BUCKETS
+)
+db_errors = Counter("db_errors_total", "Số câu SQL lỗi", ("operation",))
+db_pool_wait = Histogram("db_pool_wait_seconds", "Thời gian chờ lấy kết nối từ pool (tính cả mở kết nối mới)", ("pool",))
+
+stage_duration = Histogram("stage_duration_seconds", "Thời gian từng bước trong upload/merge/zip...", ("stage",))
+stage_bytes = Counter("stage_bytes_total", "Số byte xử lý ở từng bước", ("stage",))
+
+
+# Đo 1 bước (dùng được cả trong hàm async: with stage("upload.write"): await ...)
+def stage(name: str):
+    return stage_duration.time(name)
+
+
+# Bọc iterator đồng bộ của StreamingResponse (VD nén ZIP): mỗi khúc vẫn chạy trên threadpool
+# như Starlette làm, còn thời gian + số byte được ghi lại trên event loop khi stream kết thúc.
+# Thời gian tính cả lúc chờ client đọc.
+async def timed_stream(name: str, iterator):
+    from starlette.concurrency import iterate_in_threadpool
+
+    start = time.perf_counter()
+    total = 0
+    try:
+        async for chunk in iterate_in_threadpool(iterator):
+            total += len(chunk)
+            yield chunk
+    finally:
+        stage_duration.observe(name, value=time.perf_counter() - start)
+        stage_bytes.inc(name, amount=total)
+
+
+# Gauge đọc trạng thái lúc scrape: đăng ký 1 hàm trả về số (hoặc dict labels -> số)
+def register_gauge(name: str, documentation: str, read, labelnames=()):
+    def callback():
+        value = read()
+        return value if isinstance(value, dict) else {(): value}
+    return Gauge(name, documentation, labelnames, callback=callback)
+
+
+# --- Đếm số query theo request ---
+# Middleware đặt 1 bộ đếm vào contextvar, event của engine cộng vào.
+
+_request_queries: contextvars.ContextVar[list | None] = contextvars.ContextVar("request_queries", default=None)
+
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+# Gắn vào engine (sync_engine của AsyncEngine), gọi trong app/db/base.py
+def instrument_engine(sync_engine):
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        db_query_duration.observe(_operation(statement), value=time.perf_counter() - start)
+        counter = _request_queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        db_errors.inc(_operation(context.statement or ""))
+
+
+# Nhãn theo template route ("/api/v1/files/content/{file_id}") để không bùng nổ số series.
+# FastAPI thường chép route khi include_router nên path_format đã gồm prefix của router; bản mới
+# (include lười) lại đặt vào scope["route"] route gốc với path tương đối ("/content/{file_id}").
+# Cắt ở cuối URL thật số đoạn "/" bằng template rồi ghép lại thì đúng cả hai trường hợp (template
+# đầy đủ -> phần cắt ra rỗng). App không có route nào dùng {x:path} nên mỗi tham số đúng 1 đoạn.
+def route_label(scope) -> str:
+    path_format = getattr(scope.get("route"), "path_format", None)
+    if not path_format:
+        return "unmatched"
+    prefix = scope["path"].rsplit("/", path_format.count("/"))[0]
+    return prefix + path_format
+
+
+# --- Middleware ASGI (không dùng BaseHTTPMiddleware để không làm hỏng streaming) ---
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+        sizes = [0, 0] # byte nhận, byte gửi
+        queries = [0]
+        token = _request_queries.set(queries)
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            http_in_flight.dec()
+            _request_queries.reset(token)
+            route = route_label(scope)
+            method = scope["method"]
+            http_requests.inc(method, route, str(status[0]))
+            http_duration.observe(method, route, value=time.perf_counter() - start)
+            http_request_bytes.inc(route, amount=sizes[0])
+            http_response_bytes.inc(route, amount=sizes[1])
+            db_queries_per_request.observe(route, value=queries[0])
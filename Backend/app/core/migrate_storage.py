@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from sqlalchemy import text
+
+from app.core import compression
+from app.core.blobstore import legacy_path, new_temp_path, hash_file, copy_file, prepare_blob, store_blob, acquire_blob
+from app.core.diskio import run_io
+from app.core.storage import BLOB_BASE, LocalBackend, backend
+from app.db.base import AsyncSessionLocal
+
+# Chuyển dữ liệu sang layout mới trong lúc server vẫn chạy:
+# - legacy: file cũ storage/completed/<owner_id>/<file_id> (mỗi user 1 thư mục phẳng, có thể
+#   tới hàng trăm nghìn entry) -> blob trong storage backend (chia shard theo hash, nội dung
+#   trùng thì dùng chung). Mỗi file là 1 transaction ngắn. File gốc được giữ lại, GC reconcile
+#   xóa sau (request đang đọc / /content đang cache đường dẫn cũ vẫn đọc được).
+#   Chạy lại bao nhiêu lần cũng được: chỉ xử lý file còn blob_hash IS NULL.
+# - copy-blobs: chép storage/blobs (local) sang backend đang cấu hình (VD S3). Chạy khi server
+#   còn dùng local, đổi STORAGE_BACKEND + restart, rồi chạy lại 1 lần để chép nốt blob mới.
+#
+#   python -m app.core.migrate_storage legacy --dry-run
+#   python -m app.core.migrate_storage legacy --rate 50
+#   STORAGE_BACKEND=s3 python -m app.core.migrate_storage copy-blobs
+
+BATCH_SIZE = 500
+
+
+async def _migrate_file(db, row, dry_run: bool, stats: dict):
+    src = legacy_path(row.owner_id, row.id)
+    try:
+        size, sha256 = await run_io(hash_file, src)
+    except FileNotFoundError:
+        stats["missing"] += 1
+        return
+    if size != (row.size_bytes or 0):
+        # Không tự sửa size_bytes (lệch bộ đếm dung lượng của user) -> để người quản trị xem
+        stats["size_mismatch"] += 1
+        print(f"Bỏ qua {row.id}: size_bytes={row.size_bytes} nhưng file trên đĩa {size} bytes")
+        return
+
+    result = await db.execute(text("SELECT 1 FROM blobs WHERE sha256 = :sha256"), {"sha256": sha256})
+    exists = result.first() is not None
+    await db.commit()
+    if dry_run:
+        stats["deduplicated" if exists else "migrated"] += 1
+        stats["bytes"] += 0 if exists else size
+        return
+
+    # GC reconcile tính hạn xóa file gốc theo mtime: đặt lại mtime trước khi commit để file còn
+    # ít nhất GC_GRACE_SECONDS (> CONTENT_CACHE_TTL_SECONDS) cho cache /content đang trỏ tới nó
+    try:
+        await run_io(os.utime, src)
+    except FileNotFoundError:
+        stats["missing"] += 1
+        return
+
+    # Chép ra file tạm trước khi mở transaction (reflink nếu FS hỗ trợ): không giữ khóa
+    # trong lúc copy, file gốc vẫn còn cho các request đang đọc
+    temp_path = None
+    if not exists:
+        temp_path = new_temp_path()
+        await run_io(copy_file, src, temp_path)
+        blob = await prepare_blob(temp_path, sha256, size, row.mime_type)
+
+    try:
+        if temp_path:
+            await store_blob(db, blob)
+        elif await acquire_blob(db, sha256) is None:
+            # Blob vừa bị GC xóa -> để lần chạy sau
+            await db.rollback()
+            stats["skipped"] += 1
+            return
+        result = await db.execute(text("""
+            UPDATE files SET blob_hash = :sha256
+            WHERE id = :id AND blob_hash IS NULL
+            RETURNING id
+        """), {"sha256": sha256, "id": row.id})
+        if result.first() is None:
+            # File đã bị xóa / đã chuyển trong lúc hash. Blob mới (nếu có) thành blob mồ côi, GC dọn.
+            await db.rollback()
+            stats["skipped"] += 1
+            return
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    stats["deduplicated" if exists else "migrated"] += 1
+    stats["bytes"] += 0 if exists else size
+
+
+async def migrate_legacy(dry_run: bool = False, rate: float = 0) -> dict:
+    stats = {"migrated": 0, "deduplicated": 0, "bytes": 0, "missing": 0, "size_mismatch": 0, "skipped": 0}
+    last_id = None
+    async with AsyncSessionLocal() as db:
+        while True:
+            # Keyset theo id: file được chuyển xong không quay lại trong kết quả
+            params = {"limit": BATCH_SIZE}
+            after = ""
+            if last_id is not None:
+                after = "AND id > :last_id"
+                params["last_id"] = last_id
+            result = await db.execute(text(f"""
+                SELECT id, owner_id, size_bytes, mime_type FROM files
+                WHERE type = 'file' AND blob_hash IS NULL {after}
+                ORDER BY id LIMIT :limit
+            """), params)
+            rows = result.all()
+            await db.commit()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            for row in rows:
+                started = time.monotonic()
+                await _migrate_file(db, row, dry_run, stats)
+                if rate > 0:
+                    await asyncio.sleep(max(0.0, 1 / rate - (time.monotonic() - started)))
+    return stats
+
+
+async def copy_blobs(dry_run: bool = False, delete_source: bool = False) -> dict:
+    if isinstance(backend, LocalBackend):
+        raise SystemExit("STORAGE_BACKEND đang là local, không có gì để chép")
+    source = LocalBackend(BLOB_BASE)
+    stats = {"copied": 0, "present": 0, "bytes": 0}
+    batches = source.scan(time.time())
+    while (batch := await run_io(next, batches, None)) is not None:
+        for key, size in batch:
+            # <sha256> hoặc <sha256>.zst (blob đã nén)
+            if len(key.removesuffix(compression.KEY_SUFFIX)) != 64:
+                continue
+            if await run_io(backend.exists, key):
+                stats["present"] += 1
+            elif dry_run:
+                stats["copied"] += 1
+                stats["bytes"] += size
+                continue
+            else:
+                # put() nhận file tạm (chuyển đi / xóa sau khi ghi), bản local giữ nguyên
+                temp_path = new_temp_path()
+                await run_io(copy_file, source.local_path(key), temp_path)
+                await run_io(backend.put, key, temp_path)
+                stats["copied"] += 1
+                stats["bytes"] += size
+            if delete_source and not dry_run:
+                await run_io(source.delete, key)
+    return stats
+
+
+async def _main(args):
+    from app.db.base import engine
+    try:
+        if args.command == "legacy":
+            stats = await migrate_legacy(dry_run=args.dry_run, rate=args.rate)
+        else:
+            stats = await copy_blobs(dry_run=args.dry_run, delete_source=args.delete_source)
+        print(json.dumps({"command": args.command, "dry_run": args.dry_run, **stats}, indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyển dữ liệu trong storage/ sang layout / backend mới")
+    parser.add_argument("command", choices=["legacy", "copy-blobs"])
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ đếm, không chép / sửa gì")
+    parser.add_argument("--rate", type=float, default=0, help="legacy: số file tối đa mỗi giây (0 = không giới hạn)")
+    parser.add_argument("--delete-source", action="store_true", help="copy-blobs: xóa bản local sau khi đã có trên backend")
+    asyncio.run(_main(parser.parse_args()))
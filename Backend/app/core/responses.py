@@ -0,0 +1,104 @@
+import uuid
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+import orjson
+from fastapi import Response
+
+try:
+    import msgpack
+except ImportError: # Tùy chọn: chưa cài thì client xin msgpack vẫn nhận JSON
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    # Giống Starlette FileResponse: tên có ký tự Unicode thì dùng filename*
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+# So khớp If-None-Match (so sánh yếu theo RFC 9110: bỏ qua tiền tố W/)
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+# Client đã có bản mới nhất -> trả 304, không cần đọc đĩa.
+# If-None-Match được ưu tiên, chỉ xét If-Modified-Since khi không có If-None-Match.
+def is_not_modified(request_headers, etag: str, last_modified: float) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Header HTTP chỉ chính xác tới giây
+        return int(last_modified) <= since
+    return False
+
+
+# Header Range 1 đoạn: "bytes=a-b", "bytes=a-", "bytes=-n" -> (start, end), tính cả end.
+# None = gửi cả file (không có Range, nhiều đoạn hoặc sai cú pháp -> bỏ qua như RFC 9110 cho phép).
+# ValueError nếu đoạn nằm ngoài file (416).
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, sep, last = range_header[6:].strip().partition("-")
+    if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:
+        # "bytes=-n": n byte cuối
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Range nằm ngoài file")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise ValueError("Range nằm ngoài file")
+    return start, min(end, size - 1)
+
+
+# Client xin msgpack trong Accept (bỏ qua loại có q=0)
+def accepts_msgpack(accept: str | None) -> bool:
+    for part in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if media_type.lower() in MSGPACK_TYPES and not any(p.replace(" ", "") in ("q=0", "q=0.0") for p in params):
+            return True
+    return False
+
+
+# UUID của asyncpg không phải đúng kiểu uuid.UUID nên orjson cũng cần hàm này
+def _default(value):
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Không mã hóa được {type(value).__name__}")
+
+
+# Trả payload (dict/list/tuple, UUID, datetime giữ nguyên) theo Accept: msgpack nếu client xin
+# (và đã cài msgpack), còn lại JSON qua orjson (nhanh hơn nhiều so với json + jsonable_encoder).
+# UUID -> chuỗi, datetime -> isoformat() như list_row.
+def negotiated_response(request_headers, payload) -> Response:
+    headers = {"vary": "accept"}
+    if msgpack is not None and accepts_msgpack(request_headers.get("accept")):
+        body = msgpack.packb(payload, default=_default)
+        return Response(body, media_type="application/msgpack", headers=headers)
+    return Response(orjson.dumps(payload, default=_default), media_type="application/json", headers=headers)
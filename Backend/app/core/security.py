@@ -1,16 +1,40 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.core import metrics
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min = max = BCRYPT_ROUNDS: hash có cost khác (đổi cấu hình) bị coi là cũ -> tạo lại khi đăng nhập
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt tốn 100-300 ms CPU mỗi lần (thư viện bcrypt nhả GIL khi tính): chạy trên thread pool
+# riêng để 1 lượt đăng nhập không làm khựng các stream video đang phát.
+# Giới hạn số job giống app.core.diskio: đăng nhập dồn dập thì phải chờ, không dồn hàng vô hạn.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def _run_hash(fn, *args):
+    async with _hash_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, fn, *args)
+
+async def hash_password(password: str) -> str:
+    with metrics.stage("password.hash"):
+        return await _run_hash(pwd_context.hash, password)
+
+# (đúng mật khẩu?, hash mới nếu hash cũ không còn theo cấu hình hiện tại)
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    with metrics.stage("password.verify"):
+        return await _run_hash(pwd_context.verify_and_update, plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -21,4 +45,4 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
\ No newline at end of file
+    return encoded_jwt
@@ -0,0 +1,258 @@
+import os
+import shutil
+from contextlib import contextmanager
+from functools import partial
+
+from app.core.config import settings
+
+# Nơi cất nội dung blob (key = sha256). Router và các module khác không tự ghép đường dẫn
+# storage/... mà đi qua `backend` (hoặc các hàm trong app.core.blobstore dùng nó).
+# - local: storage/blobs/<ab>/<cd>/<sha256>, chia 2 tầng theo prefix của hash (65536 thư mục)
+#   nên không thư mục nào phình to dù 1 user có hàng trăm nghìn file.
+# - s3: bucket S3 hoặc dịch vụ tương thích (MinIO...), object <S3_PREFIX><ab>/<cd>/<sha256>.
+#   Prefix theo hash cũng rải đều tải giữa các partition của S3. Cần cài boto3.
+# Các hàm đều đồng bộ (đọc/ghi đĩa hoặc mạng), gọi qua app.core.diskio.run_io.
+
+BLOB_BASE = "storage/blobs"
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def shard_key(sha256: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def _read_file_range(f, start: int, end: int):
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self, root: str = BLOB_BASE):
+        self.root = root
+
+    # Đường dẫn đọc trực tiếp (FileResponse, sendfile...). Backend từ xa trả về None.
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *shard_key(key).split("/"))
+
+    # Đưa file tạm vào kho (file tạm bị chuyển đi / xóa; keep=True: giữ lại file tạm)
+    def put(self, key: str, src_path: str, keep: bool = False):
+        dest = self.local_path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if not keep:
+            os.replace(src_path, dest)
+            return
+        # Hard link: không copy dữ liệu (file tạm và kho cùng filesystem).
+        # Đã có (upload song song cùng nội dung) thì giữ bản cũ: nội dung giống hệt.
+        try:
+            os.link(src_path, dest)
+        except FileExistsError:
+            pass
+        except OSError:
+            copy_path = f"{src_path}.copy"
+            shutil.copyfile(src_path, copy_path)
+            os.replace(copy_path, dest)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    # (size, mtime); FileNotFoundError nếu không có
+    def stat(self, key: str) -> tuple[int, float]:
+        st = os.stat(self.local_path(key))
+        return st.st_size, st.st_mtime
+
+    def open(self, key: str):
+        return open(self.local_path(key), "rb")
+
+    # Đọc đoạn [start, end] (tính cả end) theo từng khúc
+    def read_range(self, key: str, start: int, end: int):
+        with self.open(key) as f:
+            yield from _read_file_range(f, start, end)
+
+    def read_at(self, key: str, offset: int, length: int) -> bytes:
+        with self.open_random(key) as read_at:
+            return read_at(offset, length)
+
+    # read_at(offset, length) đọc nhiều lần trên cùng 1 file đang mở:
+    # key bị ghi đè (os.replace) giữa chừng thì vẫn đọc bản cũ
+    @contextmanager
+    def open_random(self, key: str):
+        fd = os.open(self.local_path(key), os.O_RDONLY)
+        try:
+            yield lambda offset, length: os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+
+    def download(self, key: str, dest_path: str):
+        shutil.copyfile(self.local_path(key), dest_path)
+
+    # Trả về số byte được giải phóng (0 nếu đã không còn)
+    def delete(self, key: str) -> int:
+        path = self.local_path(key)
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    # Duyệt kho theo từng lô [(key, size)] các blob cũ hơn `before` (mtime), mỗi shard 1 lô
+    def scan(self, before: float):
+        for top in _list_dirs(self.root):
+            for shard in _list_dirs(top):
+                found = []
+                try:
+                    entries = list(os.scandir(shard))
+                except FileNotFoundError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if st.st_mtime < before:
+                                found.append((entry.name, st.st_size))
+                    except FileNotFoundError:
+                        pass
+                if found:
+                    yield found
+
+
+def _list_dirs(base: str) -> list[str]:
+    try:
+        return sorted(entry.path for entry in os.scandir(base) if entry.is_dir(follow_symlinks=False))
+    except FileNotFoundError:
+        return []
+
+
+class S3Backend:
+    name = "s3"
+
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 cần cài boto3 (pip install boto3)")
+
+        self.bucket = settings.S3_BUCKET
+        self.prefix = settings.S3_PREFIX
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.S3_ENDPOINT_URL or None, # MinIO: http://localhost:9000
+            region_name=settings.S3_REGION or None,
+            aws_access_key_id=settings.S3_ACCESS_KEY or None,
+            aws_secret_access_key=settings.S3_SECRET_KEY or None,
+            # Mỗi thread disk-io có thể giữ 1 kết nối
+            config=Config(max_pool_connections=settings.UPLOAD_IO_WORKERS + settings.UPLOAD_IO_QUEUE),
+        )
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + shard_key(key)
+
+    def _is_missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def local_path(self, key: str) -> None:
+        return None
+
+    def put(self, key: str, src_path: str, keep: bool = False):
+        # upload_file tự chia multipart cho file lớn
+        self.client.upload_file(src_path, self.bucket, self._object_key(key))
+        if not keep:
+            os.remove(src_path)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.stat(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stat(self, key: str) -> tuple[int, float]:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    def _get(self, key: str, **kwargs):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), **kwargs)["Body"]
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    # Body của get_object: đọc tuần tự bằng read(n)
+    def open(self, key: str):
+        return self._get(key)
+
+    def read_range(self, key: str, start: int, end: int):
+        body = self._get(key, Range=f"bytes={start}-{end}")
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def read_at(self, key: str, offset: int, length: int) -> bytes:
+        body = self._get(key, Range=f"bytes={offset}-{offset + length - 1}")
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    @contextmanager
+    def open_random(self, key: str):
+        yield partial(self.read_at, key)
+
+    def download(self, key: str, dest_path: str):
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), dest_path)
+        except Exception as e:
+            if hasattr(e, "response") and self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    def delete(self, key: str) -> int:
+        try:
+            size, _ = self.stat(key)
+        except FileNotFoundError:
+            return 0
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        return size
+
+    # Mỗi trang list_objects_v2 (tối đa 1000 object) là 1 lô
+    def scan(self, before: float):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            found = [
+                (obj["Key"].rsplit("/", 1)[-1], obj["Size"])
+                for obj in page.get("Contents", [])
+                if obj["LastModified"].timestamp() < before
+            ]
+            if found:
+                yield found
+
+
+def create_backend(name: str):
+    if name == "local":
+        return LocalBackend()
+    if name == "s3":
+        return S3Backend()
+    raise ValueError(f"STORAGE_BACKEND không hợp lệ: {name}")
+
+
+backend = create_backend(settings.STORAGE_BACKEND)
@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import shutil
+import time
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from app.core import blobcache, compression
+from app.core.config import settings
+from app.core.diskio import run_io
+from app.core.blobstore import COMPLETED_BASE, TEMP_BASE, lock_blob_hashes
+from app.core.storage import backend
+from app.core.thumbnails import THUMB_BASE
+from app.db.base import AsyncSessionLocal
+
+# Dọn rác ổ cứng chạy nền:
+# - Hàng đợi unlink: request xóa chỉ gom đường dẫn vật lý / blob rồi trả về ngay,
+#   file được xóa theo lô, giới hạn GC_UNLINK_RATE file/giây để không tranh I/O với upload.
+#   Nội dung vừa bị xóa được giữ thêm CONTENT_CACHE_TTL_SECONDS: cache /content của các worker
+#   khác (chỉ bị xóa ở worker nhận request) có thể còn trỏ tới đường dẫn cũ.
+# - Đối soát định kỳ (reconcile): file trên đĩa không còn dòng DB tương ứng
+#   (file cũ trong storage/completed, blob, thumbnail), file/folder tạm và phiên upload quá hạn.
+# Chỉ xóa thứ cũ hơn GC_GRACE_SECONDS để không đụng file đang được ghi / chưa commit.
+# Chạy tay, chỉ báo cáo:  python -m app.core.storage_gc --dry-run
+
+REPORT_SAMPLE_SIZE = 20
+DB_BATCH_SIZE = 1000
+
+# Heap (thời điểm được xóa theo time.monotonic(), "path" / "blob", đường dẫn trên đĩa / key)
+_queue: list[tuple[float, str, str]] = []
+_wakeup: asyncio.Event | None = None
+_tasks: set[asyncio.Task] = set()
+_stats = {"queued": 0, "unlinked": 0, "freed_bytes": 0, "errors": 0, "skipped_live": 0, "last_reconcile": None}
+
+
+def _enqueue(items, delay: float = 0):
+    if not items:
+        return
+    due = time.monotonic() + delay
+    for kind, path in items:
+        heapq.heappush(_queue, (due, kind, path))
+    _stats["queued"] += len(items)
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+# Gọi SAU khi commit: xếp hàng các đường dẫn cần xóa (file cũ, thumbnail), xóa sau CONTENT_CACHE_TTL_SECONDS
+def enqueue_unlink(paths):
+    _enqueue([("path", path) for path in paths if path], settings.CONTENT_CACHE_TTL_SECONDS)
+
+
+# Gọi SAU khi commit: xếp hàng các blob (ref_count về 0) cần xóa khỏi storage backend.
+# delay mặc định CONTENT_CACHE_TTL_SECONDS (caller đã tự chờ hết TTL thì truyền 0).
+def enqueue_blob_delete(keys, delay: float | None = None):
+    keys = [key for key in keys if key]
+    blobcache.discard([key.removesuffix(compression.KEY_SUFFIX) for key in keys])
+    _enqueue([("blob", key) for key in keys], settings.CONTENT_CACHE_TTL_SECONDS if delay is None else delay)
+
+
+# Số giây tới lúc phần tử đầu hàng đợi được xóa, None nếu hàng đợi rỗng
+def _next_due() -> float | None:
+    return max(0.0, _queue[0][0] - time.monotonic()) if _queue else None
+
+
+def gc_stats() -> dict:
+    return {**_stats, "pending": len(_queue)}
+
+
+# Các hàm đọc/xóa đĩa dưới đây là hàm đồng bộ, gọi qua run_io
+
+def _unlink_batch(items) -> tuple[int, int, int]:
+    removed = freed = errors = 0
+    for kind, path in items:
+        try:
+            if kind == "blob":
+                size = backend.delete(path)
+                if size:
+                    freed += size
+                    removed += 1
+                continue
+            if os.path.isdir(path):
+                freed += _tree_size(path)
+                shutil.rmtree(path)
+            else:
+                freed += os.stat(path).st_size
+                os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            errors += 1
+            print(f"GC unlink error {path}: {e}")
+    return removed, freed, errors
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.stat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _list_dirs(base: str) -> list[str]:
+    try:
+        return sorted(entry.path for entry in os.scandir(base) if entry.is_dir(follow_symlinks=False))
+    except FileNotFoundError:
+        return []
+
+
+# Các shard 2 tầng <xx>/<yy> của thumbnail
+def _list_shards(base: str) -> list[str]:
+    return [shard for top in _list_dirs(base) for shard in _list_dirs(top)]
+
+
+# (tên, đường dẫn, kích thước) của các entry cũ hơn `before` (mtime) trong 1 thư mục
+def _scan_old(directory: str, before: float, include_dirs: bool = False) -> list[tuple[str, str, int]]:
+    found = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return found
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime < before:
+                    found.append((entry.name, entry.path, st.st_size))
+            elif include_dirs and entry.is_dir(follow_symlinks=False):
+                # Folder chunk cũ: tính theo lần ghi gần nhất của các part bên trong
+                mtimes = [entry.stat().st_mtime] + [part.stat().st_mtime for part in os.scandir(entry.path)]
+                if max(mtimes) < before:
+                    found.append((entry.name, entry.path, _tree_size(entry.path)))
+        except FileNotFoundError:
+            pass
+    return found
+
+
+def _parse_uuid(value: str) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        return None
+
+
+class Report:
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.sections: dict[str, dict] = {}
+        self.items: list[tuple[str, str]] = []
+
+    # items: [(đường dẫn hoặc sha256, size)]; kind="blob" là key trong storage backend
+    def add(self, section: str, items: list[tuple[str, int]], kind: str = "path"):
+        entry = self.sections.setdefault(section, {"count": 0, "bytes": 0, "sample": []})
+        for path, size in items:
+            entry["count"] += 1
+            entry["bytes"] += size
+            if len(entry["sample"]) < REPORT_SAMPLE_SIZE:
+                entry["sample"].append(path)
+            self.items.append((kind, path))
+
+    def to_dict(self) -> dict:
+        return {
+            "dry_run": self.dry_run,
+            "total_count": sum(s["count"] for s in self.sections.values()),
+            "total_bytes": sum(s["bytes"] for s in self.sections.values()),
+            "sections": self.sections,
+        }
+
+
+# Trong các id/hash ứng viên, trả về tập còn được DB tham chiếu (truy vấn theo lô)
+async def _existing(db, sql: str, values: list, **params) -> set:
+    found = set()
+    for i in range(0, len(values), DB_BATCH_SIZE):
+        result = await db.execute(text(sql), {"values": values[i:i + DB_BATCH_SIZE], **params})
+        found.update(result.scalars().all())
+    return found
+
+
+# 1. storage/completed/<owner>/<file_id>: file cũ không còn dòng files (hoặc đã chuyển sang blob,
+#    xem app.core.migrate_storage)
+async def _reconcile_legacy(db, report: Report, before: float):
+    for owner_dir in await run_io(_list_dirs, COMPLETED_BASE):
+        owner_id = _parse_uuid(os.path.basename(owner_dir))
+        if owner_id is None:
+            continue
+        candidates = {}
+        for name, path, size in await run_io(_scan_old, owner_dir, before):
+            file_id = _parse_uuid(name)
+            if file_id is not None:
+                candidates[file_id] = (path, size)
+        alive = await _existing(db, """
+            SELECT id FROM files
+            WHERE owner_id = :owner_id AND id = ANY(:values) AND blob_hash IS NULL
+        """, list(candidates), owner_id=owner_id)
+        report.add("legacy_files", [value for key, value in candidates.items() if key not in alive])
+
+
+# 2. Blob: object trong storage backend không có dòng blobs, và dòng blobs không còn file nào tham chiếu.
+#    Blob đã nén (<sha256>.zst, xem app.core.compression): bản nguyên cũ được giữ thêm
+#    CONTENT_CACHE_TTL_SECONDS sau khi nén (cache /content có thể còn trỏ tới), sau đó là rác.
+async def _reconcile_blobs(db, report: Report, before: float):
+    batches = backend.scan(before)
+    # Mỗi lô (1 shard / 1 trang list của S3) đọc trên thread pool
+    while (batch := await run_io(next, batches, None)) is not None:
+        candidates = dict(batch)
+        hashes = list({key.removesuffix(compression.KEY_SUFFIX) for key in candidates})
+        alive = await _existing(db, "SELECT sha256 || :suffix FROM blobs WHERE sha256 = ANY(:values)", hashes,
+                                suffix=compression.KEY_SUFFIX)
+        alive |= await _existing(db, """
+            SELECT sha256 FROM blobs
+            WHERE sha256 = ANY(:values)
+              AND (encoding IS DISTINCT FROM :encoding OR compressed_at > now() - make_interval(secs => :keep))
+        """, hashes, encoding=compression.ENCODING, keep=settings.CONTENT_CACHE_TTL_SECONDS)
+        report.add("orphan_blob_files", [(key, size) for key, size in candidates.items() if key not in alive], "blob")
+
+    # Chỉ xóa key đang dùng; bản còn lại (nếu có) thành orphan_blob_files ở lần chạy sau
+    query = """
+        {verb} FROM blobs b
+        WHERE b.created_at < now() - make_interval(secs => :grace)
+          AND NOT EXISTS (SELECT 1 FROM files f WHERE f.blob_hash = b.sha256)
+          AND NOT EXISTS (SELECT 1 FROM file_versions v WHERE v.blob_hash = b.sha256)
+        {tail}
+    """
+    columns = """
+        CASE WHEN b.encoding = :encoding THEN b.sha256 || :suffix ELSE b.sha256 END,
+        COALESCE(b.stored_bytes, b.size_bytes)
+    """
+    params = {"grace": settings.GC_GRACE_SECONDS, "encoding": compression.ENCODING, "suffix": compression.KEY_SUFFIX}
+    if report.dry_run:
+        result = await db.execute(text(query.format(verb=f"SELECT {columns}", tail="")), params)
+        rows = result.all()
+    else:
+        try:
+            result = await db.execute(text(query.format(verb="DELETE", tail=f"RETURNING {columns}")), params)
+            rows = result.all()
+            await db.commit()
+        except IntegrityError:
+            # Có file vừa tham chiếu lại blob (upload tức thì) -> để lần sau
+            await db.rollback()
+            rows = []
+    report.add("unreferenced_blobs", rows, "blob")
+
+
+# 3. Thumbnail của file đã bị xóa
+async def _reconcile_thumbnails(db, report: Report, before: float):
+    for shard in await run_io(_list_shards, THUMB_BASE):
+        candidates = {}
+        for name, path, size in await run_io(_scan_old, shard, before):
+            file_id = _parse_uuid(name.split("_", 1)[0])
+            if file_id is not None:
+                candidates.setdefault(file_id, []).append((path, size))
+        alive = await _existing(db, "SELECT id FROM files WHERE id = ANY(:values)", list(candidates))
+        report.add("orphan_thumbnails", [item for key, items in candidates.items() if key not in alive for item in items])
+
+
+# 4. Phiên upload bỏ dở quá GC_TEMP_TTL_HOURS, file tạm và folder chunk (upload cũ) quá hạn
+async def _reconcile_temp(db, report: Report):
+    ttl_seconds = settings.GC_TEMP_TTL_HOURS * 3600
+    params = {"ttl": ttl_seconds}
+    stale_where = "updated_at < now() - make_interval(secs => :ttl)"
+    if report.dry_run:
+        result = await db.execute(text(f"SELECT count(*) FROM upload_sessions WHERE {stale_where}"), params)
+        report.sections["expired_sessions"] = {"count": result.scalar_one(), "bytes": 0, "sample": []}
+    else:
+        result = await db.execute(text(f"DELETE FROM upload_sessions WHERE {stale_where} RETURNING id"), params)
+        expired = len(result.all())
+        await db.commit()
+        report.sections["expired_sessions"] = {"count": expired, "bytes": 0, "sample": []}
+
+    candidates = {}
+    for name, path, size in await run_io(_scan_old, TEMP_BASE, time.time() - ttl_seconds, True):
+        candidates[name] = (path, size)
+    # File của phiên upload còn sống (vừa nhận chunk) thì giữ lại
+    session_ids = [sid for sid in (_parse_uuid(name.removesuffix(".upload")) for name in candidates) if sid]
+    alive = await _existing(db, f"""
+        SELECT id FROM upload_sessions WHERE id = ANY(:values) AND NOT ({stale_where})
+    """, session_ids, ttl=ttl_seconds)
+    alive_names = {f"{sid}.upload" for sid in alive}
+    report.add("stale_temp", [value for key, value in candidates.items() if key not in alive_names])
+
+
+async def reconcile(dry_run: bool = False) -> dict:
+    report = Report(dry_run)
+    before = time.time() - settings.GC_GRACE_SECONDS
+    async with AsyncSessionLocal() as db:
+        await _reconcile_legacy(db, report, before)
+        await _reconcile_blobs(db, report, before)
+        await _reconcile_thumbnails(db, report, before)
+        await _reconcile_temp(db, report)
+        await db.commit()
+    if not dry_run:
+        # Thứ đang chờ trong hàng đợi (chưa hết hạn giữ lại cho cache /content) không xếp lại lần nữa
+        pending = {(kind, path) for _, kind, path in _queue}
+        _enqueue([item for item in report.items if item not in pending])
+    _stats["last_reconcile"] = {"at": time.time(), **report.to_dict()}
+    return report.to_dict()
+
+
+# Blob trong hàng đợi có thể đã được upload lại (dòng blobs mới, file được ghi lại) trước khi
+# tới lượt xóa: khóa các hash (giống store_blob), kiểm tra lại trong DB rồi mới xóa,
+# giữ khóa tới khi xóa xong. Key còn dùng: dòng blobs còn, trừ bản nguyên của blob đã nén.
+async def _delete_blobs(keys: list[str]) -> tuple[int, int, int]:
+    hashes = [key.removesuffix(compression.KEY_SUFFIX) for key in keys]
+    async with AsyncSessionLocal() as db:
+        await lock_blob_hashes(db, hashes)
+        result = await db.execute(text("""
+            SELECT q.key FROM unnest(CAST(:keys AS varchar[]), CAST(:hashes AS varchar[])) AS q(key, sha256)
+            JOIN blobs b ON b.sha256 = q.sha256
+            WHERE q.key <> q.sha256 OR b.encoding IS DISTINCT FROM :encoding
+        """), {"keys": keys, "hashes": hashes, "encoding": compression.ENCODING})
+        live = set(result.scalars().all())
+        _stats["skipped_live"] += len(live)
+        counts = await run_io(_unlink_batch, [("blob", key) for key in keys if key not in live])
+        await db.commit()
+    return counts
+
+
+# Lấy từng lô đã tới hạn trong hàng đợi, xóa trên thread pool, ngủ cho đúng tốc độ giới hạn
+async def drain(limit_rate: bool = True):
+    while _queue and _next_due() == 0:
+        batch = []
+        while _queue and len(batch) < settings.GC_UNLINK_BATCH and _next_due() == 0:
+            _, kind, path = heapq.heappop(_queue)
+            batch.append((kind, path))
+        started = time.monotonic()
+        removed, freed, errors = await run_io(_unlink_batch, [item for item in batch if item[0] != "blob"])
+        blob_keys = [key for kind, key in batch if kind == "blob"]
+        if blob_keys:
+            counts = await _delete_blobs(blob_keys)
+            removed, freed, errors = removed + counts[0], freed + counts[1], errors + counts[2]
+        _stats["unlinked"] += removed
+        _stats["freed_bytes"] += freed
+        _stats["errors"] += errors
+        if limit_rate and settings.GC_UNLINK_RATE > 0:
+            await asyncio.sleep(max(0.0, len(batch) / settings.GC_UNLINK_RATE - (time.monotonic() - started)))
+
+
+async def _unlink_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=_next_due())
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await drain()
+        except Exception as e:
+            print(f"GC unlink loop error: {e}")
+
+
+async def _reconcile_loop():
+    while True:
+        await asyncio.sleep(settings.GC_INTERVAL_SECONDS)
+        try:
+            report = await reconcile(dry_run=settings.GC_DRY_RUN)
+            if report["total_count"]:
+                print(f"GC reconcile: {report['total_count']} items, {report['total_bytes']} bytes"
+                      f"{' (dry run)' if report['dry_run'] else ''}")
+        except Exception as e:
+            print(f"GC reconcile error: {e}")
+
+
+# Gọi trong lifespan của app
+def start():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    if _queue:
+        _wakeup.set()
+    loops = [_unlink_loop()]
+    if settings.GC_INTERVAL_SECONDS > 0:
+        loops.append(_reconcile_loop())
+    for loop in loops:
+        task = asyncio.create_task(loop)
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+# Còn sót trong hàng đợi khi tắt server thì lần reconcile sau sẽ dọn
+async def stop():
+    global _wakeup
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _wakeup = None
+
+
+async def _main(args):
+    from app.db.base import engine
+    try:
+        report = await reconcile(dry_run=args.dry_run)
+        if not args.dry_run:
+            await drain(limit_rate=not args.no_rate_limit)
+        print(json.dumps(report, indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dọn file rác trong storage/")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ báo cáo, không xóa gì")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Xóa hết ngay, không giới hạn tốc độ")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,120 @@
+import tarfile
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+# Header tên dài (GNU "L", pax) được đọc cả vào RAM -> giới hạn kích thước
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+class TarStreamError(ValueError):
+    pass
+
+
+class _ByteStream:
+    # Đọc theo số byte chính xác từ async iterator các khúc bytes (request.stream())
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._buffer = bytearray()
+        self.received = 0
+
+    async def _fill(self) -> bool:
+        try:
+            data = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return False
+        self._buffer += data
+        self.received += len(data)
+        return True
+
+    async def read_exact(self, n: int) -> bytes:
+        while len(self._buffer) < n:
+            if not await self._fill():
+                raise TarStreamError("File tar bị cắt cụt")
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    # Trả dần n byte tiếp theo theo từng khúc (không gom cả entry vào RAM)
+    async def iter_exact(self, n: int):
+        while n > 0:
+            if not self._buffer and not await self._fill():
+                raise TarStreamError("File tar bị cắt cụt")
+            take = min(n, len(self._buffer))
+            data = bytes(self._buffer[:take])
+            del self._buffer[:take]
+            n -= take
+            yield data
+
+    async def skip(self, n: int):
+        async for _ in self.iter_exact(n):
+            pass
+
+
+def _padding(size: int) -> int:
+    return -size % BLOCK_SIZE
+
+
+def _pax_path(data: bytes) -> str | None:
+    # Bản ghi pax: "<độ dài> <key>=<value>\n"
+    path = None
+    pos = 0
+    while pos < len(data):
+        length = int(data[pos:data.index(b" ", pos)])
+        key, _, value = data[data.index(b" ", pos) + 1:pos + length - 1].partition(b"=")
+        if key == b"path":
+            path = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return path
+
+
+# Tên entry -> các thành phần đường dẫn tương đối, None nếu không an toàn ("..", rỗng)
+def split_name(name: str) -> list[str] | None:
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if not parts or ".." in parts or any(len(part) > 255 for part in parts):
+        return None
+    return parts
+
+
+# Đọc file tar theo luồng (ustar / GNU / pax), không cần biết trước kích thước, không seek.
+# Sinh (TarInfo, data) theo thứ tự; data là async iterator nội dung entry, caller phải đọc hết
+# (hoặc bỏ qua) trước khi lấy entry tiếp theo. Tên dài (GNU "L", pax "path") đã được gộp vào TarInfo.
+async def iter_tar(chunks):
+    stream = _ByteStream(chunks)
+    long_name = None
+    while True:
+        header = await stream.read_exact(BLOCK_SIZE)
+        try:
+            info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+        except tarfile.EOFHeaderError:
+            return
+        except tarfile.HeaderError as e:
+            raise TarStreamError(f"Header tar không hợp lệ: {e}")
+
+        if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE):
+            if info.size > MAX_HEADER_SIZE:
+                raise TarStreamError(f"Header tên dài / pax quá lớn ({info.size} bytes)")
+            data = await stream.read_exact(info.size)
+            await stream.skip(_padding(info.size))
+            if info.type == tarfile.GNUTYPE_LONGNAME:
+                long_name = data.rstrip(b"\0").decode("utf-8", "surrogateescape")
+            else:
+                try:
+                    long_name = _pax_path(data) or long_name
+                except ValueError:
+                    raise TarStreamError("Header pax không hợp lệ")
+            continue
+        if info.type in (tarfile.XGLTYPE, tarfile.GNUTYPE_LONGLINK):
+            await stream.skip(info.size + _padding(info.size))
+            continue
+
+        if long_name is not None:
+            info.name = long_name.rstrip("/") if info.isdir() else long_name
+            long_name = None
+        # Chỉ file thường có dữ liệu cho caller. Link, thiết bị... header vẫn có thể khai báo
+        # size > 0: phần dữ liệu đó nằm trong luồng và được bỏ qua sau khi yield
+        size = info.size if info.isreg() else 0
+        data = stream.iter_exact(size)
+        yield info, data
+        # Caller bỏ dở entry -> bỏ qua phần còn lại
+        async for _ in data:
+            pass
+        await stream.skip(info.size - size + _padding(info.size))
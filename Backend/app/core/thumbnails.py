@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app.core.blobstore import local_copy
+from app.core.config import settings
+
+# Cache ảnh thu nhỏ: storage/thumbnails/<xx>/<yy>/<file_id>_<size>.jpg
+# (uuid7 tăng dần theo thời gian nên chia thư mục theo các ký tự cuối, phần ngẫu nhiên)
+THUMB_BASE = "storage/thumbnails"
+THUMBNAIL_SIZES = (128, 256, 512)
+DEFAULT_THUMBNAIL_SIZE = 256
+
+THUMBNAIL_MIME_TYPES = {
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff",
+}
+
+_pool: ProcessPoolExecutor | None = None
+_inflight: dict[str, asyncio.Future] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def supports_thumbnail(mime_type: str | None) -> bool:
+    return mime_type in THUMBNAIL_MIME_TYPES
+
+
+def thumbnail_path(file_id, size: int) -> str:
+    fid = str(file_id).replace("-", "")
+    return os.path.join(THUMB_BASE, fid[-2:], fid[-4:-2], f"{fid}_{size}.jpg")
+
+
+def has_thumbnail(file_id, size: int = DEFAULT_THUMBNAIL_SIZE) -> bool:
+    return os.path.exists(thumbnail_path(file_id, size))
+
+
+# Mọi cỡ thumbnail có thể có của các file (xóa file thì xếp hàng xóa hết)
+def thumbnail_paths(file_ids) -> list[str]:
+    return [thumbnail_path(file_id, size) for file_id in file_ids for size in THUMBNAIL_SIZES]
+
+
+# Nội dung file bị thay (upload delta, khôi phục bản cũ): bỏ thumbnail cũ để tạo lại từ nội dung mới
+def remove_thumbnails(file_id):
+    for path in thumbnail_paths([file_id]):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# Chạy trong process con (giải mã/resize ảnh tốn CPU, không để chiếm GIL của server)
+def _render(src_path: str, dest_path: str, size: int):
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+    with Image.open(src_path) as img:
+        img.draft("RGB", (size, size)) # JPEG: giải mã thẳng ở độ phân giải thấp
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(tmp_path, "JPEG", quality=settings.THUMBNAIL_QUALITY, optimize=True)
+    os.replace(tmp_path, dest_path)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: không fork cả process server (đang có nhiều thread)
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def _create(owner_id, file_id, blob_hash, dest_path: str, size: int):
+    # Blob ở backend từ xa (S3) được tải về file tạm trước khi render
+    async with local_copy(owner_id, file_id, blob_hash) as src_path:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_get_pool(), _render, src_path, dest_path, size)
+
+
+# Trả về đường dẫn thumbnail, tạo nếu chưa có. Nhiều request cùng lúc
+# cho cùng 1 ảnh chỉ tạo (và tải nguồn) 1 lần.
+# FileNotFoundError nếu file gốc không còn.
+async def ensure_thumbnail(owner_id, file_id, blob_hash: str | None, size: int = DEFAULT_THUMBNAIL_SIZE) -> str:
+    dest_path = thumbnail_path(file_id, size)
+    if os.path.exists(dest_path):
+        return dest_path
+
+    future = _inflight.get(dest_path)
+    if future is None:
+        future = asyncio.ensure_future(_create(owner_id, file_id, blob_hash, dest_path, size))
+        _inflight[dest_path] = future
+        future.add_done_callback(lambda _: _inflight.pop(dest_path, None))
+    # 1 request bị hủy không làm hỏng việc tạo thumbnail của các request khác
+    await asyncio.shield(future)
+    return dest_path
+
+
+def in_flight() -> int:
+    return len(_inflight)
+
+
+# Gọi sau khi upload xong: tạo sẵn thumbnail cỡ mặc định dưới nền
+def schedule_thumbnail(owner_id, file_id, blob_hash: str | None, mime_type: str | None):
+    if not supports_thumbnail(mime_type):
+        return
+
+    async def worker():
+        try:
+            await ensure_thumbnail(owner_id, file_id, blob_hash)
+        except Exception as e:
+            print(f"Thumbnail error {file_id}: {e}")
+
+    task = asyncio.create_task(worker())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
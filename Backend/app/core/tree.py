@@ -0,0 +1,148 @@
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, func, literal, text
+
+from app.db.models import FileItem
+
+# Materialized path: files.path = chuỗi id (hex) của các tổ tiên + chính nó,
+# VD "<root>/<photos>/<a.jpg>/". Cả cây con của X là các dòng có path bắt đầu
+# bằng X.path, tức 1 khoảng liên tục [X.path, X.path[:-1] + "0") trong index
+# (owner_id, path) -- cột path dùng collation "C" nên so sánh theo byte.
+# Path dựa trên id nên đổi tên không làm thay đổi path, chỉ di chuyển mới cần cập nhật.
+PATH_SEP = "/"
+
+
+def item_path(parent_path: str | None, item_id) -> str:
+    segment = (item_id if isinstance(item_id, uuid.UUID) else uuid.UUID(str(item_id))).hex
+    return (parent_path or "") + segment + PATH_SEP
+
+
+def path_depth(path: str) -> int:
+    return path.count(PATH_SEP) - 1
+
+
+# Điều kiện WHERE cho cả cây con (gồm cả chính item)
+def subtree_filter(owner_id, path: str):
+    # "/" + 1 = "0": mọi path con đều < path[:-1] + "0"
+    upper = path[:-1] + chr(ord(PATH_SEP) + 1)
+    return (FileItem.owner_id == owner_id, FileItem.path >= path, FileItem.path < upper)
+
+
+def ancestor_ids(path: str) -> list[uuid.UUID]:
+    return [uuid.UUID(segment) for segment in path.split(PATH_SEP)[:-2]]
+
+
+# Path của các tổ tiên, VD "a/b/c/" -> ["a/", "a/b/"]
+def ancestor_paths(path: str) -> list[str]:
+    segments = path.split(PATH_SEP)[:-2]
+    return [PATH_SEP.join(segments[:i]) + PATH_SEP for i in range(1, len(segments) + 1)]
+
+
+# Đường dẫn hiển thị của folder chứa từng item ("/Ảnh/2024", item ở Home -> "/").
+# Gom id tổ tiên của mọi item rồi lấy tên trong 1 query.
+async def display_folder_paths(db, owner_id, paths: list[str]) -> dict[str, str]:
+    # Bỏ Home (tổ tiên đầu tiên) khỏi đường dẫn hiển thị
+    ancestors = {path: ancestor_ids(path)[1:] for path in paths}
+    ids = list({folder_id for folder_ids in ancestors.values() for folder_id in folder_ids})
+    names = {}
+    if ids:
+        result = await db.execute(select(FileItem.id, FileItem.name).where(
+            FileItem.owner_id == owner_id, FileItem.id.in_(ids)
+        ))
+        names = dict(result.all())
+    return {
+        path: PATH_SEP + PATH_SEP.join(names.get(folder_id, "?") for folder_id in folder_ids)
+        for path, folder_ids in ancestors.items()
+    }
+
+
+# Lấy path của folder cha (và kiểm tra nó là folder của user), 404 nếu không có
+async def get_folder_path(db, owner_id, folder_id) -> str:
+    try:
+        folder_id = uuid.UUID(str(folder_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Không tìm thấy thư mục")
+    result = await db.execute(select(FileItem.path).where(
+        FileItem.id == folder_id,
+        FileItem.owner_id == owner_id,
+        FileItem.type == "folder"
+    ))
+    path = result.scalar_one_or_none()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy thư mục")
+    return path
+
+
+# Tổng dung lượng, số file, số folder con cháu: 1 range query trên index
+async def subtree_stats(db, owner_id, path: str) -> dict:
+    result = await db.execute(select(
+        func.coalesce(func.sum(FileItem.size_bytes), 0),
+        func.count().filter(FileItem.type == "file"),
+        func.count().filter(FileItem.type == "folder"),
+    ).where(*subtree_filter(owner_id, path)))
+    size_bytes, files, folders = result.one()
+    return {"size_bytes": size_bytes, "files": files, "folders": folders}
+
+
+# Di chuyển item (và cả cây con) sang folder mới. Không commit.
+# Chỉ cần 1 lệnh UPDATE: thay phần đầu path cũ bằng path mới cho cả khoảng.
+async def move_subtree(db, owner_id, item_id, old_path: str, new_parent_id, new_parent_path: str) -> str:
+    if new_parent_path.startswith(old_path):
+        raise HTTPException(status_code=400, detail="Không thể di chuyển folder vào chính nó")
+
+    new_path = item_path(new_parent_path, item_id)
+    depth_delta = path_depth(new_path) - path_depth(old_path)
+    await db.execute(
+        update(FileItem)
+        .where(*subtree_filter(owner_id, old_path))
+        .values(
+            path=literal(new_path) + func.substr(FileItem.path, len(old_path) + 1),
+            depth=FileItem.depth + depth_delta,
+            updated_at=FileItem.updated_at, # Nội dung con cháu không đổi
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(FileItem)
+        .where(FileItem.id == item_id, FileItem.owner_id == owner_id)
+        .values(parent_id=new_parent_id)
+        .execution_options(synchronize_session=False)
+    )
+    return new_path
+
+
+# Di chuyển nhiều cây con cùng lúc (API batch): 2 lệnh UPDATE cho mọi item. Không commit.
+# moves: [(item_id, old_path, new_parent_id, new_parent_path)], caller đã kiểm tra
+# các cây con không lồng nhau và không item nào bị đưa vào chính cây con của nó.
+async def move_subtrees(db, owner_id, moves) -> list[str]:
+    if not moves:
+        return []
+    new_paths = [item_path(new_parent_path, item_id) for item_id, _, _, new_parent_path in moves]
+    old_paths = [old_path for _, old_path, _, _ in moves]
+    await db.execute(text("""
+        UPDATE files f
+        SET path = m.new_path || substr(f.path, length(m.old_path) + 1),
+            depth = f.depth + m.delta
+        FROM unnest(
+            CAST(:old_paths AS varchar[]), CAST(:uppers AS varchar[]),
+            CAST(:new_paths AS varchar[]), CAST(:deltas AS integer[])
+        ) AS m(old_path, upper, new_path, delta)
+        WHERE f.owner_id = :owner_id AND f.path >= m.old_path AND f.path < m.upper
+    """), {
+        "owner_id": owner_id,
+        "old_paths": old_paths,
+        "uppers": [path[:-1] + chr(ord(PATH_SEP) + 1) for path in old_paths],
+        "new_paths": new_paths,
+        "deltas": [path_depth(new) - path_depth(old) for old, new in zip(old_paths, new_paths)],
+    })
+    await db.execute(text("""
+        UPDATE files f SET parent_id = m.parent_id, updated_at = now()
+        FROM unnest(CAST(:ids AS uuid[]), CAST(:parent_ids AS uuid[])) AS m(id, parent_id)
+        WHERE f.id = m.id AND f.owner_id = :owner_id
+    """), {
+        "owner_id": owner_id,
+        "ids": [item_id for item_id, _, _, _ in moves],
+        "parent_ids": [parent_id for _, _, parent_id, _ in moves],
+    })
+    return new_paths
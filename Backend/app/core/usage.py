@@ -0,0 +1,104 @@
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.deps import authenticate_token
+from app.db.base import AsyncSessionLocal
+
+# Dung lượng đã dùng của mỗi user: 2 bộ đếm users.used_bytes / users.file_count được
+# cộng trừ ngay trong transaction tạo/xóa file nên đọc usage chỉ là 1 lookup theo khóa chính,
+# không phải SUM(size_bytes) trên cả bảng files.
+# Tính theo dung lượng logic (file trùng nội dung vẫn tính cho từng bản).
+# Quota: users.quota_bytes, NULL = dùng DEFAULT_QUOTA_BYTES (0 = không giới hạn).
+
+QUOTA_EXCEEDED = "Vượt quá dung lượng cho phép"
+
+# Điều kiện SQL: thêm :nbytes vẫn nằm trong quota
+_WITHIN_QUOTA = """(
+    (quota_bytes IS NULL AND :default_quota <= 0)
+    OR used_bytes + :nbytes <= COALESCE(quota_bytes, :default_quota)
+)"""
+
+
+def quota_exceeded() -> HTTPException:
+    return HTTPException(status_code=413, detail=QUOTA_EXCEEDED)
+
+
+# Cộng (hoặc trừ khi số âm) vào bộ đếm, kiểm tra quota nếu có thêm dữ liệu.
+# Không commit: gọi trong cùng transaction với INSERT/DELETE files -> bộ đếm luôn khớp.
+# Lệnh UPDATE khóa dòng user nên các upload song song không cùng lọt qua quota.
+# Thứ tự khóa cố định ở mọi route: dòng files -> blobs (ref_count) -> users (add_usage),
+# tức là gọi add_usage sau khi đổi tham chiếu blob, ngay trước record_changes.
+async def add_usage(db, owner_id, nbytes: int, nfiles: int):
+    if nbytes == 0 and nfiles == 0:
+        return
+    check = nbytes > 0
+    result = await db.execute(text(f"""
+        UPDATE users SET used_bytes = used_bytes + :nbytes, file_count = file_count + :nfiles
+        WHERE id = :owner_id {"AND " + _WITHIN_QUOTA if check else ""}
+        RETURNING used_bytes
+    """), {"owner_id": owner_id, "nbytes": nbytes, "nfiles": nfiles, "default_quota": settings.DEFAULT_QUOTA_BYTES})
+    if result.first() is None and check:
+        raise quota_exceeded()
+
+
+# Kiểm tra sớm (trước khi nhận dữ liệu): còn đủ chỗ cho `incoming` bytes không.
+# Chỉ đọc, lần kiểm tra chính thức là add_usage lúc commit.
+async def check_quota(db, owner_id, incoming: int):
+    result = await db.execute(text(f"""
+        SELECT {_WITHIN_QUOTA} FROM users WHERE id = :owner_id
+    """), {"owner_id": owner_id, "nbytes": max(incoming, 0), "default_quota": settings.DEFAULT_QUOTA_BYTES})
+    if not result.scalar():
+        raise quota_exceeded()
+
+
+async def get_usage(db, owner_id) -> dict:
+    result = await db.execute(text("""
+        SELECT used_bytes, file_count, quota_bytes FROM users WHERE id = :owner_id
+    """), {"owner_id": owner_id})
+    used_bytes, file_count, quota_bytes = result.one()
+    if quota_bytes is None and settings.DEFAULT_QUOTA_BYTES > 0:
+        quota_bytes = settings.DEFAULT_QUOTA_BYTES
+    return {
+        "used_bytes": used_bytes,
+        "file_count": file_count,
+        "quota_bytes": quota_bytes, # None = không giới hạn
+        "available_bytes": None if quota_bytes is None else max(0, quota_bytes - used_bytes),
+    }
+
+
+# Upload multipart (/files/upload, /files/upload_chunk): FastAPI đọc + ghi cả form ra file tạm
+# trước khi chạy handler / dependency. Middleware này kiểm tra quota theo Content-Length ngay
+# khi nhận header, hết chỗ thì trả 413 trước khi đọc byte body nào.
+# Không có Content-Length / token không hợp lệ -> để route xử lý như thường (add_usage vẫn chặn lúc commit).
+class QuotaMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.paths = {f"{settings.API_V1_STR}/files/upload", f"{settings.API_V1_STR}/files/upload_chunk"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            if not await self._within_quota(scope):
+                response = JSONResponse({"detail": QUOTA_EXCEEDED}, status_code=413)
+                return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+    async def _within_quota(self, scope) -> bool:
+        request = Request(scope)
+        length = request.headers.get("content-length")
+        authorization = request.headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        token = token if scheme.lower() == "bearer" else request.query_params.get("token")
+        if not length or not length.isdigit() or not token:
+            return True
+        try:
+            user = await authenticate_token(token)
+        except HTTPException:
+            return True
+        async with AsyncSessionLocal() as db:
+            try:
+                await check_quota(db, user.id, int(length))
+            except HTTPException:
+                return False
+        return True
@@ -0,0 +1,69 @@
+from collections import Counter
+
+import uuid6
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from app.core.blobstore import release_blobs
+from app.core.config import settings
+
+# Phiên bản file: mỗi lần nội dung file bị thay (upload delta, khôi phục bản cũ), nội dung cũ
+# được chuyển sang file_versions, vẫn giữ tham chiếu tới blob cũ (ref_count không giảm).
+# Mỗi bản là 1 blob đầy đủ trong kho (có nén nếu bật COMPRESSION_ENABLED).
+# Không tính vào used_bytes (quota tính theo nội dung hiện tại). Mỗi file giữ tối đa
+# FILE_VERSIONS_KEEP bản cũ, bản cũ hơn bị xóa và trả tham chiếu blob.
+
+
+# Khóa dòng file (FOR UPDATE) trước khi thay nội dung, 404 nếu không phải file của user
+async def lock_file(db, owner_id, file_id):
+    result = await db.execute(text("""
+        SELECT id, owner_id, name, mime_type, blob_hash, size_bytes, version, updated_at FROM files
+        WHERE id = :id AND owner_id = :owner_id AND type = 'file'
+        FOR UPDATE
+    """), {"id": file_id, "owner_id": owner_id})
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    return row
+
+
+# Thay nội dung file (dòng lấy từ lock_file) bằng blob đã có tham chiếu mới cho file này.
+# Không commit, không cộng usage (caller gọi add_usage sau hàm này, trước record_changes).
+# Trả về key blob cần xóa khỏi backend sau khi commit (bản cũ bị dọn vì quá FILE_VERSIONS_KEEP).
+async def replace_content(db, item, blob_hash: str, size: int) -> list[str]:
+    if item.blob_hash:
+        await db.execute(text("""
+            INSERT INTO file_versions (id, file_id, owner_id, version, blob_hash, size_bytes, created_at)
+            VALUES (:id, :file_id, :owner_id, :version, :blob_hash, :size, :created_at)
+        """), {
+            "id": uuid6.uuid7(), "file_id": item.id, "owner_id": item.owner_id, "version": item.version,
+            "blob_hash": item.blob_hash, "size": item.size_bytes or 0, "created_at": item.updated_at,
+        })
+    await db.execute(text("""
+        UPDATE files SET blob_hash = :blob_hash, size_bytes = :size, version = version + 1, updated_at = now()
+        WHERE id = :id
+    """), {"id": item.id, "blob_hash": blob_hash, "size": size})
+    return await prune_versions(db, item.id)
+
+
+async def prune_versions(db, file_id) -> list[str]:
+    result = await db.execute(text("""
+        DELETE FROM file_versions WHERE id IN (
+            SELECT id FROM file_versions WHERE file_id = :file_id ORDER BY version DESC OFFSET :keep
+        )
+        RETURNING blob_hash
+    """), {"file_id": file_id, "keep": settings.FILE_VERSIONS_KEEP})
+    return await release_blobs(db, Counter(result.scalars().all()))
+
+
+# Tham chiếu blob của các bản cũ (xóa file thì CASCADE xóa file_versions -> phải trả cả các tham chiếu này)
+async def version_blob_refs(db, owner_id, file_ids) -> Counter:
+    file_ids = list(file_ids)
+    if not file_ids:
+        return Counter()
+    result = await db.execute(text("""
+        SELECT blob_hash, count(*) FROM file_versions
+        WHERE owner_id = :owner_id AND file_id = ANY(CAST(:ids AS uuid[]))
+        GROUP BY blob_hash
+    """), {"owner_id": owner_id, "ids": file_ids})
+    return Counter(dict(result.all()))
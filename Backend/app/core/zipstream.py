@@ -0,0 +1,94 @@
+import os
+import time
+import zipfile
+
+# Kích thước mỗi lần đọc file nguồn / ngưỡng đẩy dữ liệu ra client
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Các định dạng đã nén sẵn: deflate lại chỉ tốn CPU mà không giảm dung lượng
+ALREADY_COMPRESSED_PREFIXES = ("video/",)
+ALREADY_COMPRESSED_TYPES = {
+    "image/jpeg", "image/png", "image/gif", "image/webp",
+    "image/heic", "image/heif", "image/avif",
+    "audio/mpeg", "audio/mp4", "audio/aac", "audio/ogg", "audio/webm", "audio/flac",
+    "application/zip", "application/gzip", "application/x-gzip",
+    "application/x-7z-compressed", "application/x-rar-compressed", "application/vnd.rar",
+    "application/x-bzip2", "application/x-xz", "application/zstd",
+}
+
+
+def is_already_compressed(mime_type: str | None) -> bool:
+    if not mime_type:
+        return False
+    return mime_type in ALREADY_COMPRESSED_TYPES or mime_type.startswith(ALREADY_COMPRESSED_PREFIXES)
+
+
+class _ChunkSink:
+    # File-like chỉ có write(): không có tell()/seek() nên ZipFile tự chuyển
+    # sang chế độ streaming (data descriptor sau mỗi entry, không ghi lùi header)
+    def __init__(self):
+        self._parts = []
+        self.pending = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.pending += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        self.pending = 0
+        return data
+
+
+def _open_source(source):
+    if isinstance(source, str):
+        st = os.stat(source)
+        return st.st_size, st.st_mtime, open(source, "rb")
+    return source()
+
+
+# Sinh file ZIP theo từng khúc bytes, không tạo file tạm trên đĩa.
+# entries: iterable (arcname, source, mime_type); source = None là folder, còn lại là
+# đường dẫn file hoặc hàm trả về (size, mtime, file-like) (đọc qua storage backend).
+# Đây là generator đồng bộ -> StreamingResponse chạy nó trong threadpool,
+# nên việc đọc đĩa và nén không chặn event loop.
+def iter_zip(entries, chunk_size: int = ZIP_CHUNK_SIZE):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+        for arcname, source, mime_type in entries:
+            if source is None:
+                zf.writestr(zipfile.ZipInfo(arcname + "/"), b"")
+                continue
+
+            try:
+                size, mtime, src = _open_source(source)
+            except FileNotFoundError:
+                # File vật lý đã mất -> bỏ qua như trước đây
+                continue
+            zinfo = zipfile.ZipInfo(arcname, time.localtime(mtime)[:6])
+            zinfo.file_size = size
+            zinfo.external_attr = 0o644 << 16
+            zinfo.compress_type = zipfile.ZIP_STORED if is_already_compressed(mime_type) else zipfile.ZIP_DEFLATED
+
+            # file_size đã biết trước nên ZipFile tự quyết định có cần ZIP64 hay không
+            with src, zf.open(zinfo, "w") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    if sink.pending >= chunk_size:
+                        yield sink.drain()
+
+            if sink.pending >= chunk_size:
+                yield sink.drain()
+
+    # Central directory được ghi khi đóng ZipFile
+    tail = sink.drain()
+    if tail:
+        yield tail
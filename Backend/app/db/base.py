@@ -1,13 +1,82 @@
+import time
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import settings
+from app.core import metrics
+
+# Pool có đo thời gian lấy kết nối: tăng cao là pool đã bão hòa (request phải xếp hàng chờ DB).
+# Nhãn "pool" lấy từ pool_logging_name (được giữ lại khi pool bị recreate).
+class TimedPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.db_pool_wait.observe(self._orig_logging_name, value=time.perf_counter() - start)
+
+
+def create_engine(url: str, pool_name: str):
+    options = {}
+    if settings.METRICS_ENABLED:
+        options["poolclass"] = TimedPool
+        options["pool_logging_name"] = pool_name
+    engine = create_async_engine(
+        url,
+        echo=False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        },
+        **options,
+    )
+    if settings.METRICS_ENABLED:
+        # Đo thời gian từng câu SQL + đếm số query mỗi request
+        metrics.instrument_engine(engine.sync_engine)
+    return engine
+
+
+engine = create_engine(settings.DATABASE_URL, "primary")
+# Không cấu hình replica thì đọc cũng đi vào primary (dùng chung pool)
+read_engine = create_engine(settings.DATABASE_REPLICA_URL, "replica") if settings.DATABASE_REPLICA_URL else engine
+
+if settings.METRICS_ENABLED:
+    # Mức dùng connection pool: checkedout chạm size + max_overflow là pool đã bão hòa
+    def _pool_states():
+        engines = {"primary": engine, "replica": read_engine} if read_engine is not engine else {"primary": engine}
+        states = {}
+        for name, pool_engine in engines.items():
+            pool = pool_engine.pool
+            states[(name, "checked_out")] = pool.checkedout()
+            states[(name, "idle")] = pool.checkedin()
+            states[(name, "size")] = pool.size()
+            states[(name, "overflow")] = pool.overflow()
+        return states
+
+    metrics.register_gauge("db_pool_connections", "Trạng thái connection pool", _pool_states, ("pool", "state"))
 
-engine = create_async_engine(settings.DATABASE_URL, echo=False)
 AsyncSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+# Session chỉ đọc. Replica có thể trễ primary một chút (thường vài ms): dữ liệu vừa ghi
+# có thể chưa thấy, chỗ nào cần chắc chắn thì hỏi lại primary (xem has_replica).
+ReadSessionLocal = async_sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
+
+def has_replica() -> bool:
+    return read_engine is not engine
 
 class Base(DeclarativeBase):
     pass
 
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+# Cho endpoint chỉ đọc (không commit gì)
+async def get_read_db():
+    async with ReadSessionLocal() as session:
+        yield session
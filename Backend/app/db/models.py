@@ -1,8 +1,9 @@
 import uuid6
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, BigInteger
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, BigInteger, Integer, SmallInteger, LargeBinary, Index
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.db.base import Base
+from app.core.blobstore import physical_path
 
 class User(Base):
     __tablename__ = "users"
@@ -12,10 +13,36 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     root_folder_id = Column(UUID(as_uuid=True), nullable=True) # Trỏ logic sang files
     is_active = Column(Boolean, default=True)
+    # Bộ đếm dung lượng (app/core/usage.py), quota NULL = mặc định trong cấu hình
+    used_bytes = Column(BigInteger, nullable=False, default=0, server_default="0")
+    file_count = Column(BigInteger, nullable=False, default=0, server_default="0")
+    quota_bytes = Column(BigInteger, nullable=True)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0") # app/core/changes.py
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Blob(Base):
+    # Nội dung file lưu theo SHA-256, nhiều FileItem có thể dùng chung 1 blob
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=1)
+    encoding = Column(String(16), nullable=True) # NULL / 'identity' = nguyên bản, 'zstd' = nén (app.core.compression)
+    stored_bytes = Column(BigInteger, nullable=True)
+    compression_level = Column(SmallInteger, nullable=True)
+    compressed_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class FileItem(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # Phục vụ /list: lọc theo folder, sắp xếp + phân trang keyset theo (type, name, id)
+        Index("idx_files_listing", "owner_id", "parent_id", "type", "name", "id"),
+        # Cây con = 1 khoảng liên tục của path (xem app/core/tree.py)
+        Index("idx_files_path", "owner_id", "path"),
+        # /search: tìm chuỗi con trong tên (cần extension pg_trgm)
+        Index("idx_files_name_trgm", text("lower(name) gin_trgm_ops"), postgresql_using="gin"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid6.uuid7)
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -23,16 +50,80 @@ class FileItem(Base):
     
     name = Column(String, nullable=False)
     type = Column(String, nullable=False, index=True) # 'file' hoặc 'folder'
+
+    # Materialized path: id hex của tổ tiên + chính nó, VD "<root>/<folder>/<file>/"
+    path = Column(String(collation="C"), nullable=False)
+    depth = Column(Integer, nullable=False, default=0) # Home = 0
     
     mime_type = Column(String, nullable=True)
     size_bytes = Column(BigInteger, default=0)
+    blob_hash = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True) # NULL = file cũ / folder
+    version = Column(Integer, nullable=False, default=1, server_default="1") # Bản cũ: FileVersion
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     @property
     def get_physical_path(self):
-        # Đường dẫn vật lý: storage/completed/<owner_id>/<file_id>
+        # Đường dẫn vật lý (storage backend local): storage/blobs/<ab>/<cd>/<sha256>
+        # (file cũ chưa có blob: storage/completed/<owner_id>/<file_id>)
+        # None nếu blob nằm ở backend từ xa (S3): đọc qua app.core.blobstore
         if self.type == 'folder':
             return None
-        return f"storage/completed/{str(self.owner_id)}/{str(self.id)}"
\ No newline at end of file
+        return physical_path(self.owner_id, self.id, self.blob_hash)
+
+class FileVersion(Base):
+    # Nội dung cũ của file sau khi bị thay bằng upload delta (giữ 1 tham chiếu tới blob)
+    __tablename__ = "file_versions"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid6.uuid7)
+    file_id = Column(UUID(as_uuid=True), ForeignKey("files.id", ondelete="CASCADE"), nullable=False)
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    blob_hash = Column(String(64), ForeignKey("blobs.sha256"), nullable=False, index=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    replaced_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class BlobBlock(Base):
+    # Block chia theo nội dung (app/core/delta.py) của 1 blob
+    __tablename__ = "blob_blocks"
+
+    blob_hash = Column(String(64), ForeignKey("blobs.sha256", ondelete="CASCADE"), primary_key=True)
+    idx = Column(Integer, primary_key=True)
+    offset_bytes = Column(BigInteger, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    block_hash = Column(String(64), nullable=False)
+
+class Change(Base):
+    # Nhật ký thay đổi: client hỏi "các thay đổi sau seq X" thay vì /list lại mọi folder
+    __tablename__ = "changes"
+
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(BigInteger, primary_key=True)
+    file_id = Column(UUID(as_uuid=True), nullable=False)
+    action = Column(String(10), nullable=False) # upsert | delete
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class UploadSession(Base):
+    # Phiên upload theo chunk: các chunk ghi thẳng vào storage/temp/<id>.upload
+    # tại offset chunk_index * chunk_size, bitmap ghi nhận chunk đã nhận
+    __tablename__ = "upload_sessions"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid6.uuid7)
+    owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    parent_id = Column(UUID(as_uuid=True), nullable=True)
+
+    filename = Column(String, nullable=False)
+    mime_type = Column(String, nullable=True)
+    total_size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    total_chunks = Column(Integer, nullable=False)
+
+    received = Column(LargeBinary, nullable=False) # Bitmap: bit i = chunk i đã nhận
+    received_count = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="uploading") # uploading | finalizing | completed
+    file_id = Column(UUID(as_uuid=True), nullable=True) # FileItem tạo ra khi hoàn tất
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
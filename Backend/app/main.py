@@ -1,9 +1,32 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.core.config import settings
-from app.routers import auth, files
+from app.core.usage import QuotaMiddleware
+from app.core import thumbnails, storage_gc, cold_compress, changes, delta, metrics, diskio, blobcache, deps
+from app.routers import auth, files, uploads, batch, versions, changes as changes_router
 
-app = FastAPI(title=settings.PROJECT_NAME)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Dọn file rác dưới nền (hàng đợi xóa + đối soát định kỳ)
+    storage_gc.start()
+    # Nén lại dữ liệu cũ (khi bật COMPRESSION_ENABLED)
+    cold_compress.start()
+    # Báo thay đổi cho client đang long-poll / WebSocket (LISTEN), dọn nhật ký cũ
+    changes.start()
+    yield
+    await changes.stop()
+    await cold_compress.stop()
+    await storage_gc.stop()
+    # Tắt process pool tạo thumbnail / chia block upload delta khi server dừng
+    thumbnails.shutdown()
+    delta.shutdown()
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
+
+# Upload multipart: kiểm tra quota theo Content-Length trước khi FastAPI đọc body
+app.add_middleware(QuotaMiddleware)
 
 # Cấu hình CORS để Android/Tkinter gọi được
 app.add_middleware(
@@ -14,8 +37,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.METRICS_ENABLED:
+    # Đo latency / số byte / số query theo từng route (lớp ngoài cùng)
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    # Độ bão hòa các pool chạy nền
+    metrics.register_gauge(
+        "disk_io_jobs", "Job đọc/ghi đĩa: đã vào thread pool / đang chờ slot",
+        lambda: {(state,): value for state, value in diskio.io_stats().items()}, ("state",)
+    )
+    metrics.register_gauge("thumbnail_jobs_in_flight", "Số thumbnail đang tạo", thumbnails.in_flight)
+    metrics.register_gauge("storage_gc_pending", "Số file đang chờ xóa", lambda: storage_gc.gc_stats()["pending"])
+    # Cache user theo token: hit_ratio thấp = mỗi request phải hỏi DB
+    metrics.register_gauge(
+        "auth_cache", "Cache xác thực user theo token (size, hits, misses, hit_ratio...)",
+        lambda: {(stat,): value for stat, value in deps.auth_cache_stats().items()}, ("stat",)
+    )
+    # Cache nội dung trong RAM của /content: hit_ratio, bytes_served = số byte không phải đọc đĩa
+    metrics.register_gauge(
+        "blob_cache", "Cache nội dung file nhỏ trong RAM (hits, misses, bytes, bytes_served, hit_ratio...)",
+        lambda: {(stat,): value for stat, value in blobcache.stats().items()}, ("stat",)
+    )
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["Auth"])
 app.include_router(files.router, prefix=f"{settings.API_V1_STR}/files", tags=["Files"])
+app.include_router(batch.router, prefix=f"{settings.API_V1_STR}/files", tags=["Files"])
+app.include_router(versions.router, prefix=f"{settings.API_V1_STR}/files", tags=["Files"])
+app.include_router(uploads.router, prefix=f"{settings.API_V1_STR}/uploads", tags=["Uploads"])
+app.include_router(changes_router.router, prefix=f"{settings.API_V1_STR}/changes", tags=["Changes"])
 
 @app.get("/")
 def root():
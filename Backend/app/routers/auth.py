@@ -8,11 +8,16 @@ from datetime import timedelta
 from app.db.base import get_db
 from app.db.models import User, FileItem
 from app.schemas.user import UserCreate, UserResponse, Token
-from app.core.security import get_password_hash, verify_password, create_access_token
+from app.core.security import hash_password, verify_and_update_password, create_access_token
 from app.core.config import settings
+from app.core.tree import item_path
 
 router = APIRouter()
 
+# Số lượt đăng nhập đang xử lý theo email: đoán mật khẩu 1 tài khoản bằng nhiều request song song
+# chỉ chiếm tối đa LOGIN_MAX_CONCURRENT_PER_ACCOUNT thread bcrypt, phần còn lại bị trả 429 ngay
+_logins_in_flight: dict[str, int] = {}
+
 @router.post("/register", response_model=UserResponse)
 async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.email == user_in.email))
@@ -21,12 +26,13 @@ async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
 
     new_user_id = uuid6.uuid7()
     new_root_id = uuid6.uuid7()
+    hashed_password = await hash_password(user_in.password)
     
     new_user = User(
         id=new_user_id,
         email=user_in.email,
         username=user_in.username,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=hashed_password,
         root_folder_id=new_root_id
     )
     
@@ -36,7 +42,9 @@ async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
         parent_id=None,
         name="Home",
         type="folder",
-        size_bytes=0
+        size_bytes=0,
+        path=item_path(None, new_root_id),
+        depth=0
     )
     
     try:
@@ -52,15 +60,39 @@ async def register(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.email == form_data.username))
-    user = result.scalar_one_or_none()
-    
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    account = form_data.username.strip().lower()
+    if _logins_in_flight.get(account, 0) >= settings.LOGIN_MAX_CONCURRENT_PER_ACCOUNT:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Đang có quá nhiều lượt đăng nhập vào tài khoản này, thử lại sau",
+            headers={"Retry-After": "1"},
+        )
+    _logins_in_flight[account] = _logins_in_flight.get(account, 0) + 1
+    try:
+        result = await db.execute(select(User).where(User.email == form_data.username))
+        user = result.scalar_one_or_none()
+        # Trả kết nối về pool trong lúc chờ bcrypt
+        await db.commit()
+
+        valid, new_hash = False, None
+        if user:
+            valid, new_hash = await verify_and_update_password(form_data.password, user.hashed_password)
+    finally:
+        _logins_in_flight[account] -= 1
+        if not _logins_in_flight[account]:
+            del _logins_in_flight[account]
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Sai email hoặc mật khẩu",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Hash theo cost cũ (đổi BCRYPT_ROUNDS) -> lưu lại hash mới, lúc này mới có mật khẩu gốc
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
         
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -0,0 +1,240 @@
+import uuid
+from collections import Counter
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.deps import get_current_user, CurrentUser
+from app.core.blobstore import legacy_path, release_blobs
+from app.core.changes import record_changes
+from app.core.versions import version_blob_refs
+from app.core.storage_gc import enqueue_unlink, enqueue_blob_delete
+from app.core.thumbnails import thumbnail_paths
+from app.core.tree import PATH_SEP, ancestor_paths, move_subtrees
+from app.core.usage import add_usage
+from app.db.base import get_db
+from app.routers.files import invalidate_content
+
+# Thao tác hàng loạt (chọn 500 ảnh rồi xóa/di chuyển): 1 request, 1 transaction.
+# Mỗi loại thao tác chạy bằng vài câu SQL theo tập (unnest / = ANY) nên số query
+# gần như không đổi dù batch có 1 hay 1000 item. Item lỗi (không tồn tại, trùng tên...)
+# được báo riêng trong kết quả, các item còn lại vẫn thực hiện.
+router = APIRouter()
+
+
+class BatchOperation(BaseModel):
+    op: Literal["rename", "move", "delete"]
+    id: str
+    name: str | None = None # rename: tên mới
+    parent_id: str | None = None # move: folder đích, "root" = Home
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(..., min_length=1, max_length=settings.BATCH_MAX_ITEMS)
+
+
+# {(parent_id, name): id} của các item đang giữ những tên này
+async def names_in_use(db, owner_id, pairs) -> dict:
+    if not pairs:
+        return {}
+    result = await db.execute(text("""
+        SELECT f.parent_id, f.name, f.id
+        FROM files f
+        JOIN unnest(CAST(:parent_ids AS uuid[]), CAST(:names AS varchar[])) AS p(parent_id, name)
+          ON f.parent_id = p.parent_id AND f.name = p.name
+        WHERE f.owner_id = :owner_id
+    """), {"owner_id": owner_id, "parent_ids": [p for p, _ in pairs], "names": [n for _, n in pairs]})
+    return {(parent_id, name): item_id for parent_id, name, item_id in result.all()}
+
+
+@router.post("/items/batch")
+async def batch_items(
+    batch_in: BatchRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    owner_id = current_user.id
+    ops = batch_in.operations
+    results = [{"id": op.id, "op": op.op, "status": "ok"} for op in ops]
+
+    def fail(index: int, detail: str):
+        results[index]["status"] = "error"
+        results[index]["detail"] = detail
+
+    # 1. Kiểm tra đầu vào, mỗi item chỉ được xuất hiện 1 lần
+    parsed, seen = {}, set()
+    for i, op in enumerate(ops):
+        try:
+            item_id = uuid.UUID(op.id)
+        except ValueError:
+            fail(i, "id không hợp lệ")
+            continue
+        if item_id in seen:
+            fail(i, "Item xuất hiện nhiều lần trong batch")
+        elif op.op == "rename" and not op.name:
+            fail(i, "Thiếu tên mới")
+        elif op.op == "move" and not op.parent_id:
+            fail(i, "Thiếu folder đích")
+        else:
+            parsed[i] = item_id
+            seen.add(item_id)
+
+    # 2. Lấy mọi item trong 1 query
+    items = {}
+    if parsed:
+        result = await db.execute(text("""
+            SELECT id, parent_id, name, type, path, blob_hash, size_bytes FROM files
+            WHERE owner_id = :owner_id AND id = ANY(CAST(:ids AS uuid[]))
+        """), {"owner_id": owner_id, "ids": list(parsed.values())})
+        items = {row.id: row for row in result.all()}
+
+    pending = {"rename": [], "move": [], "delete": []}
+    for i, item_id in parsed.items():
+        row = items.get(item_id)
+        if row is None:
+            fail(i, "Không tìm thấy file/folder")
+        elif row.parent_id is None and ops[i].op != "rename":
+            fail(i, "Không thể di chuyển hoặc xóa thư mục gốc")
+        else:
+            pending[ops[i].op].append((i, row))
+
+    renamed_ids, moved_ids, deleted_ids = [], [], []
+    deleted_file_ids, freed_blobs, unlink_paths = [], [], []
+    try:
+        # 3. Đổi tên: kiểm tra trùng tên trong cùng folder (kể cả giữa các item trong batch)
+        renames = pending["rename"]
+        taken = await names_in_use(db, owner_id, [(row.parent_id, ops[i].name) for i, row in renames])
+        accepted = []
+        for i, row in renames:
+            key = (row.parent_id, ops[i].name)
+            if taken.get(key, row.id) != row.id:
+                fail(i, "Tên đã tồn tại trong thư mục")
+                continue
+            taken[key] = row.id
+            accepted.append((row.id, ops[i].name))
+        if accepted:
+            await db.execute(text("""
+                UPDATE files f SET name = r.name, updated_at = now()
+                FROM unnest(CAST(:ids AS uuid[]), CAST(:names AS varchar[])) AS r(id, name)
+                WHERE f.id = r.id AND f.owner_id = :owner_id
+            """), {"owner_id": owner_id, "ids": [a for a, _ in accepted], "names": [n for _, n in accepted]})
+            renamed_ids = [a for a, _ in accepted]
+
+        # 4. Di chuyển
+        moves = pending["move"]
+        if moves:
+            targets = {}
+            for i, row in moves:
+                parent_id = ops[i].parent_id
+                try:
+                    targets[i] = current_user.root_folder_id if parent_id == "root" else uuid.UUID(parent_id)
+                except ValueError:
+                    targets[i] = None
+            result = await db.execute(text("""
+                SELECT id, path FROM files
+                WHERE owner_id = :owner_id AND type = 'folder' AND id = ANY(CAST(:ids AS uuid[]))
+            """), {"owner_id": owner_id, "ids": list({t for t in targets.values() if t})})
+            target_paths = dict(result.all())
+
+            candidates = []
+            for i, row in moves:
+                target_path = target_paths.get(targets[i])
+                if target_path is None:
+                    fail(i, "Không tìm thấy thư mục đích")
+                elif target_path.startswith(row.path):
+                    fail(i, "Không thể di chuyển folder vào chính nó")
+                elif targets[i] != row.parent_id:
+                    candidates.append((i, row))
+
+            # Các cây con được di chuyển không được lồng nhau / chứa folder đích của nhau
+            # (path tính trước khi di chuyển sẽ sai)
+            moving_paths = {row.path for _, row in candidates}
+            valid = []
+            for i, row in candidates:
+                target_path = target_paths[targets[i]]
+                if any(path in moving_paths for path in ancestor_paths(row.path)):
+                    fail(i, "Folder cha của item cũng đang được di chuyển")
+                elif any(path in moving_paths for path in ancestor_paths(target_path) + [target_path]):
+                    fail(i, "Thư mục đích cũng đang được di chuyển")
+                else:
+                    valid.append((i, row))
+
+            taken = await names_in_use(db, owner_id, [(targets[i], row.name) for i, row in valid])
+            move_list = []
+            for i, row in valid:
+                key = (targets[i], row.name)
+                if taken.get(key, row.id) != row.id:
+                    fail(i, "Tên đã tồn tại trong thư mục đích")
+                    continue
+                taken[key] = row.id
+                move_list.append((row.id, row.path, targets[i], target_paths[targets[i]]))
+            await move_subtrees(db, owner_id, move_list)
+            moved_ids = [item_id for item_id, _, _, _ in move_list]
+
+        # 5. Xóa: chỉ xóa các item "trên cùng" (item nằm trong folder cũng bị xóa sẽ mất theo CASCADE)
+        deletes = pending["delete"]
+        if deletes:
+            if moves:
+                # Folder cha có thể vừa được di chuyển -> lấy lại path mới
+                result = await db.execute(text("""
+                    SELECT id, path FROM files WHERE owner_id = :owner_id AND id = ANY(CAST(:ids AS uuid[]))
+                """), {"owner_id": owner_id, "ids": [row.id for _, row in deletes]})
+                paths = dict(result.all())
+            else:
+                paths = {row.id: row.path for _, row in deletes}
+            deleting = set(paths.values())
+            tops = [row for _, row in deletes if not any(p in deleting for p in ancestor_paths(paths[row.id]))]
+
+            # Gom file của mọi cây con trước khi CASCADE xóa mất
+            files = [(row.id, row.blob_hash, row.size_bytes) for row in tops if row.type == "file"]
+            folder_paths = [paths[row.id] for row in tops if row.type == "folder"]
+            if folder_paths:
+                result = await db.execute(text("""
+                    SELECT f.id, f.blob_hash, f.size_bytes
+                    FROM files f
+                    JOIN unnest(CAST(:paths AS varchar[]), CAST(:uppers AS varchar[])) AS d(path, upper)
+                      ON f.path >= d.path AND f.path < d.upper
+                    WHERE f.owner_id = :owner_id AND f.type = 'file'
+                """), {
+                    "owner_id": owner_id,
+                    "paths": folder_paths,
+                    "uppers": [path[:-1] + chr(ord(PATH_SEP) + 1) for path in folder_paths],
+                })
+                files += result.all()
+
+            # Cả tham chiếu của các bản cũ (file_versions bị CASCADE xóa theo)
+            blob_refs = Counter(blob_hash for _, blob_hash, _ in files if blob_hash)
+            blob_refs += await version_blob_refs(db, owner_id, [file_id for file_id, _, _ in files])
+
+            await db.execute(text("""
+                DELETE FROM files WHERE owner_id = :owner_id AND id = ANY(CAST(:ids AS uuid[]))
+            """), {"owner_id": owner_id, "ids": [row.id for row in tops]})
+            freed_blobs = await release_blobs(db, blob_refs)
+            deleted_ids = [row.id for row in tops]
+            unlink_paths = [legacy_path(owner_id, file_id) for file_id, blob_hash, _ in files if not blob_hash]
+            await add_usage(db, owner_id, -sum(size or 0 for _, _, size in files), -len(files))
+            deleted_file_ids = [file_id for file_id, _, _ in files]
+            unlink_paths += thumbnail_paths(deleted_file_ids)
+
+        await record_changes(db, owner_id, upserts=renamed_ids + moved_ids, deletes=deleted_ids)
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Xung đột khi thực hiện batch: " + str(e.orig))
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Lỗi batch: " + str(e))
+
+    # DB đã commit: xóa file vật lý dưới nền
+    invalidate_content(owner_id, renamed_ids, drop_data=False)
+    invalidate_content(owner_id, deleted_file_ids)
+    enqueue_blob_delete(freed_blobs)
+    enqueue_unlink(unlink_paths)
+
+    failed = sum(1 for r in results if r["status"] == "error")
+    return {"results": results, "succeeded": len(results) - failed, "failed": failed}
@@ -0,0 +1,117 @@
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import changes
+from app.core.config import settings
+from app.core.deps import get_current_user, authenticate_token, CurrentUser
+from app.db.base import get_db, AsyncSessionLocal
+from app.db.models import FileItem
+from app.routers.files import LIST_COLUMNS, list_row
+
+# Đồng bộ delta cho client (Android / Tkinter):
+# 1. Lần đầu: GET /changes (không cursor) lấy cursor hiện tại, rồi /list toàn bộ cây như cũ.
+# 2. Các lần sau: GET /changes?cursor=...&wait=30 -> cây không đổi thì chỉ là 1 request nhỏ
+#    (được giữ tới khi có thay đổi hoặc hết wait giây). has_more=true thì gọi tiếp ngay.
+#    410: cursor đã quá cũ (nhật ký bị dọn) -> làm lại bước 1.
+# Hoặc mở WebSocket /changes/ws?token=...&cursor=... để được báo cursor mới, rồi GET /changes.
+# Đọc từ primary (không dùng replica): vừa được báo có thay đổi thì phải đọc thấy ngay.
+router = APIRouter()
+
+CURSOR_EXPIRED = "Cursor đã hết hạn, cần đồng bộ lại toàn bộ"
+
+
+@router.get("")
+async def get_changes(
+    cursor: int | None = Query(None, ge=0),
+    limit: int = Query(settings.CHANGES_BATCH_SIZE, ge=1, le=settings.CHANGES_BATCH_SIZE),
+    wait: int = Query(0, ge=0, le=settings.CHANGES_MAX_WAIT_SECONDS), # Long-poll: số giây chờ tối đa
+    with_thumbnails: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    if cursor is None:
+        return {"cursor": await changes.latest_seq(db, current_user.id), "has_more": False, "changes": []}
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    event = changes.subscribe(current_user.id)
+    try:
+        while True:
+            event.clear()
+            try:
+                latest, entries = await changes.read_changes(db, current_user.id, cursor, limit)
+            except changes.CursorExpired:
+                raise HTTPException(status_code=410, detail=CURSOR_EXPIRED)
+            remaining = deadline - loop.time()
+            if entries or remaining <= 0:
+                break
+            # Trả kết nối DB về pool trong lúc chờ
+            await db.commit()
+            await changes.wait_for_change(event, remaining)
+    finally:
+        changes.unsubscribe(current_user.id, event)
+
+    compacted = changes.compact(entries)
+    upsert_ids = [file_id for file_id, action in compacted if action == "upsert"]
+    items = {}
+    if upsert_ids:
+        result = await db.execute(select(*LIST_COLUMNS).where(
+            FileItem.owner_id == current_user.id,
+            FileItem.id.in_(upsert_ids)
+        ))
+        items = {row.id: row for row in result.all()}
+
+    out = []
+    for file_id, action in compacted:
+        row = items.get(file_id)
+        if action == "upsert" and row is not None:
+            out.append({"op": "upsert", **list_row(row, with_thumbnails)})
+        else:
+            # Item tạo rồi bị xóa theo folder cha trong cùng đoạn -> client chỉ cần bỏ đi
+            out.append({"op": "delete", "id": str(file_id)})
+    new_cursor = entries[-1][0] if entries else cursor
+    return JSONResponse({"cursor": new_cursor, "has_more": new_cursor < latest, "changes": out})
+
+
+# Kênh báo cursor mới: server gửi {"cursor": n} mỗi khi có thay đổi (lần đầu gửi ngay nếu
+# cursor client gửi lên đã cũ). Client không cần gửi gì, chỉ giữ kết nối.
+@router.websocket("/ws")
+async def changes_socket(websocket: WebSocket, token: str, cursor: int = 0):
+    try:
+        current_user = await authenticate_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    # Phát hiện client đóng kết nối trong lúc đang chờ thay đổi
+    closed = asyncio.ensure_future(_wait_closed(websocket))
+    event = changes.subscribe(current_user.id)
+    try:
+        while not closed.done():
+            event.clear()
+            async with AsyncSessionLocal() as db:
+                latest = await changes.latest_seq(db, current_user.id)
+            if latest != cursor:
+                cursor = latest
+                await websocket.send_json({"cursor": cursor})
+            waiter = asyncio.ensure_future(changes.wait_for_change(event, changes.FALLBACK_POLL_SECONDS))
+            await asyncio.wait({waiter, closed}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        changes.unsubscribe(current_user.id, event)
+        closed.cancel()
+
+
+async def _wait_closed(websocket: WebSocket):
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
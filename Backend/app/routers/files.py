@@ -1,20 +1,46 @@
 import os
-import shutil
+import json
+import uuid
+import base64
+from datetime import datetime
+from functools import partial
 import uuid6
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from dataclasses import dataclass
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from sqlalchemy import select
-from app.db.base import get_db
-from app.db.models import User, FileItem
-from app.core.deps import get_current_user
-from fastapi.responses import FileResponse
+from collections import Counter
+from sqlalchemy import select, insert, func, tuple_, text
+from app.db.base import get_db, get_read_db, has_replica, AsyncSessionLocal
+from app.db.models import FileItem
+from app.core.deps import get_current_user, CurrentUser
+from app.core.config import settings
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 import mimetypes
 from fastapi import Response
-import zipfile
-from fastapi import BackgroundTasks
-from sqlalchemy import text
 from pydantic import BaseModel # Thêm import này
+from app.core.responses import content_disposition, http_date, is_not_modified, parse_range, negotiated_response
+from app.core.cache import TTLCache
+from app.core.zipstream import iter_zip
+from app.core.blobstore import (
+    physical_path, locate_blob, read_blob_range, open_content, legacy_path, new_temp_path, copy_and_hash, write_file, merge_parts, copy_file, move_file,
+    prepare_blob, store_blob, acquire_blob, add_blob_refs, release_blobs
+)
+from app.core.diskio import run_io
+from app.core import metrics, blobcache
+from app.core.jobs import create_job, get_job, start_job
+from app.core.storage import backend
+from app.core.storage_gc import enqueue_unlink, enqueue_blob_delete
+from app.core.usage import add_usage, get_usage
+from app.core.changes import record_changes
+from app.core.versions import version_blob_refs
+from app.core.tree import (
+    item_path, path_depth, subtree_filter, get_folder_path, subtree_stats, move_subtree, display_folder_paths, PATH_SEP
+)
+from app.core.thumbnails import (
+    THUMBNAIL_SIZES, DEFAULT_THUMBNAIL_SIZE, supports_thumbnail, has_thumbnail,
+    ensure_thumbnail, schedule_thumbnail, thumbnail_paths
+)
 
 # ... (Các import khác giữ nguyên)
 
@@ -23,12 +49,11 @@ class FolderCreate(BaseModel):
     name: str
     parent_id: str | None = None
 router = APIRouter()
-STORAGE_BASE = "storage/completed"
 @router.post("/create_folder")
 async def create_folder(
     folder_in: FolderCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     # 1. Kiểm tra tên folder có trùng trong cùng thư mục cha không
     # (Optional - nhưng nên làm để tránh lỗi Unique Constraint của DB)
@@ -37,6 +62,7 @@ async def create_folder(
     
     # Xử lý parent_id
     pid = folder_in.parent_id if folder_in.parent_id and folder_in.parent_id != "root" else current_user.root_folder_id
+    path = item_path(await get_folder_path(db, current_user.id, pid), new_folder_id)
 
     new_folder = FileItem(
         id=new_folder_id,
@@ -45,11 +71,14 @@ async def create_folder(
         name=folder_in.name,
         type="folder", # Quan trọng: Đánh dấu là folder
         mime_type=None,
-        size_bytes=0
+        size_bytes=0,
+        path=path,
+        depth=path_depth(path)
     )
     
     try:
         db.add(new_folder)
+        await record_changes(db, current_user.id, upserts=[new_folder_id])
         await db.commit()
         await db.refresh(new_folder)
         return new_folder
@@ -61,24 +90,27 @@ async def upload_file(
     parent_id: str = Form(...),
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     new_file_id = uuid6.uuid7()
+
+    # Quota theo Content-Length đã được QuotaMiddleware kiểm tra trước khi nhận body
+
+    # Xử lý parent_id (nếu gửi lên chuỗi "root" hoặc rỗng thì lấy root mặc định)
+    # Kiểm tra folder cha trước khi ghi byte nào xuống đĩa
+    pid = parent_id if parent_id and parent_id != "root" else current_user.root_folder_id
+    path = item_path(await get_folder_path(db, current_user.id, pid), new_file_id)
+    # Không giữ kết nối DB trong lúc nhận dữ liệu / nén
+    await db.commit()
     
-    # Tạo folder cho user nếu chưa có: storage/completed/<owner_id>
-    user_storage_path = os.path.join(STORAGE_BASE, str(current_user.id))
-    os.makedirs(user_storage_path, exist_ok=True)
-    
-    # File name trên ổ cứng là UUID
-    final_file_path = os.path.join(user_storage_path, str(new_file_id))
+    # Ghi ra file tạm, vừa ghi vừa tính SHA-256 để đưa vào kho blob
+    temp_path = new_temp_path()
     
     try:
-        with open(final_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        file_size = os.path.getsize(final_file_path)
+        with metrics.stage("upload.write"):
+            file_size, sha256 = await run_io(copy_and_hash, file.file, temp_path)
+        metrics.stage_bytes.inc("upload.write", amount=file_size)
         
-        # Xử lý parent_id (nếu gửi lên chuỗi "root" hoặc rỗng thì lấy root mặc định)
         content_type = file.content_type
         
         # Nếu nó là generic (octet-stream) hoặc null -> Tự đoán dựa vào tên file
@@ -89,8 +121,12 @@ async def upload_file(
         
         # ---------------------------------------------
 
-        # Xử lý parent_id
-        pid = parent_id if parent_id and parent_id != "root" else current_user.root_folder_id
+        # Nén + ghi vào kho trước khi mở transaction (nội dung trùng blob đã có -> không ghi thêm)
+        with metrics.stage("blob.store"):
+            blob = await prepare_blob(temp_path, sha256, file_size, content_type)
+
+        # Tăng ref_count của blob
+        await store_blob(db, blob)
 
         new_file_record = FileItem(
             id=new_file_id,
@@ -99,76 +135,534 @@ async def upload_file(
             name=file.filename,
             type="file",
             mime_type=content_type, # <-- Dùng biến đã được xử lý
-            size_bytes=file_size
+            size_bytes=file_size,
+            blob_hash=sha256,
+            path=path,
+            depth=path_depth(path)
         )
         db.add(new_file_record)
+        # Cộng dung lượng + kiểm tra quota (khóa dòng user)
+        await add_usage(db, current_user.id, file_size, 1)
+        await record_changes(db, current_user.id, upserts=[new_file_id])
         await db.commit()
         await db.refresh(new_file_record)
+
+        # Tạo sẵn thumbnail cho ảnh (chạy nền trên process pool)
+        schedule_thumbnail(current_user.id, new_file_id, sha256, content_type)
         
         return {
             "id": new_file_record.id,
             "name": new_file_record.name,
             "size": new_file_record.size_bytes,
+            "sha256": sha256,
             "status": "success"
         }
 
     except Exception as e:
-        if os.path.exists(final_file_path):
-            os.remove(final_file_path)
+        await db.rollback()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
 
+class InstantUpload(BaseModel):
+    sha256: str
+    name: str
+    parent_id: str | None = None
+    mime_type: str | None = None
+
+# Upload tức thì: nội dung đã có trên server (cùng SHA-256) thì chỉ tạo bản ghi
+@router.post("/upload_instant")
+async def upload_instant(
+    file_in: InstantUpload,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    sha256 = file_in.sha256.lower()
+    content_type = file_in.mime_type
+    if not content_type or content_type == "application/octet-stream":
+        guessed_type, _ = mimetypes.guess_type(file_in.name)
+        if guessed_type:
+            content_type = guessed_type
+
+    pid = file_in.parent_id if file_in.parent_id and file_in.parent_id != "root" else current_user.root_folder_id
+    new_file_id = uuid6.uuid7()
+    path = item_path(await get_folder_path(db, current_user.id, pid), new_file_id)
+
+    try:
+        file_size = await acquire_blob(db, sha256)
+        if file_size is None:
+            # Client cần upload bình thường qua /upload hoặc /upload_chunk
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Blob not found")
+
+        new_file_record = FileItem(
+            id=new_file_id,
+            owner_id=current_user.id,
+            parent_id=pid,
+            name=file_in.name,
+            type="file",
+            mime_type=content_type,
+            size_bytes=file_size,
+            blob_hash=sha256,
+            path=path,
+            depth=path_depth(path)
+        )
+        db.add(new_file_record)
+        await add_usage(db, current_user.id, file_size, 1)
+        await record_changes(db, current_user.id, upserts=[new_file_id])
+        await db.commit()
+        await db.refresh(new_file_record)
+
+        return {
+            "id": new_file_record.id,
+            "name": new_file_record.name,
+            "size": new_file_record.size_bytes,
+            "sha256": sha256,
+            "status": "success"
+        }
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Các cột client cần khi hiển thị danh sách (không load cả ORM object)
+LIST_COLUMNS = (
+    FileItem.id, FileItem.parent_id, FileItem.name, FileItem.type,
+    FileItem.mime_type, FileItem.size_bytes, FileItem.created_at, FileItem.updated_at,
+)
+# Thứ tự hiển thị: Folder lên trước, rồi tới File
+TYPE_ORDER = ("folder", "file")
+
+def encode_cursor(row) -> str:
+    raw = json.dumps([row.type, row.name, str(row.id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        item_type, name, item_id = json.loads(raw)
+        return item_type, name, uuid.UUID(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor không hợp lệ")
+
+# Dựng dict JSON trực tiếp từ tuple của DB (bỏ qua jsonable_encoder)
+def list_row(row, with_thumbnails: bool) -> dict:
+    item = {
+        "id": str(row.id),
+        "parent_id": str(row.parent_id) if row.parent_id else None,
+        "name": row.name,
+        "type": row.type,
+        "mime_type": row.mime_type,
+        "size_bytes": row.size_bytes,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+    }
+    if with_thumbnails:
+        item["has_thumbnail"] = row.type == "file" and supports_thumbnail(row.mime_type) and has_thumbnail(row.id)
+    return item
+
 @router.get("/list")
 async def list_files(
     folder_id: str = None, # Nếu null thì lấy root
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    with_thumbnails: bool = False, # Thêm trường has_thumbnail cho từng file
+    limit: int | None = Query(None, ge=1, le=1000), # Có limit -> trả về từng trang
+    cursor: str | None = None, # next_cursor của trang trước
+    with_total: bool = False, # Đếm tổng số item trong folder (tốn thêm 1 query)
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     # Nếu không gửi folder_id, mặc định lấy root của user
     target_folder_id = folder_id if folder_id else current_user.root_folder_id
-    
-    # Query lấy tất cả file có parent_id tương ứng
-    query = select(FileItem).where(
+
+    in_folder = (
         FileItem.owner_id == current_user.id,
         FileItem.parent_id == target_folder_id
-    ).order_by(
-        FileItem.type.desc(), # Folder lên trước
-        FileItem.name.asc()   # Tên A-Z
     )
-    
-    result = await db.execute(query)
-    files = result.scalars().all()
-    
-    return files
+
+    # Không phân trang: trả về cả folder như cũ (mảng JSON)
+    if limit is None and cursor is None:
+        query = select(*LIST_COLUMNS).where(*in_folder).order_by(
+            FileItem.type.desc(), # Folder lên trước
+            FileItem.name.asc(),  # Tên A-Z
+            FileItem.id.asc()
+        )
+        result = await db.execute(query)
+        return JSONResponse([list_row(row, with_thumbnails) for row in result.all()])
+
+    limit = limit or 100
+
+    # Keyset pagination theo (type, name, id): mỗi type là 1 đoạn liên tục trong index
+    # (owner_id, parent_id, type, name, id) nên mọi trang đều là 1 range scan,
+    # không phụ thuộc trang đó nằm sâu bao nhiêu trong folder.
+    start_type, after = TYPE_ORDER[0], None
+    if cursor:
+        cursor_type, cursor_name, cursor_id = decode_cursor(cursor)
+        if cursor_type not in TYPE_ORDER:
+            raise HTTPException(status_code=400, detail="cursor không hợp lệ")
+        start_type, after = cursor_type, (cursor_name, cursor_id)
+
+    rows = []
+    for item_type in TYPE_ORDER[TYPE_ORDER.index(start_type):]:
+        query = select(*LIST_COLUMNS).where(*in_folder, FileItem.type == item_type)
+        if after is not None:
+            query = query.where(tuple_(FileItem.name, FileItem.id) > tuple_(*after))
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        query = query.order_by(FileItem.name.asc(), FileItem.id.asc()).limit(limit + 1 - len(rows))
+        result = await db.execute(query)
+        rows.extend(result.all())
+        after = None
+        if len(rows) > limit:
+            break
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    page = {
+        "items": [list_row(row, with_thumbnails) for row in rows],
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+    }
+    if with_total:
+        result = await db.execute(select(func.count()).select_from(FileItem).where(*in_folder))
+        page["total"] = result.scalar_one()
+    return JSONResponse(page)
+
+# Cột của GET /tree, theo thứ tự trong mỗi dòng
+TREE_FIELDS = ("id", "parent_id", "name", "type", "mime_type", "size_bytes", "created_at", "updated_at", "depth")
+
+# Cả cây con của folder (tới `depth` tầng) trong 1 request: client vẽ cây / đồng bộ folder
+# không phải gọi /list cho từng folder. Chỉ 1 range query trên index (owner_id, path).
+# Dạng cột cho gọn: {"columns": [...], "rows": [[...], ...]}, depth tính từ folder (con = 1).
+# Dòng theo thứ tự path: folder cha luôn đứng trước con cháu (anh em xếp theo id, không theo tên),
+# nên cắt trang ở đâu thì phần đã nhận vẫn là 1 cây liền. JSON (orjson) hoặc msgpack theo Accept.
+@router.get("/tree")
+async def list_tree(
+    request: Request,
+    folder_id: str | None = None, # Nếu null thì lấy root
+    depth: int | None = Query(None, ge=1), # 1 = chỉ con trực tiếp như /list, null = cả cây
+    limit: int = Query(settings.TREE_MAX_ITEMS, ge=1, le=settings.TREE_MAX_ITEMS),
+    cursor: str | None = None, # next_cursor của lần trước
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    folder_path = await get_folder_path(db, current_user.id, folder_id or current_user.root_folder_id)
+    base_depth = path_depth(folder_path)
+
+    query = select(*LIST_COLUMNS, (FileItem.depth - base_depth).label("depth"), FileItem.path).where(
+        *subtree_filter(current_user.id, folder_path),
+        FileItem.depth > base_depth
+    )
+    if depth is not None:
+        query = query.where(FileItem.depth <= base_depth + depth)
+    if cursor:
+        try:
+            after = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        except ValueError:
+            after = ""
+        # Cursor là path của dòng cuối lần trước, phải nằm trong cây con này
+        if not after.startswith(folder_path) or not after.endswith(PATH_SEP):
+            raise HTTPException(status_code=400, detail="cursor không hợp lệ")
+        query = query.where(FileItem.path > after)
+    result = await db.execute(query.order_by(FileItem.path).limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return negotiated_response(request.headers, {
+        "folder_id": str(uuid.UUID(folder_path.split(PATH_SEP)[-2])),
+        "columns": TREE_FIELDS,
+        "rows": [row[:-1] for row in rows], # Bỏ cột path
+        "next_cursor": base64.urlsafe_b64encode(rows[-1].path.encode()).decode().rstrip("=") if has_more else None,
+    })
+
+# Tìm theo tên trong toàn bộ cây của user (hoặc trong 1 folder).
+# Dùng index trigram trên lower(name) nên "chứa chuỗi con" vẫn là index scan.
+# Kết quả mới nhất trước (id là uuid7 tăng theo thời gian), keyset pagination theo id.
+@router.get("/search")
+async def search_files(
+    q: str = Query(..., min_length=1, max_length=255),
+    type: str | None = Query(None, pattern="^(file|folder)$"),
+    mime: str | None = None, # "image/jpeg" hoặc tiền tố "image/"
+    min_size: int | None = Query(None, ge=0),
+    max_size: int | None = Query(None, ge=0),
+    modified_after: datetime | None = None,
+    modified_before: datetime | None = None,
+    folder_id: str | None = None, # Chỉ tìm trong cây con của folder này
+    with_thumbnails: bool = False,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None, # next_cursor của trang trước
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    # Escape ký tự đặc biệt của LIKE để tìm đúng chuỗi người dùng gõ
+    pattern = "%" + q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    query = select(*LIST_COLUMNS, FileItem.path).where(
+        FileItem.owner_id == current_user.id,
+        FileItem.parent_id.is_not(None), # Không trả về Home
+        func.lower(FileItem.name).like(pattern, escape="\\"),
+    )
+    if folder_id:
+        query = query.where(*subtree_filter(current_user.id, await get_folder_path(db, current_user.id, folder_id)))
+    if type:
+        query = query.where(FileItem.type == type)
+    if mime:
+        query = query.where(FileItem.mime_type.startswith(mime) if mime.endswith("/") else FileItem.mime_type == mime)
+    if min_size is not None:
+        query = query.where(FileItem.size_bytes >= min_size)
+    if max_size is not None:
+        query = query.where(FileItem.size_bytes <= max_size)
+    if modified_after:
+        query = query.where(FileItem.updated_at >= modified_after)
+    if modified_before:
+        query = query.where(FileItem.updated_at < modified_before)
+    if cursor:
+        try:
+            query = query.where(FileItem.id < uuid.UUID(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor không hợp lệ")
+
+    result = await db.execute(query.order_by(FileItem.id.desc()).limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    folder_paths = await display_folder_paths(db, current_user.id, [row.path for row in rows])
+    items = []
+    for row in rows:
+        item = list_row(row, with_thumbnails)
+        item["folder_path"] = folder_paths[row.path]
+        items.append(item)
+    return JSONResponse({
+        "items": items,
+        "next_cursor": str(rows[-1].id) if has_more else None,
+    })
+
+# Metadata cần để phục vụ /content, cache theo (owner_id, file_id): video/ảnh xem lại
+# nhiều lần (mỗi lần tua là 1 Range request) không phải query DB + stat file nữa.
+@dataclass(frozen=True)
+class ContentMeta:
+    path: str | None # None: blob ở storage backend từ xa (S3) hoặc đã nén, đọc qua read_blob_range
+    blob_hash: str | None
+    name: str
+    mime_type: str | None
+    size: int
+    mtime: float
+    stat: os.stat_result | None # Chỉ có với file trên đĩa (cho FileResponse)
+    etag: str
+    immutable: bool # Blob: nội dung của file_id không bao giờ đổi
+
+_content_cache = TTLCache(maxsize=settings.CONTENT_CACHE_MAX_SIZE, ttl=settings.CONTENT_CACHE_TTL_SECONDS)
+
+# Gọi khi file bị đổi tên / xóa / ghi đè. Đổi tên thì nội dung không đổi: drop_data=False
+# để giữ nội dung trong blobcache (blob bị xóa hẳn thì storage_gc tự bỏ khỏi blobcache).
+def invalidate_content(owner_id, file_ids, drop_data: bool = True):
+    for file_id in file_ids:
+        key = (str(owner_id), str(file_id))
+        meta = _content_cache.get(key)
+        if meta is not None and drop_data:
+            blobcache.discard([cache_key(meta)])
+        _content_cache.delete(key)
+
+async def get_content_meta(db, owner_id, file_id: str) -> ContentMeta:
+    try:
+        file_id = uuid.UUID(file_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="File not found")
+    key = (str(owner_id), str(file_id))
+    meta = _content_cache.get(key)
+    if meta is not None:
+        # Cache chỉ bị xóa ở worker nhận request xóa / di chuyển: file trên đĩa đã mất
+        # (FileResponse sẽ lỗi 500) thì bỏ entry, hỏi lại DB
+        if meta.path is None or await run_io(os.path.exists, meta.path):
+            return meta
+        _content_cache.delete(key)
+
+    query = select(
+        FileItem.id, FileItem.owner_id, FileItem.name, FileItem.mime_type, FileItem.blob_hash
+    ).where(
+        FileItem.id == file_id,
+        FileItem.owner_id == owner_id,
+        FileItem.type == 'file'
+    )
+    row = (await db.execute(query)).one_or_none()
+    if row is None and has_replica():
+        # File vừa upload có thể chưa sang tới replica -> hỏi lại primary
+        async with AsyncSessionLocal() as primary:
+            row = (await primary.execute(query)).one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    file_path = physical_path(row.owner_id, row.id, row.blob_hash)
+    stat_result = None
+    try:
+        try:
+            if file_path is None:
+                raise FileNotFoundError
+            stat_result = os.stat(file_path)
+            size, mtime = stat_result.st_size, stat_result.st_mtime
+        except FileNotFoundError:
+            if not row.blob_hash:
+                raise
+            # Blob ở backend từ xa hoặc đã nén: đọc qua read_blob_range, không gửi thẳng file
+            file_path = None
+            location = await run_io(locate_blob, row.blob_hash)
+            size, mtime = location.size, location.mtime
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File on disk missing")
+
+    # ETag mạnh: blob dùng chính SHA-256 nội dung, file cũ dùng id + mtime + size
+    if row.blob_hash:
+        etag = f'"{row.blob_hash}"'
+    else:
+        etag = f'"{row.id.hex}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    meta = ContentMeta(
+        file_path, row.blob_hash, row.name, row.mime_type, size, mtime, stat_result, etag,
+        immutable=bool(row.blob_hash)
+    )
+    _content_cache.set(key, meta)
+    return meta
+
+# Blob ở storage backend từ xa / đã nén: tự xử lý Range 1 đoạn (đủ cho tua video / tải tiếp),
+# dữ liệu được kéo từ backend (giải nén các frame cần thiết) theo từng khúc rồi đẩy thẳng ra client
+def remote_content(request: Request, meta: ContentMeta, headers: dict) -> Response:
+    headers = {**headers, "accept-ranges": "bytes", "content-disposition": content_disposition(meta.name)}
+    byte_range = content_range(request, meta, headers)
+    if isinstance(byte_range, Response):
+        return byte_range
+    if meta.size == 0:
+        return Response(b"", media_type=meta.mime_type, headers=headers)
+
+    start, end = byte_range or (0, meta.size - 1)
+    headers["content-length"] = str(end - start + 1)
+    return StreamingResponse(
+        read_blob_range(meta.blob_hash, start, end),
+        status_code=206 if byte_range else 200,
+        media_type=meta.mime_type,
+        headers=headers
+    )
+
+# Range 1 đoạn của request: (start, end), None = gửi cả file, hoặc Response 416.
+# Ghi content-range vào headers.
+def content_range(request: Request, meta: ContentMeta, headers: dict) -> tuple[int, int] | Response | None:
+    byte_range = None
+    # If-Range khác ETag hiện tại -> gửi cả file
+    if request.headers.get("if-range", meta.etag) == meta.etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), meta.size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{meta.size}"})
+    if byte_range:
+        start, end = byte_range
+        headers["content-range"] = f"bytes {start}-{end}/{meta.size}"
+    return byte_range
+
+# Key của nội dung trong blobcache: blob theo SHA-256, file cũ theo ETag (id + mtime + size)
+def cache_key(meta: ContentMeta) -> str:
+    return meta.blob_hash or meta.etag
+
+# Đọc cả nội dung file nhỏ cho blobcache
+def read_content(meta: ContentMeta) -> bytes:
+    if meta.path is not None:
+        with open(meta.path, "rb") as f:
+            return f.read()
+    return b"".join(read_blob_range(meta.blob_hash, 0, meta.size - 1))
+
+# File nhỏ hay mở: trả từ RAM (blobcache). Cả file: gửi thẳng bytes trong cache, không copy;
+# Range: chỉ copy đoạn được hỏi (body là bytes, Starlette bản nào cũng nhận).
+# None = không có / chưa đủ điều kiện vào cache -> đọc đĩa như thường.
+async def cached_content(request: Request, meta: ContentMeta, headers: dict) -> Response | None:
+    # Nhiều đoạn (multipart/byteranges) để FileResponse lo
+    if "," in request.headers.get("range", "") or not blobcache.cacheable(meta.size):
+        return None
+    try:
+        data = await blobcache.get_or_load(cache_key(meta), meta.size, partial(run_io, read_content, meta))
+    except OSError:
+        return None
+    if data is None:
+        return None
+
+    headers = {**headers, "accept-ranges": "bytes", "content-disposition": content_disposition(meta.name)}
+    byte_range = content_range(request, meta, headers)
+    if isinstance(byte_range, Response):
+        return byte_range
+    start, end = byte_range or (0, meta.size - 1)
+    body = data[start:end + 1] if byte_range else data
+    blobcache.record_served(len(body))
+    return Response(body, status_code=206 if byte_range else 200, media_type=meta.mime_type, headers=headers)
 
 # 2. API Xem nội dung file (Stream Video/Ảnh)
 @router.get("/content/{file_id}")
 async def get_file_content(
     file_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    meta = await get_content_meta(db, current_user.id, file_id)
+
+    headers = {
+        "etag": meta.etag,
+        "last-modified": http_date(meta.mtime),
+        # Blob đặt tên theo UUID/SHA-256 không bao giờ đổi nội dung -> client cache vĩnh viễn.
+        # File cũ: được cache nhưng phải hỏi lại (thường chỉ tốn 1 lần 304).
+        "cache-control": "private, max-age=31536000, immutable" if meta.immutable else "private, no-cache",
+    }
+    # Client đã có bản này: 304, không đụng tới ổ cứng
+    if is_not_modified(request.headers, meta.etag, meta.mtime):
+        return Response(status_code=304, headers=headers)
+
+    response = await cached_content(request, meta, headers)
+    if response is not None:
+        return response
+    if meta.path is None:
+        return remote_content(request, meta, headers)
+
+    # FileResponse lo Range / multipart/byteranges / If-Range (so với ETag ở trên),
+    # truyền sẵn stat_result để không stat file lần nữa
+    return FileResponse(
+        path=meta.path,
+        media_type=meta.mime_type,
+        filename=meta.name,
+        headers=headers,
+        stat_result=meta.stat
+    )
+
+# API Ảnh thu nhỏ (lưới ảnh trên client), chưa có trong cache thì tạo ngay
+@router.get("/thumbnail/{file_id}")
+async def get_thumbnail(
+    file_id: str,
+    size: int = DEFAULT_THUMBNAIL_SIZE,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
-    # Tìm file trong DB
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size phải là một trong {list(THUMBNAIL_SIZES)}")
+
     result = await db.execute(select(FileItem).where(
         FileItem.id == file_id,
         FileItem.owner_id == current_user.id
     ))
     file_item = result.scalar_one_or_none()
-    
+
     if not file_item or file_item.type == 'folder':
         raise HTTPException(status_code=404, detail="File not found")
+    if not supports_thumbnail(file_item.mime_type):
+        raise HTTPException(status_code=415, detail="File không hỗ trợ thumbnail")
 
-    # Lấy đường dẫn vật lý (dùng property ảo trong model)
-    # Lưu ý: file_item.get_physical_path là property chúng ta đã viết ở model
-    file_path = file_item.get_physical_path 
-    
-    if not os.path.exists(file_path):
+    try:
+        thumb_path = await ensure_thumbnail(current_user.id, file_item.id, file_item.blob_hash, size)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File on disk missing")
+    except Exception as e:
+        raise HTTPException(status_code=415, detail=f"Không tạo được thumbnail: {e}")
 
-    # Trả về FileResponse (Hỗ trợ stream video range request tự động)
     return FileResponse(
-        path=file_path,
-        media_type=file_item.mime_type,
-        filename=file_item.name
+        path=thumb_path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "private, max-age=86400"}
     )
 
 class ItemUpdate(BaseModel):
@@ -180,7 +674,7 @@ async def rename_item(
     item_id: str,
     item_in: ItemUpdate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     # Tìm item
     result = await db.execute(select(FileItem).where(
@@ -196,19 +690,89 @@ async def rename_item(
     item.name = item_in.name
     
     try:
+        await record_changes(db, current_user.id, upserts=[item.id])
         await db.commit()
         await db.refresh(item)
+        invalidate_content(current_user.id, [item.id], drop_data=False) # Tên file nằm trong Content-Disposition
         return item
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=400, detail="Lỗi đổi tên: " + str(e))
 
+class ItemMove(BaseModel):
+    parent_id: str # Folder đích, "root" = Home
+
+# API Di chuyển file/folder (cả cây con)
+@router.post("/items/{item_id}/move")
+async def move_item(
+    item_id: str,
+    move_in: ItemMove,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    result = await db.execute(select(FileItem).where(
+        FileItem.id == item_id,
+        FileItem.owner_id == current_user.id
+    ))
+    item = result.scalar_one_or_none()
+
+    if not item:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file/folder")
+    if item.parent_id is None:
+        raise HTTPException(status_code=400, detail="Không thể di chuyển thư mục gốc")
+
+    target_id = move_in.parent_id if move_in.parent_id != "root" else current_user.root_folder_id
+    target_path = await get_folder_path(db, current_user.id, target_id)
+
+    try:
+        await move_subtree(db, current_user.id, item.id, item.path, target_id, target_path)
+        await record_changes(db, current_user.id, upserts=[item.id])
+        await db.commit()
+        await db.refresh(item)
+        return item
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Lỗi di chuyển: " + str(e))
+
+# Dung lượng đã dùng / quota của user (đọc bộ đếm, không quét bảng files)
+@router.get("/usage")
+async def storage_usage(
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    return await get_usage(db, current_user.id)
+
+# API Thống kê cây con: tổng dung lượng, số file, số folder (không tính chính item)
+@router.get("/items/{item_id}/stats")
+async def item_stats(
+    item_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    result = await db.execute(select(FileItem.path, FileItem.type).where(
+        FileItem.id == item_id,
+        FileItem.owner_id == current_user.id
+    ))
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file/folder")
+
+    stats = await subtree_stats(db, current_user.id, row.path)
+    if row.type == "folder":
+        stats["folders"] -= 1
+    else:
+        stats["files"] -= 1
+    return {"id": item_id, **stats}
+
 # 4. API Xóa (Delete)
 @router.delete("/items/{item_id}")
 async def delete_item(
     item_id: str,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     # Tìm item
     result = await db.execute(select(FileItem).where(
@@ -221,20 +785,31 @@ async def delete_item(
         raise HTTPException(status_code=404, detail="Không tìm thấy file/folder")
     
     try:
-        # Nếu là File -> Xóa file vật lý trên ổ cứng
+        # Gom trước khi DB CASCADE xóa mất các dòng con: tham chiếu blob sẽ mất,
+        # file cũ (chưa có blob) và thumbnail của mọi file trong cây con.
         if item.type == 'file':
-            # Dùng property ảo get_physical_path để lấy đường dẫn
-            file_path = item.get_physical_path
-            if file_path and os.path.exists(file_path):
-                os.remove(file_path)
-        
-        # Nếu là Folder -> Logic phức tạp hơn (xóa đệ quy file con). 
-        # Tuy nhiên, nếu DB bạn set ON DELETE CASCADE, các dòng con trong DB sẽ mất.
-        # Lưu ý: Các file vật lý con của folder này sẽ thành file rác (orphan).
-        # Để đơn giản cho bài này, ta chỉ xóa DB record.
-        
+            files = [(item.id, item.blob_hash, item.size_bytes or 0)]
+        else:
+            result = await db.execute(
+                select(FileItem.id, FileItem.blob_hash, FileItem.size_bytes)
+                .where(*subtree_filter(current_user.id, item.path), FileItem.type == 'file')
+            )
+            files = result.all()
+        blob_refs = Counter(blob_hash for _, blob_hash, _ in files if blob_hash)
+        blob_refs += await version_blob_refs(db, current_user.id, [file_id for file_id, _, _ in files])
+        legacy_paths = [legacy_path(current_user.id, file_id) for file_id, blob_hash, _ in files if not blob_hash]
+
         await db.delete(item)
+        await db.flush()
+        freed_blobs = await release_blobs(db, blob_refs)
+        await add_usage(db, current_user.id, -sum(size or 0 for _, _, size in files), -len(files))
+        await record_changes(db, current_user.id, deletes=[item.id])
         await db.commit()
+
+        # DB đã commit: file vật lý được xóa dưới nền, request trả về ngay
+        invalidate_content(current_user.id, [file_id for file_id, _, _ in files])
+        enqueue_blob_delete(freed_blobs)
+        enqueue_unlink(legacy_paths + thumbnail_paths(file_id for file_id, _, _ in files))
         
         return Response(status_code=204) # 204 No Content
     except Exception as e:
@@ -242,73 +817,221 @@ async def delete_item(
         raise HTTPException(status_code=500, detail="Lỗi khi xóa: " + str(e))
 
 
+class ItemCopy(BaseModel):
+    parent_id: str | None = None # Folder đích; None = cùng folder với bản gốc, "root" = Home
+    name: str | None = None # Tên bản sao; None = giữ tên (tự thêm "(copy)" nếu trùng)
+
+# Tìm tên chưa dùng trong folder đích: "a.jpg" -> "a (copy).jpg" -> "a (copy 2).jpg"
+async def unique_name(db, owner_id, parent_id, name):
+    stem, ext = os.path.splitext(name)
+    result = await db.execute(select(FileItem.name).where(
+        FileItem.owner_id == owner_id,
+        FileItem.parent_id == parent_id,
+        FileItem.name.startswith(stem, autoescape=True)
+    ))
+    taken = set(result.scalars().all())
+    candidate = name
+    n = 1
+    while candidate in taken:
+        candidate = f"{stem} (copy){ext}" if n == 1 else f"{stem} (copy {n}){ext}"
+        n += 1
+    return candidate
+
+# 5. API Copy file/folder (cả cây con)
+@router.post("/items/{item_id}/copy")
+async def copy_item(
+    item_id: str,
+    copy_in: ItemCopy,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    result = await db.execute(select(FileItem).where(
+        FileItem.id == item_id,
+        FileItem.owner_id == current_user.id
+    ))
+    item = result.scalar_one_or_none()
+
+    if not item:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file/folder")
+    if item.parent_id is None:
+        raise HTTPException(status_code=400, detail="Không thể copy thư mục gốc")
+
+    if copy_in.parent_id is None:
+        target_id = item.parent_id
+    else:
+        target_id = copy_in.parent_id if copy_in.parent_id != "root" else current_user.root_folder_id
+
+    target_path = await get_folder_path(db, current_user.id, target_id)
+    if target_path.startswith(item.path):
+        raise HTTPException(status_code=400, detail="Không thể copy folder vào chính nó")
+
+    # Lấy cả cây con, sắp theo path -> cha luôn đứng trước con
+    result = await db.execute(
+        select(
+            FileItem.id, FileItem.parent_id, FileItem.name, FileItem.type,
+            FileItem.mime_type, FileItem.size_bytes, FileItem.blob_hash
+        )
+        .where(*subtree_filter(current_user.id, item.path))
+        .order_by(FileItem.path)
+    )
+    all_items = result.fetchall()
+
+    new_root_id = uuid6.uuid7()
+    new_root_name = await unique_name(db, current_user.id, target_id, copy_in.name or item.name)
+    # Không giữ transaction đọc trong lúc copy vật lý
+    await db.commit()
+
+    id_map = {}
+    rel_paths = {} # path của bản sao tính từ folder đích (folder đích có thể bị di chuyển trong lúc copy)
+    rows = []
+    legacy_copies = {} # id bản sao -> (đường dẫn gốc, đường dẫn bản sao, size) cho file cũ chưa có blob
+    for row in all_items:
+        is_root = row.id == item.id
+        new_id = new_root_id if is_root else uuid6.uuid7()
+        id_map[row.id] = new_id
+        rel_paths[row.id] = item_path(None if is_root else rel_paths[row.parent_id], new_id)
+        rows.append({
+            "id": new_id,
+            "owner_id": current_user.id,
+            "parent_id": target_id if is_root else id_map[row.parent_id],
+            "name": new_root_name if is_root else row.name,
+            "type": row.type,
+            "mime_type": row.mime_type,
+            "size_bytes": row.size_bytes,
+            "blob_hash": row.blob_hash,
+            "path": rel_paths[row.id],
+        })
+        if row.type == "file" and not row.blob_hash:
+            legacy_copies[new_id] = (
+                legacy_path(current_user.id, row.id), legacy_path(current_user.id, new_id), row.size_bytes or 0
+            )
+
+    response = {"id": new_root_id, "name": new_root_name, "items": len(rows)}
+
+    # File cũ: copy vật lý ra file tạm trước, DB chỉ thấy bản sao khi mọi byte đã nằm trên đĩa.
+    # Chèn dòng + tham chiếu blob + usage rồi os.replace file tạm vào chỗ trong cùng 1 transaction;
+    # lỗi ở bất kỳ bước nào -> rollback, dọn file tạm, không để lại dòng trỏ tới file thiếu.
+    async def copy_and_save(db, job=None) -> dict:
+        temps = {}
+        moved = []
+        try:
+            missing = set()
+            for new_id, (src, _, _) in legacy_copies.items():
+                temps[new_id] = new_temp_path()
+                try:
+                    await run_io(copy_file, src, temps[new_id], job.advance if job else None)
+                except FileNotFoundError:
+                    # File gốc đã mất trên đĩa: bỏ khỏi bản sao thay vì tạo dòng trỏ tới file không có
+                    missing.add(new_id)
+                if job:
+                    job.advance(items=1)
+
+            saved = [row for row in rows if row["id"] not in missing]
+            base_path = await get_folder_path(db, current_user.id, target_id)
+            for row in saved:
+                row["path"] = base_path + row["path"]
+                row["depth"] = path_depth(row["path"])
+            copied_files = [row for row in saved if row["type"] == "file"]
+            await db.execute(insert(FileItem), saved)
+            await add_blob_refs(db, Counter(row["blob_hash"] for row in copied_files if row["blob_hash"]))
+            await add_usage(db, current_user.id, sum(row["size_bytes"] or 0 for row in copied_files), len(copied_files))
+            await record_changes(db, current_user.id, upserts=[row["id"] for row in saved])
+            for new_id in list(temps):
+                if new_id not in missing:
+                    await run_io(move_file, temps.pop(new_id), legacy_copies[new_id][1])
+                    moved.append(legacy_copies[new_id][1])
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            for path in [*temps.values(), *moved]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        for path in temps.values():
+            if os.path.exists(path):
+                os.remove(path)
+        return {**response, "items": len(saved), "missing": len(missing)}
+
+    # Ít byte cần copy thì làm luôn, nhiều thì chạy nền
+    legacy_bytes = sum(size for _, _, size in legacy_copies.values())
+    if legacy_bytes <= settings.COPY_INLINE_MAX_BYTES:
+        try:
+            result = await copy_and_save(db)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail="Lỗi copy: " + str(e))
+        return {**result, "status": "completed"}
+
+    job = create_job(current_user.id, "copy", total_bytes=legacy_bytes, total_items=len(legacy_copies))
+
+    async def run(job):
+        async with AsyncSessionLocal() as job_db:
+            job.result = await copy_and_save(job_db, job)
+
+    start_job(job, run)
+    return {**response, "status": "running", "job_id": job.id}
+
+# Tiến độ job nền (copy...)
+@router.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    job = get_job(job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job.to_dict()
+
 @router.get("/download_folder/{folder_id}")
 async def download_folder(
     folder_id: str,
-    background_tasks: BackgroundTasks, # Xóa file sau khi gửi xong
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
-    # 1. SQL Đệ quy: Lấy toàn bộ cây thư mục con cháu
-    query = text("""
-        WITH RECURSIVE folder_tree AS (
-            -- Neo: Lấy folder gốc
-            SELECT id, owner_id, name, type, parent_id, CAST(name AS TEXT) as relative_path 
-            FROM files 
-            WHERE id = :target_id AND owner_id = :owner_id
-            
-            UNION ALL
-            
-            -- Đệ quy: Lấy con
-            SELECT child.id, child.owner_id, child.name, child.type, child.parent_id,
-                   CAST(parent.relative_path || '/' || child.name AS TEXT)
-            FROM files child
-            JOIN folder_tree parent ON child.parent_id = parent.id
-        )
-        SELECT * FROM folder_tree;
-    """)
-
-    result = await db.execute(query, {"target_id": folder_id, "owner_id": current_user.id})
+    # 1. Lấy toàn bộ cây thư mục con cháu: 1 range query trên path
+    folder_path = await get_folder_path(db, current_user.id, folder_id)
+    result = await db.execute(
+        select(FileItem.id, FileItem.parent_id, FileItem.name, FileItem.type, FileItem.mime_type, FileItem.blob_hash)
+        .where(*subtree_filter(current_user.id, folder_path))
+        .order_by(FileItem.path) # Cha luôn đứng trước con
+    )
     all_items = result.fetchall()
 
-    if not all_items:
-        raise HTTPException(status_code=404, detail="Không tìm thấy thư mục")
-
-    # 2. Tạo file ZIP tạm
     root_name = all_items[0].name
-    zip_filename = f"{root_name}_{uuid6.uuid7()}.zip"
-    zip_path = os.path.join("storage", zip_filename)
 
-    try:
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for item in all_items:
-                # item.relative_path chính là đường dẫn ảo (VD: TaiLieu/Hinh/a.jpg)
-                
-                if item.type == 'file':
-                    # Tính đường dẫn thật trên ổ cứng
-                    real_path = os.path.join(STORAGE_BASE, str(current_user.id), str(item.id))
-                    if os.path.exists(real_path):
-                        zipf.write(real_path, arcname=item.relative_path)
-                else:
-                    # Tạo folder rỗng trong zip
-                    zfi = zipfile.ZipInfo(item.relative_path + "/")
-                    zipf.writestr(zfi, "")
-                    
-    except Exception as e:
-        if os.path.exists(zip_path): os.remove(zip_path)
-        raise HTTPException(status_code=500, detail=f"Lỗi nén: {e}")
+    # 2. Danh sách entry cho ZIP: (đường dẫn ảo, hàm mở nội dung, mime)
+    # Đường dẫn ảo ghép từ tên của cha (VD: TaiLieu/Hinh/a.jpg)
+    def open_item(item_id, blob_hash):
+        return open_content(current_user.id, item_id, blob_hash)
 
-    # 3. Gửi file và xóa ngay lập tức
-    background_tasks.add_task(os.remove, zip_path)
-    
-    return FileResponse(
-        path=zip_path, 
-        filename=f"{root_name}.zip",
-        media_type='application/zip'
+    def zip_entries():
+        relative_paths = {}
+        for item in all_items:
+            parent_relative = relative_paths.get(item.parent_id)
+            relative_path = f"{parent_relative}/{item.name}" if parent_relative else item.name
+            relative_paths[item.id] = relative_path
+            if item.type == 'file':
+                yield relative_path, partial(open_item, item.id, item.blob_hash), item.mime_type
+            else:
+                yield relative_path, None, None
+
+    # 3. Nén và gửi dần từng khúc, không tạo file ZIP tạm trên ổ cứng
+    return StreamingResponse(
+        metrics.timed_stream("zip.stream", iter_zip(zip_entries())),
+        media_type='application/zip',
+        headers={"Content-Disposition": content_disposition(f"{root_name}.zip")}
     )
 
 # app/routers/files.py
 
+# API cũ (deprecated, client mới dùng /uploads/sessions): mỗi chunk là 1 file <index>.part,
+# không biết trước kích thước file. Số chunk đã nhận đếm bằng bitmap của 1 dòng upload_sessions
+# (id suy ra từ owner + upload_id) thay vì liệt kê thư mục ở mỗi chunk; chỉ request giành được
+# trạng thái 'finalizing' mới gộp file (2 chunk cuối đến cùng lúc không gộp 2 lần).
+def legacy_session_id(owner_id, upload_id: str) -> uuid.UUID:
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"upload_chunk:{owner_id}:{upload_id}")
+
 @router.post("/upload_chunk")
 async def upload_chunk(
     upload_id: str = Form(...),
@@ -317,63 +1040,108 @@ async def upload_chunk(
     parent_id: str = Form(...),
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
+    # Hết quota thì không nhận thêm chunk: QuotaMiddleware kiểm tra trước khi nhận body,
+    # kiểm tra chính thức lúc gộp file
+
+    if total_chunks < 1 or not 0 <= chunk_index < total_chunks:
+        raise HTTPException(status_code=400, detail="chunk_index / total_chunks không hợp lệ")
+    if os.path.basename(upload_id) != upload_id or upload_id in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail="upload_id không hợp lệ")
+    try:
+        pid = uuid.UUID(parent_id) if parent_id != "root" else current_user.root_folder_id
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Không tìm thấy folder")
+    session_id = legacy_session_id(current_user.id, upload_id)
+    await db.execute(text("""
+        INSERT INTO upload_sessions
+            (id, owner_id, parent_id, filename, mime_type, total_size, chunk_size, total_chunks, received, received_count, status)
+        VALUES (:id, :owner_id, :parent_id, :filename, :mime_type, 0, 0, :total_chunks, :received, 0, 'uploading')
+        ON CONFLICT (id) DO NOTHING
+    """), {
+        "id": session_id, "owner_id": current_user.id, "parent_id": pid, "filename": file.filename,
+        "mime_type": file.content_type, "total_chunks": total_chunks, "received": bytes((total_chunks + 7) // 8),
+    })
+    await db.commit()
+
     # 1. Tạo folder tạm riêng cho upload_id này
     temp_dir = os.path.join("storage", "temp", upload_id)
     os.makedirs(temp_dir, exist_ok=True)
-    
+
     # 2. Lưu mảnh ghép thành file riêng: VD "3.part"
     part_file_path = os.path.join(temp_dir, f"{chunk_index}.part")
-    
     try:
-        with open(part_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # 3. Kiểm tra xem đã đủ tất cả các mảnh chưa?
-        # Đếm số file .part trong folder
-        uploaded_parts = len([name for name in os.listdir(temp_dir) if name.endswith('.part')])
-        
-        if uploaded_parts == total_chunks:
-            # --- ĐÃ ĐỦ MẢNH -> TIẾN HÀNH GỘP FILE ---
-            return await merge_files(upload_id, total_chunks, parent_id, file.filename, file.content_type, db, current_user)
+        await run_io(write_file, file.file, part_file_path)
+    except OSError:
+        raise HTTPException(status_code=500, detail="Không ghi được chunk")
 
+    # 3. Đánh dấu chunk trong bitmap (UPDATE khóa dòng: chunk song song vẫn đếm đúng)
+    result = await db.execute(text("""
+        UPDATE upload_sessions
+        SET received = set_bit(received, :idx, 1),
+            received_count = received_count + (1 - get_bit(received, :idx)),
+            updated_at = now()
+        WHERE id = :id AND status = 'uploading' AND total_chunks = :total_chunks
+        RETURNING received_count
+    """), {"id": session_id, "idx": chunk_index, "total_chunks": total_chunks})
+    row = result.first()
+    if row is None:
+        await db.commit()
+        raise HTTPException(status_code=409, detail="Phiên upload không còn nhận chunk")
+    if row.received_count < total_chunks:
+        await db.commit()
         return {"status": "chunk_received", "index": chunk_index}
 
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # 4. Đủ mảnh: chỉ 1 request giành được quyền gộp file
+    result = await db.execute(text("""
+        UPDATE upload_sessions SET status = 'finalizing', updated_at = now()
+        WHERE id = :id AND status = 'uploading'
+        RETURNING id
+    """), {"id": session_id})
+    claimed = result.first()
+    await db.commit()
+    if claimed is None:
+        raise HTTPException(status_code=409, detail="Phiên upload đang được hoàn tất")
+    try:
+        response = await merge_files(upload_id, total_chunks, parent_id, file.filename, file.content_type, db, current_user)
+    except Exception:
+        # Các part có thể đã bị gộp / xóa: bỏ phiên, client upload lại từ đầu
+        await db.execute(text("DELETE FROM upload_sessions WHERE id = :id"), {"id": session_id})
+        await db.commit()
+        raise
+    await db.execute(text("""
+        UPDATE upload_sessions SET status = 'completed', file_id = :file_id, updated_at = now() WHERE id = :id
+    """), {"id": session_id, "file_id": response["file_id"]})
+    await db.commit()
+    return response
 
 # Hàm phụ trợ để gộp file (Tách ra cho gọn)
 async def merge_files(upload_id, total_chunks, parent_id, filename, content_type, db, user):
     temp_dir = os.path.join("storage", "temp", upload_id)
     new_file_id = uuid6.uuid7()
+
+    pid = parent_id if parent_id and parent_id != "root" else user.root_folder_id
+    path = item_path(await get_folder_path(db, user.id, pid), new_file_id)
+    await db.commit()
     
-    user_path = os.path.join(STORAGE_BASE, str(user.id))
-    os.makedirs(user_path, exist_ok=True)
-    final_path = os.path.join(user_path, str(new_file_id))
+    merged_path = new_temp_path()
     
     try:
-        # Mở file đích để ghi
-        with open(final_path, "wb") as outfile:
-            # Lặp từ 0 -> total_chunks để gộp đúng thứ tự
-            for i in range(total_chunks):
-                part_path = os.path.join(temp_dir, f"{i}.part")
-                with open(part_path, "rb") as infile:
-                    shutil.copyfileobj(infile, outfile)
-        
-        # Xóa folder tạm
-        shutil.rmtree(temp_dir)
-        
-        # Lưu DB (Logic cũ)
-        file_size = os.path.getsize(final_path)
+        # Gộp từ 0 -> total_chunks đúng thứ tự, vừa gộp vừa tính SHA-256,
+        # xong thì xóa folder tạm (chạy trên thread pool ghi đĩa)
+        with metrics.stage("merge.parts"):
+            file_size, sha256 = await run_io(merge_parts, temp_dir, total_chunks, merged_path)
+        metrics.stage_bytes.inc("merge.parts", amount=file_size)
         
         # Đoán mime type nếu cần
         if not content_type or content_type == "application/octet-stream":
              guessed_type, _ = mimetypes.guess_type(filename)
              if guessed_type: content_type = guessed_type
 
-        pid = parent_id if parent_id and parent_id != "root" else user.root_folder_id
+        with metrics.stage("blob.store"):
+            blob = await prepare_blob(merged_path, sha256, file_size, content_type)
+        await store_blob(db, blob)
 
         new_file = FileItem(
             id=new_file_id,
@@ -382,13 +1150,25 @@ async def merge_files(upload_id, total_chunks, parent_id, filename, content_type
             name=filename,
             type="file",
             mime_type=content_type,
-            size_bytes=file_size
+            size_bytes=file_size,
+            blob_hash=sha256,
+            path=path,
+            depth=path_depth(path)
         )
         db.add(new_file)
+        await add_usage(db, user.id, file_size, 1)
+        await record_changes(db, user.id, upserts=[new_file_id])
         await db.commit()
         await db.refresh(new_file)
+
+        schedule_thumbnail(user.id, new_file_id, sha256, content_type)
         
-        return {"status": "completed", "file_id": new_file.id}
+        return {"status": "completed", "file_id": new_file.id, "sha256": sha256}
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Merge Error: {e}")
\ No newline at end of file
+        await db.rollback()
+        if os.path.exists(merged_path):
+            os.remove(merged_path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Merge Error: {e}")
@@ -0,0 +1,662 @@
+import os
+import uuid
+import hashlib
+import mimetypes
+import uuid6
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File, Form
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, text
+from sqlalchemy.exc import IntegrityError
+from pydantic import BaseModel, Field, ValidationError
+
+from app.core import delta, metrics
+from app.core.config import settings
+from app.core.deps import get_current_user, CurrentUser
+from app.core.diskio import run_io
+from app.core.blobstore import (
+    TEMP_BASE, new_temp_path, preallocate, write_at, append_and_hash, hash_file, prepare_blob, store_blob, store_blobs
+)
+from app.core.tarstream import TarStreamError, iter_tar, split_name
+from app.core.storage_gc import enqueue_blob_delete
+from app.core.thumbnails import schedule_thumbnail, remove_thumbnails
+from app.core.tree import item_path, path_depth, get_folder_path
+from app.core.usage import add_usage, check_quota
+from app.core.changes import record_changes
+from app.core.versions import lock_file, replace_content
+from app.db.base import get_db
+from app.db.models import FileItem, UploadSession
+from app.routers.files import invalidate_content
+
+# Upload theo phiên (resume được):
+#   POST /sessions                      -> tạo phiên, cấp phát trước file đích
+#   PUT  /sessions/{id}/chunks/{index}  -> body là bytes thô của chunk, ghi thẳng vào offset
+#   GET  /sessions/{id}                 -> trạng thái + danh sách chunk còn thiếu (để resume)
+#   POST /sessions/{id}/complete        -> hoàn tất thủ công (tự động khi nhận đủ chunk)
+#   DELETE /sessions/{id}               -> hủy phiên
+# Upload hàng loạt nhiều file nhỏ trong 1 file tar: POST /bulk
+# Upload delta (chỉ gửi các block bị sửa của file lớn): /delta/... (cuối file)
+router = APIRouter()
+
+
+class SessionCreate(BaseModel):
+    filename: str
+    total_size: int = Field(..., ge=0)
+    chunk_size: int | None = None
+    parent_id: str | None = None
+    mime_type: str | None = None
+
+
+def session_temp_path(session_id) -> str:
+    return os.path.join(TEMP_BASE, f"{session_id}.upload")
+
+
+def chunk_length(session: UploadSession, index: int) -> int:
+    return min(session.chunk_size, session.total_size - index * session.chunk_size)
+
+
+# Bitmap giống set_bit của Postgres: bit i nằm ở byte i // 8, bit thấp trước
+def missing_chunks(bitmap: bytes, total_chunks: int) -> list[int]:
+    return [i for i in range(total_chunks) if not (bitmap[i >> 3] >> (i & 7)) & 1]
+
+
+def session_status(session: UploadSession) -> dict:
+    return {
+        "upload_id": session.id,
+        "status": session.status,
+        "filename": session.filename,
+        "total_size": session.total_size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "received_chunks": session.received_count,
+        "missing_chunks": missing_chunks(session.received, session.total_chunks) if session.status == "uploading" else [],
+        "file_id": session.file_id,
+    }
+
+
+async def get_session(db, session_id: str, user: CurrentUser) -> UploadSession:
+    result = await db.execute(select(UploadSession).where(
+        UploadSession.id == session_id,
+        UploadSession.owner_id == user.id
+    ))
+    session = result.scalar_one_or_none()
+    if not session:
+        raise HTTPException(status_code=404, detail="Không tìm thấy phiên upload")
+    return session
+
+
+@router.post("/sessions")
+async def create_session(
+    session_in: SessionCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    chunk_size = session_in.chunk_size or settings.UPLOAD_CHUNK_SIZE
+    if chunk_size <= 0 or chunk_size > settings.UPLOAD_MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"chunk_size phải trong khoảng 1..{settings.UPLOAD_MAX_CHUNK_SIZE}")
+
+    # File rỗng vẫn có 1 chunk (0 byte) để luồng hoàn tất giống nhau
+    total_chunks = max(1, -(-session_in.total_size // chunk_size))
+
+    content_type = session_in.mime_type
+    if not content_type or content_type == "application/octet-stream":
+        guessed_type, _ = mimetypes.guess_type(session_in.filename)
+        if guessed_type:
+            content_type = guessed_type
+
+    pid = session_in.parent_id if session_in.parent_id and session_in.parent_id != "root" else current_user.root_folder_id
+    await get_folder_path(db, current_user.id, pid) # 404 nếu folder đích không tồn tại
+    # Không đủ quota thì từ chối ngay, trước khi cấp phát file tạm
+    await check_quota(db, current_user.id, session_in.total_size)
+
+    session = UploadSession(
+        id=uuid6.uuid7(),
+        owner_id=current_user.id,
+        parent_id=pid,
+        filename=session_in.filename,
+        mime_type=content_type,
+        total_size=session_in.total_size,
+        chunk_size=chunk_size,
+        total_chunks=total_chunks,
+        received=bytes((total_chunks + 7) // 8),
+        received_count=0,
+        status="uploading"
+    )
+
+    temp_path = session_temp_path(session.id)
+    try:
+        os.makedirs(TEMP_BASE, exist_ok=True)
+        await run_io(preallocate, temp_path, session.total_size)
+        db.add(session)
+        await db.commit()
+        await db.refresh(session)
+        return session_status(session)
+    except Exception as e:
+        await db.rollback()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/sessions/{upload_id}")
+async def get_session_status(
+    upload_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    session = await get_session(db, upload_id, current_user)
+    return session_status(session)
+
+
+@router.put("/sessions/{upload_id}/chunks/{chunk_index}")
+async def put_chunk(
+    upload_id: str,
+    chunk_index: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    session = await get_session(db, upload_id, current_user)
+    if session.status != "uploading":
+        raise HTTPException(status_code=409, detail=f"Phiên upload đang ở trạng thái {session.status}")
+    if chunk_index < 0 or chunk_index >= session.total_chunks:
+        raise HTTPException(status_code=400, detail="chunk_index không hợp lệ")
+
+    expected = chunk_length(session, chunk_index)
+    offset = chunk_index * session.chunk_size
+    temp_path = session_temp_path(session.id)
+    # Kết thúc transaction đọc, không giữ kết nối DB trong lúc nhận dữ liệu
+    await db.commit()
+
+    # Nhận body theo luồng, gom đủ buffer rồi pwrite thẳng vào offset của file đích.
+    # Phiên bị hủy / hết hạn trong lúc nhận (file tạm bị xóa) -> 409 như khi không còn phiên.
+    received = 0
+    buffer = bytearray()
+    try:
+        async for data in request.stream():
+            received += len(data)
+            if received > expected:
+                raise HTTPException(status_code=400, detail=f"Chunk {chunk_index} phải dài {expected} bytes")
+            buffer += data
+            if len(buffer) >= settings.UPLOAD_BUFFER_SIZE:
+                await run_io(write_at, temp_path, offset, bytes(buffer))
+                offset += len(buffer)
+                buffer.clear()
+        if received != expected:
+            raise HTTPException(status_code=400, detail=f"Chunk {chunk_index} phải dài {expected} bytes")
+        if buffer:
+            await run_io(write_at, temp_path, offset, bytes(buffer))
+    except OSError as e:
+        if isinstance(e, FileNotFoundError) or not os.path.exists(temp_path):
+            raise HTTPException(status_code=409, detail="Phiên upload không còn nhận chunk")
+        raise HTTPException(status_code=500, detail="Không ghi được chunk")
+    metrics.stage_bytes.inc("session.chunk", amount=received)
+
+    # Đánh dấu chunk trong bitmap. Lệnh UPDATE khóa dòng nên các chunk đến
+    # song song / không theo thứ tự vẫn đếm đúng; gửi lại chunk cũ không đếm 2 lần.
+    result = await db.execute(text("""
+        UPDATE upload_sessions
+        SET received = set_bit(received, :idx, 1),
+            received_count = received_count + (1 - get_bit(received, :idx)),
+            updated_at = now()
+        WHERE id = :id AND status = 'uploading'
+        RETURNING received_count, total_chunks
+    """), {"id": session.id, "idx": chunk_index})
+    row = result.first()
+    await db.commit()
+    if row is None:
+        raise HTTPException(status_code=409, detail="Phiên upload không còn nhận chunk")
+
+    if row.received_count == row.total_chunks:
+        return await finalize_session(db, session.id, current_user)
+    return {"status": "chunk_received", "index": chunk_index, "received_chunks": row.received_count}
+
+
+@router.post("/sessions/{upload_id}/complete")
+async def complete_session(
+    upload_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    session = await get_session(db, upload_id, current_user)
+    if session.status == "completed":
+        return {"status": "completed", "file_id": session.file_id}
+    await db.commit()
+    return await finalize_session(db, session.id, current_user)
+
+
+@router.delete("/sessions/{upload_id}")
+async def abort_session(
+    upload_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    session = await get_session(db, upload_id, current_user)
+    if session.status == "finalizing":
+        raise HTTPException(status_code=409, detail="Phiên upload đang được hoàn tất")
+    await db.delete(session)
+    await db.commit()
+
+    temp_path = session_temp_path(session.id)
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return Response(status_code=204)
+
+
+async def finalize_session(db, session_id, user: CurrentUser):
+    # Chỉ 1 request giành được quyền hoàn tất (chunk cuối đến song song)
+    result = await db.execute(text("""
+        UPDATE upload_sessions SET status = 'finalizing', updated_at = now()
+        WHERE id = :id AND status = 'uploading' AND received_count = total_chunks
+        RETURNING id
+    """), {"id": session_id})
+    claimed = result.first()
+    await db.commit()
+    if claimed is None:
+        raise HTTPException(status_code=409, detail="Phiên upload chưa nhận đủ chunk hoặc đang được hoàn tất")
+
+    session = await db.get(UploadSession, session_id)
+    temp_path = session_temp_path(session_id)
+    # Kho blob nhận 1 hardlink, file của phiên giữ nguyên tới khi commit thành công:
+    # commit lỗi (trùng tên, quota...) thì phiên vẫn còn dữ liệu, client gọi /complete lại được
+    blob_path = new_temp_path()
+
+    try:
+        # Dữ liệu đã nằm đúng vị trí: chỉ đọc 1 lượt để tính SHA-256, không ghi lại
+        with metrics.stage("session.hash"):
+            file_size, sha256 = await run_io(hash_file, temp_path)
+        metrics.stage_bytes.inc("session.hash", amount=file_size)
+        if file_size != session.total_size:
+            raise ValueError(f"Kích thước file {file_size} khác total_size {session.total_size}")
+        # Nén + ghi vào kho trước khi mở transaction
+        await run_io(os.link, temp_path, blob_path)
+        with metrics.stage("blob.store"):
+            blob = await prepare_blob(blob_path, sha256, file_size, session.mime_type)
+
+        # Folder đích có thể đã bị di chuyển trong lúc upload -> lấy path mới nhất
+        new_file_id = uuid6.uuid7()
+        path = item_path(await get_folder_path(db, user.id, session.parent_id), new_file_id)
+
+        await store_blob(db, blob)
+
+        new_file = FileItem(
+            id=new_file_id,
+            owner_id=user.id,
+            parent_id=session.parent_id,
+            name=session.filename,
+            type="file",
+            mime_type=session.mime_type,
+            size_bytes=file_size,
+            blob_hash=sha256,
+            path=path,
+            depth=path_depth(path)
+        )
+        db.add(new_file)
+        session.status = "completed"
+        session.file_id = new_file.id
+        await add_usage(db, user.id, file_size, 1)
+        await record_changes(db, user.id, upserts=[new_file_id])
+        await db.commit()
+        await run_io(os.remove, temp_path)
+
+        schedule_thumbnail(user.id, new_file.id, sha256, new_file.mime_type)
+
+        return {"status": "completed", "file_id": new_file.id, "sha256": sha256}
+
+    except Exception as e:
+        await db.rollback()
+        if os.path.exists(blob_path):
+            os.remove(blob_path)
+        # Trả phiên về trạng thái uploading để client gọi /complete lại
+        await db.execute(text("""
+            UPDATE upload_sessions SET status = 'uploading', updated_at = now() WHERE id = :id
+        """), {"id": session_id})
+        await db.commit()
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, IntegrityError):
+            raise HTTPException(status_code=409, detail="Xung đột khi hoàn tất upload: " + str(e.orig))
+        raise HTTPException(status_code=500, detail=f"Merge Error: {e}")
+
+
+# --- Upload hàng loạt ---
+# POST /bulk?parent_id=...  body: file tar (Content-Type: application/x-tar), gửi theo luồng.
+# Cho sao lưu ảnh (hàng nghìn file 2-5 MB): 1 request, 1 lần xác thực, 1 transaction thay vì
+# mỗi file 1 lượt /upload. Mỗi entry được ghi ra file tạm + tính SHA-256 ngay khi nhận;
+# thư mục trong tar ("2024/06/IMG_1.jpg") được tạo dưới parent_id nếu chưa có.
+# Cuối request: blobs + mọi dòng files vào DB bằng vài câu INSERT nhiều dòng.
+# Entry lỗi (trùng tên, đường dẫn không hợp lệ...) được báo riêng, các file còn lại vẫn được lưu.
+
+
+# {(parent_id, name): dòng (id, type, path)} của các item đang giữ những tên này
+async def children_by_name(db, owner_id, pairs) -> dict:
+    if not pairs:
+        return {}
+    result = await db.execute(text("""
+        SELECT f.parent_id, f.name, f.id, f.type, f.path
+        FROM files f
+        JOIN unnest(CAST(:parent_ids AS uuid[]), CAST(:names AS varchar[])) AS p(parent_id, name)
+          ON f.parent_id = p.parent_id AND f.name = p.name
+        WHERE f.owner_id = :owner_id
+    """), {"owner_id": owner_id, "parent_ids": [p for p, _ in pairs], "names": [n for _, n in pairs]})
+    return {(row.parent_id, row.name): row for row in result.all()}
+
+
+# Tìm / tạo id + path cho mọi folder trong tar (tuple tên, () = folder đích).
+# Mỗi tầng 1 query cho các folder có cha đã tồn tại; folder mới chỉ được thêm vào new_rows (chưa INSERT).
+# Folder trùng tên với 1 file đã có thì không có trong kết quả.
+async def resolve_folders(db, owner_id, base_id, base_path: str, folders) -> tuple[dict, list]:
+    wanted = {parts[:i] for parts in folders for i in range(1, len(parts) + 1)}
+    known = {(): (base_id, base_path)}
+    created = set()
+    new_rows = []
+    for depth in sorted({len(parts) for parts in wanted}):
+        level = [parts for parts in wanted if len(parts) == depth and parts[:-1] in known]
+        existing = await children_by_name(db, owner_id, [
+            (known[parts[:-1]][0], parts[-1]) for parts in level if parts[:-1] not in created
+        ])
+        for parts in sorted(level):
+            parent_id, parent_path = known[parts[:-1]]
+            row = existing.get((parent_id, parts[-1]))
+            if row is not None:
+                if row.type == "folder":
+                    known[parts] = (row.id, row.path)
+                continue
+            folder_id = uuid6.uuid7()
+            path = item_path(parent_path, folder_id)
+            known[parts] = (folder_id, path)
+            created.add(parts)
+            new_rows.append({
+                "id": folder_id, "owner_id": owner_id, "parent_id": parent_id, "name": parts[-1],
+                "type": "folder", "mime_type": None, "size_bytes": 0, "blob_hash": None,
+                "path": path, "depth": path_depth(path),
+            })
+    return known, new_rows
+
+
+# Nhận nội dung 1 entry vào file tạm, vừa ghi vừa hash (ghi theo buffer trên thread pool)
+async def receive_entry(data, temp_path: str) -> tuple[int, str]:
+    hasher = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+    out = await run_io(open, temp_path, "wb")
+    try:
+        async for chunk in data:
+            buffer += chunk
+            if len(buffer) >= settings.UPLOAD_BUFFER_SIZE:
+                size += await run_io(append_and_hash, out, hasher, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            size += await run_io(append_and_hash, out, hasher, bytes(buffer))
+    finally:
+        await run_io(out.close)
+    return size, hasher.hexdigest()
+
+
+@router.post("/bulk")
+async def bulk_upload(
+    request: Request,
+    parent_id: str | None = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    owner_id = current_user.id
+    base_id = parent_id if parent_id and parent_id != "root" else current_user.root_folder_id
+    base_path = await get_folder_path(db, owner_id, base_id)
+    base_id = uuid.UUID(str(base_id)) # So khớp với parent_id (UUID) đọc từ DB
+    await check_quota(db, owner_id, int(request.headers.get("content-length") or 0))
+    # Không giữ kết nối DB trong lúc nhận dữ liệu
+    await db.commit()
+
+    results = []
+    entries = [] # (vị trí trong results, các thành phần đường dẫn, file tạm, size, sha256)
+    folders = set()
+    temp_paths = []
+
+    def fail(index: int, detail: str):
+        results[index]["status"] = "error"
+        results[index]["detail"] = detail
+
+    try:
+        # 1. Nhận tar theo luồng
+        with metrics.stage("upload.bulk"):
+            async for info, data in iter_tar(request.stream()):
+                parts = split_name(info.name)
+                if info.isdir():
+                    if parts:
+                        folders.add(tuple(parts))
+                    continue
+                results.append({"name": info.name, "status": "ok"})
+                if parts is None:
+                    fail(len(results) - 1, "Đường dẫn không hợp lệ")
+                elif not info.isreg():
+                    fail(len(results) - 1, "Chỉ hỗ trợ file thường")
+                elif len(entries) >= settings.BULK_UPLOAD_MAX_FILES:
+                    raise HTTPException(status_code=413, detail=f"Tối đa {settings.BULK_UPLOAD_MAX_FILES} file mỗi request")
+                else:
+                    temp_path = new_temp_path()
+                    temp_paths.append(temp_path)
+                    size, sha256 = await receive_entry(data, temp_path)
+                    entries.append((len(results) - 1, tuple(parts), temp_path, size, sha256))
+        metrics.stage_bytes.inc("upload.bulk", amount=sum(entry[3] for entry in entries))
+
+        # 2. Folder: tìm cái đã có, tạo cái còn thiếu
+        known, folder_rows = await resolve_folders(
+            db, owner_id, base_id, base_path, folders | {parts[:-1] for _, parts, _, _, _ in entries}
+        )
+
+        # 3. Trùng tên: với item đã có trong folder và giữa các file trong cùng tar
+        new_folder_ids = {row["id"] for row in folder_rows}
+        existing = await children_by_name(db, owner_id, [
+            (known[parts[:-1]][0], parts[-1]) for _, parts, _, _, _ in entries
+            if parts[:-1] in known and known[parts[:-1]][0] not in new_folder_ids
+        ])
+        taken = {(row["parent_id"], row["name"]) for row in folder_rows}
+        file_rows, blob_entries = [], []
+        for index, parts, temp_path, size, sha256 in entries:
+            if parts[:-1] not in known:
+                fail(index, "Đường dẫn trùng tên với 1 file đã có")
+                continue
+            folder_id, folder_path = known[parts[:-1]]
+            key = (folder_id, parts[-1])
+            if key in existing or key in taken:
+                fail(index, "Tên đã tồn tại trong thư mục")
+                continue
+            taken.add(key)
+            mime_type, _ = mimetypes.guess_type(parts[-1])
+            file_id = uuid6.uuid7()
+            path = item_path(folder_path, file_id)
+            file_rows.append({
+                "id": file_id, "owner_id": owner_id, "parent_id": folder_id, "name": parts[-1],
+                "type": "file", "mime_type": mime_type, "size_bytes": size, "blob_hash": sha256,
+                "path": path, "depth": path_depth(path),
+            })
+            blob_entries.append((temp_path, sha256, size, mime_type))
+            results[index].update({"id": str(file_id), "size": size, "sha256": sha256})
+
+        # 4. Nén + ghi vào kho (ngoài transaction), rồi 1 transaction: quota, dòng blobs, INSERT nhiều dòng
+        rows = folder_rows + file_rows
+        if rows:
+            await db.commit()
+            with metrics.stage("blob.store"):
+                blobs = [await prepare_blob(*entry) for entry in blob_entries]
+            await store_blobs(db, blobs)
+            await db.execute(insert(FileItem), rows)
+            await add_usage(db, owner_id, sum(row["size_bytes"] for row in file_rows), len(file_rows))
+            await record_changes(db, owner_id, upserts=[row["id"] for row in rows])
+            await db.commit()
+    except TarStreamError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        await db.rollback()
+        raise
+    except IntegrityError as e:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Xung đột khi upload hàng loạt: " + str(e.orig))
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Bulk upload error: {e}")
+    finally:
+        # File tạm của entry lỗi / request thất bại (file đã vào kho blob thì không còn ở đây)
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    for row in file_rows:
+        schedule_thumbnail(owner_id, row["id"], row["blob_hash"], row["mime_type"])
+
+    failed = sum(1 for r in results if r["status"] == "error")
+    return {"results": results, "succeeded": len(results) - failed, "failed": failed, "folders_created": len(folder_rows)}
+
+
+# --- Upload delta: file lớn bị sửa một phần (xem app/core/delta.py) ---
+#   GET  /delta/params             -> tham số chia block, client chia bản mới giống hệt server
+#   POST /delta/{file_id}/missing  -> {"blocks": [sha256 các block của bản mới]} -> block server chưa có
+#   POST /delta/{file_id}          -> multipart: manifest (JSON, DeltaManifest) + data (nội dung các block
+#                                     còn thiếu nối liền nhau, mỗi block 1 lần, theo thứ tự trong manifest)
+# Server ghép bản mới từ block của bản hiện tại / các bản cũ + phần client gửi; bản hiện tại
+# được giữ lại thành phiên bản cũ (app/core/versions.py).
+
+class DeltaQuery(BaseModel):
+    blocks: list[str]
+
+
+class DeltaManifest(BaseModel):
+    base_version: int # files.version của bản đã hỏi /missing (file bị đổi trong lúc upload -> 409)
+    blocks: list[tuple[str, int]] # [(sha256 block, size)] theo thứ tự của bản mới
+    sha256: str | None = None # SHA-256 cả file để server kiểm tra kết quả ghép
+
+
+async def get_delta_base(db, owner_id, file_id: str):
+    try:
+        file_id = uuid.UUID(file_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    result = await db.execute(text("""
+        SELECT id, mime_type, blob_hash, size_bytes, version FROM files
+        WHERE id = :id AND owner_id = :owner_id AND type = 'file'
+    """), {"id": file_id, "owner_id": owner_id})
+    item = result.first()
+    if item is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    if not item.blob_hash:
+        # File cũ (chưa vào kho blob): upload lại bình thường
+        raise HTTPException(status_code=409, detail="File chưa hỗ trợ upload delta")
+    return item
+
+
+# Blob có thể lấy block: bản hiện tại trước, rồi các bản cũ (mới -> cũ)
+async def delta_sources(db, item) -> list[str]:
+    result = await db.execute(text("""
+        SELECT blob_hash FROM file_versions WHERE file_id = :id ORDER BY version DESC
+    """), {"id": item.id})
+    return list(dict.fromkeys([item.blob_hash, *result.scalars().all()]))
+
+
+@router.get("/delta/params")
+async def delta_params(current_user: CurrentUser = Depends(get_current_user)):
+    return delta.params()
+
+
+@router.post("/delta/{file_id}/missing")
+async def delta_missing(
+    file_id: str,
+    query: DeltaQuery,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    item = await get_delta_base(db, current_user.id, file_id)
+    try:
+        # File upload thường: lần đầu server phải tự chia block bản hiện tại
+        with metrics.stage("delta.manifest"):
+            await delta.ensure_manifest(db, item.blob_hash)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File on disk missing")
+    available = await delta.find_blocks(db, await delta_sources(db, item), query.blocks)
+    missing = [block_hash for block_hash in dict.fromkeys(query.blocks) if block_hash not in available]
+    return {"version": item.version, "sha256": item.blob_hash, "missing": missing}
+
+
+@router.post("/delta/{file_id}")
+async def delta_upload(
+    file_id: str,
+    manifest: str = Form(...),
+    data: UploadFile | None = File(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    owner_id = current_user.id
+    try:
+        spec = DeltaManifest.model_validate_json(manifest)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    if any(size <= 0 or size > delta.MAX_SIZE for _, size in spec.blocks):
+        raise HTTPException(status_code=400, detail=f"Kích thước block phải trong khoảng 1..{delta.MAX_SIZE}")
+
+    item = await get_delta_base(db, owner_id, file_id)
+    if item.version != spec.base_version:
+        raise HTTPException(status_code=409, detail="File đã có phiên bản mới hơn, cần hỏi lại /missing")
+    available = await delta.find_blocks(db, await delta_sources(db, item), [block_hash for block_hash, _ in spec.blocks])
+    try:
+        plan, data_size, layout = delta.plan_assembly(spec.blocks, available)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    received = data.size if data is not None else 0
+    if received != data_size:
+        raise HTTPException(status_code=400, detail=f"Cần gửi {data_size} byte dữ liệu block, nhận được {received}")
+    await check_quota(db, owner_id, sum(size for _, size in spec.blocks) - (item.size_bytes or 0))
+    # Không giữ kết nối DB trong lúc ghép file
+    await db.commit()
+
+    temp_path = new_temp_path()
+    try:
+        with metrics.stage("delta.assemble"):
+            file_size, sha256 = await run_io(delta.assemble, plan, data.file if data is not None else None, temp_path)
+        metrics.stage_bytes.inc("delta.assemble", amount=file_size)
+        if spec.sha256 and spec.sha256.lower() != sha256:
+            raise HTTPException(status_code=400, detail="SHA-256 của file ghép được không khớp")
+        with metrics.stage("blob.store"):
+            blob = await prepare_blob(temp_path, sha256, file_size, item.mime_type)
+
+        item = await lock_file(db, owner_id, item.id)
+        if item.version != spec.base_version:
+            raise HTTPException(status_code=409, detail="File đã có phiên bản mới hơn, cần hỏi lại /missing")
+        if sha256 == item.blob_hash:
+            await db.commit()
+            return {"id": item.id, "version": item.version, "size": file_size, "sha256": sha256, "status": "unchanged"}
+
+        await store_blob(db, blob)
+        # Ranh giới block của bản mới theo kế hoạch ghép: block cũ lấy kích thước từ blob_blocks,
+        # block mới đã được kiểm tra SHA-256 khi ghép
+        await delta.save_manifest(db, sha256, layout)
+        freed_blobs = await replace_content(db, item, sha256, file_size)
+        await add_usage(db, owner_id, file_size - (item.size_bytes or 0), 0)
+        await record_changes(db, owner_id, upserts=[item.id])
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Delta upload error: {e}")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    invalidate_content(owner_id, [item.id])
+    enqueue_blob_delete(freed_blobs)
+    remove_thumbnails(item.id)
+    schedule_thumbnail(owner_id, item.id, sha256, item.mime_type)
+
+    return {
+        "id": item.id,
+        "version": item.version + 1,
+        "size": file_size,
+        "sha256": sha256,
+        "uploaded_bytes": data_size,
+        "reused_bytes": file_size - data_size,
+        "status": "success",
+    }
@@ -0,0 +1,96 @@
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.blobstore import acquire_blob
+from app.core.changes import record_changes
+from app.core.deps import get_current_user, CurrentUser
+from app.core.storage_gc import enqueue_blob_delete
+from app.core.thumbnails import schedule_thumbnail, remove_thumbnails
+from app.core.usage import add_usage
+from app.core.versions import lock_file, replace_content
+from app.db.base import get_db
+from app.routers.files import invalidate_content
+
+# Phiên bản cũ của file (tạo khi upload delta / khôi phục, xem app/core/versions.py)
+router = APIRouter()
+
+
+def parse_id(value: str, detail: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=detail)
+
+
+@router.get("/items/{item_id}/versions")
+async def list_versions(
+    item_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    result = await db.execute(text("""
+        SELECT id, version, size_bytes, updated_at FROM files
+        WHERE id = :id AND owner_id = :owner_id AND type = 'file'
+    """), {"id": parse_id(item_id, "Không tìm thấy file"), "owner_id": current_user.id})
+    item = result.first()
+    if item is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    result = await db.execute(text("""
+        SELECT id, version, size_bytes, created_at, replaced_at FROM file_versions
+        WHERE file_id = :file_id ORDER BY version DESC
+    """), {"file_id": item.id})
+    return {
+        "id": item.id,
+        "version": item.version,
+        "size": item.size_bytes,
+        "updated_at": item.updated_at,
+        "versions": [
+            {"id": row.id, "version": row.version, "size": row.size_bytes,
+             "created_at": row.created_at, "replaced_at": row.replaced_at}
+            for row in result.all()
+        ],
+    }
+
+
+# Khôi phục 1 bản cũ: nội dung đó thành bản mới nhất (version tăng), bản hiện tại thành bản cũ
+@router.post("/items/{item_id}/versions/{version_id}/restore")
+async def restore_version(
+    item_id: str,
+    version_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    owner_id = current_user.id
+    try:
+        item = await lock_file(db, owner_id, parse_id(item_id, "Không tìm thấy file"))
+        result = await db.execute(text("""
+            SELECT blob_hash, size_bytes FROM file_versions WHERE id = :id AND file_id = :file_id
+        """), {"id": parse_id(version_id, "Không tìm thấy phiên bản"), "file_id": item.id})
+        old = result.first()
+        if old is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy phiên bản")
+        if old.blob_hash == item.blob_hash:
+            # Nội dung bản cũ đang là bản hiện tại: không tạo phiên bản mới
+            await db.commit()
+            return {"id": item.id, "version": item.version, "size": item.size_bytes, "sha256": item.blob_hash, "status": "unchanged"}
+
+        await acquire_blob(db, old.blob_hash) # Tham chiếu cho dòng files, bản cũ vẫn giữ tham chiếu của nó
+        freed_blobs = await replace_content(db, item, old.blob_hash, old.size_bytes)
+        await add_usage(db, owner_id, old.size_bytes - (item.size_bytes or 0), 0)
+        await record_changes(db, owner_id, upserts=[item.id])
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Lỗi khôi phục phiên bản: " + str(e))
+
+    invalidate_content(owner_id, [item.id])
+    enqueue_blob_delete(freed_blobs)
+    remove_thumbnails(item.id)
+    schedule_thumbnail(owner_id, item.id, old.blob_hash, item.mime_type)
+    return {"id": item.id, "version": item.version + 1, "size": old.size_bytes, "sha256": old.blob_hash}
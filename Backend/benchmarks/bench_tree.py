@@ -0,0 +1,143 @@
+# So sánh truy vấn cây con bằng WITH RECURSIVE (cách cũ) với materialized path
+# (app.core.tree). Tạo 1 user tạm với cây ~100k node sâu 10 tầng rồi xóa khi xong.
+# Cần DATABASE_URL trỏ tới DB đã chạy create_table.sql (KHÔNG dùng DB thật).
+#
+# Chạy từ thư mục Backend:
+#   python -m benchmarks.bench_tree --nodes 100000 --depth 10
+import argparse
+import asyncio
+import time
+
+import uuid6
+from sqlalchemy import insert, select, text, delete
+
+from app.core.tree import item_path, path_depth, subtree_stats, subtree_filter
+from app.db.base import engine, AsyncSessionLocal
+from app.db.models import User, FileItem
+
+CTE_STATS = text("""
+    WITH RECURSIVE subtree AS (
+        SELECT id, size_bytes, type FROM files WHERE id = :target_id AND owner_id = :owner_id
+        UNION ALL
+        SELECT child.id, child.size_bytes, child.type
+        FROM files child
+        JOIN subtree parent ON child.parent_id = parent.id
+    )
+    SELECT COALESCE(SUM(size_bytes), 0), COUNT(*) FILTER (WHERE type = 'file'), COUNT(*) FILTER (WHERE type = 'folder')
+    FROM subtree;
+""")
+
+CTE_LIST = text("""
+    WITH RECURSIVE subtree AS (
+        SELECT id, parent_id, name FROM files WHERE id = :target_id AND owner_id = :owner_id
+        UNION ALL
+        SELECT child.id, child.parent_id, child.name
+        FROM files child
+        JOIN subtree parent ON child.parent_id = parent.id
+    )
+    SELECT * FROM subtree;
+""")
+
+
+def build_tree(owner_id, root_id, nodes, depth, fanout=3):
+    root_path = item_path(None, root_id)
+    rows = []
+    levels = [[(root_id, root_path)]]
+    # Folder: mỗi folder có `fanout` folder con, tới tầng depth - 1
+    while len(levels) < depth and sum(len(level) for level in levels) < nodes // 3:
+        next_level = []
+        for parent_id, parent_path in levels[-1]:
+            for i in range(fanout):
+                folder_id = uuid6.uuid7()
+                path = item_path(parent_path, folder_id)
+                rows.append(dict(
+                    id=folder_id, owner_id=owner_id, parent_id=parent_id, name=f"d{i}",
+                    type="folder", size_bytes=0, path=path, depth=path_depth(path),
+                ))
+                next_level.append((folder_id, path))
+        levels.append(next_level)
+    # File: rải đều vào các folder tầng sâu nhất cho đủ số node
+    leaves = levels[-1]
+    remaining = max(0, nodes - 1 - len(rows))
+    for i in range(remaining):
+        parent_id, parent_path = leaves[i % len(leaves)]
+        file_id = uuid6.uuid7()
+        path = item_path(parent_path, file_id)
+        rows.append(dict(
+            id=file_id, owner_id=owner_id, parent_id=parent_id, name=f"f{i}.jpg",
+            type="file", mime_type="image/jpeg", size_bytes=1024, path=path, depth=path_depth(path),
+        ))
+    return rows, levels
+
+
+async def timed(db, fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await fn(db)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def run(args):
+    owner_id = uuid6.uuid7()
+    root_id = uuid6.uuid7()
+    async with AsyncSessionLocal() as db:
+        db.add(User(id=owner_id, email=f"bench_{owner_id.hex}@example.com", username="bench",
+                    hashed_password="-", root_folder_id=root_id))
+        await db.flush()
+        db.add(FileItem(id=root_id, owner_id=owner_id, parent_id=None, name="Home", type="folder",
+                        size_bytes=0, path=item_path(None, root_id), depth=0))
+        await db.flush()
+        rows, levels = build_tree(owner_id, root_id, args.nodes, args.depth)
+        for i in range(0, len(rows), 5000):
+            await db.execute(insert(FileItem), rows[i:i + 5000])
+        await db.commit()
+        await db.execute(text("ANALYZE files"))
+        print(f"tree: {len(rows) + 1} nodes, {len(levels)} folder levels")
+
+    try:
+        async with AsyncSessionLocal() as db:
+            for level in (0, len(levels) // 3, 2 * len(levels) // 3):
+                target_id, target_path = levels[level][0]
+                params = {"target_id": target_id, "owner_id": owner_id}
+
+                async def cte_stats(db):
+                    return (await db.execute(CTE_STATS, params)).one()
+
+                async def path_stats(db):
+                    return await subtree_stats(db, owner_id, target_path)
+
+                async def cte_list(db):
+                    return (await db.execute(CTE_LIST, params)).all()
+
+                async def path_list(db):
+                    query = select(FileItem.id, FileItem.parent_id, FileItem.name).where(
+                        *subtree_filter(owner_id, target_path)).order_by(FileItem.path)
+                    return (await db.execute(query)).all()
+
+                size, n_files, n_folders = await cte_stats(db)
+                assert (await path_stats(db)) == {"size_bytes": size, "files": n_files, "folders": n_folders}
+                print(
+                    f"level {level}: {n_files + n_folders} nodes | "
+                    f"stats cte={await timed(db, cte_stats, args.repeat):.1f}ms "
+                    f"path={await timed(db, path_stats, args.repeat):.1f}ms | "
+                    f"list cte={await timed(db, cte_list, args.repeat):.1f}ms "
+                    f"path={await timed(db, path_list, args.repeat):.1f}ms"
+                )
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(FileItem).where(FileItem.owner_id == owner_id, FileItem.parent_id.is_(None)))
+            await db.execute(delete(User).where(User.id == owner_id))
+            await db.commit()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=100_000)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Đo độ trễ /list (p50/p99) khi có nhiều upload lớn chạy song song.
+# App chạy ngay trong process (httpx ASGITransport), cần DATABASE_URL trỏ tới
+# một DB đã chạy create_table.sql (KHÔNG dùng DB thật của gia đình).
+#
+# Chạy từ thư mục Backend:
+#   python -m benchmarks.bench_upload_latency --uploads 8 --size-mb 64
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import httpx
+import uuid6
+
+from app.main import app
+
+API = "/api/v1"
+
+
+async def login(client):
+    email = f"bench_{uuid6.uuid7().hex}@example.com"
+    password = "benchmark"
+    r = await client.post(f"{API}/auth/register", json={"email": email, "username": "bench", "password": password})
+    r.raise_for_status()
+    r = await client.post(f"{API}/auth/token", data={"username": email, "password": password})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+async def poll_list(client, headers, stop, latencies, interval):
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.get(f"{API}/files/list", headers=headers)
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+async def upload_many(client, headers, count, payload):
+    async def one(i):
+        r = await client.post(
+            f"{API}/files/upload",
+            data={"parent_id": "root"},
+            files={"file": (f"bench_{i}.bin", payload, "application/octet-stream")},
+            headers=headers,
+        )
+        r.raise_for_status()
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+
+
+def summary(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:14s} n={len(latencies):4d} p50={statistics.median(latencies) * 1000:.1f}ms "
+        f"p99={p99 * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms"
+    )
+
+
+async def run(args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        headers = await login(client)
+
+        # Mốc so sánh: /list khi không có upload
+        stop = asyncio.Event()
+        idle = []
+        poller = asyncio.create_task(poll_list(client, headers, stop, idle, args.interval))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        await poller
+        summary("idle", idle)
+
+        # /list trong lúc có upload lớn
+        payload = os.urandom(int(args.size_mb * 1024 * 1024))
+        stop = asyncio.Event()
+        busy = []
+        poller = asyncio.create_task(poll_list(client, headers, stop, busy, args.interval))
+        start = time.perf_counter()
+        await upload_many(client, headers, args.uploads, payload)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await poller
+        summary("during upload", busy)
+        print(f"upload throughput {args.uploads * len(payload) / elapsed / 1e6:.1f}MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--interval", type=float, default=0.02)
+    parser.add_argument("--idle-seconds", type=float, default=2)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
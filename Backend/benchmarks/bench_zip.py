@@ -0,0 +1,105 @@
+# So sánh cách tải folder dạng ZIP cũ (nén ra file tạm rồi mới gửi) với
+# cách streaming mới (app.core.zipstream.iter_zip).
+#
+# Chạy từ thư mục Backend:
+#   python -m benchmarks.bench_zip --files 200 --size-mb 4
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from app.core.zipstream import iter_zip
+
+MIME_MIX = ["image/jpeg", "video/mp4", "text/plain", "application/pdf"]
+
+
+def make_dataset(root, n_files, size):
+    entries = [("Album", None, None)]
+    for i in range(n_files):
+        mime = MIME_MIX[i % len(MIME_MIX)]
+        path = os.path.join(root, f"{i}.bin")
+        with open(path, "wb") as f:
+            if mime == "text/plain":
+                f.write((b"family storage benchmark line %d\n" % i) * (size // 32 + 1))
+            else:
+                # Dữ liệu ngẫu nhiên ~ ảnh/video đã nén
+                f.write(os.urandom(size))
+        entries.append((f"Album/{i}.bin", path, mime))
+    return entries
+
+
+def bench_tempfile(entries, workdir):
+    # Giống download_folder cũ: ZIP_DEFLATED toàn bộ vào storage/ rồi mới gửi
+    zip_path = os.path.join(workdir, "old.zip")
+    start = time.perf_counter()
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for arcname, real_path, _ in entries:
+            if real_path is None:
+                zipf.writestr(zipfile.ZipInfo(arcname + "/"), "")
+            else:
+                zipf.write(real_path, arcname=arcname)
+    first_byte = time.perf_counter() - start
+    sent = 0
+    with open(zip_path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            sent += len(chunk)
+    total = time.perf_counter() - start
+    disk = os.path.getsize(zip_path)
+    os.remove(zip_path)
+    return {"ttfb_s": first_byte, "total_s": total, "bytes": sent, "extra_disk_bytes": disk}
+
+
+def bench_stream(entries):
+    start = time.perf_counter()
+    first_byte = None
+    sent = 0
+    for chunk in iter_zip(entries):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        sent += len(chunk)
+    total = time.perf_counter() - start
+    return {"ttfb_s": first_byte, "total_s": total, "bytes": sent, "extra_disk_bytes": 0}
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["peak_mem_bytes"] = peak
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_zip_")
+    try:
+        entries = make_dataset(workdir, args.files, int(args.size_mb * 1024 * 1024))
+        input_bytes = sum(os.path.getsize(p) for _, p, _ in entries if p)
+        for name, fn, fn_args in (
+            ("tempfile", bench_tempfile, (entries, workdir)),
+            ("stream", bench_stream, (entries,)),
+        ):
+            r = measure(fn, *fn_args)
+            print(
+                f"{name:9s} ttfb={r['ttfb_s']:.3f}s total={r['total_s']:.2f}s "
+                f"throughput={input_bytes / r['total_s'] / 1e6:.1f}MB/s "
+                f"zip={r['bytes'] / 1e6:.1f}MB peak_mem={r['peak_mem_bytes'] / 1e6:.1f}MB "
+                f"extra_disk={r['extra_disk_bytes'] / 1e6:.1f}MB"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
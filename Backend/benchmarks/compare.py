@@ -0,0 +1,81 @@
+# So sánh 2 file kết quả của benchmarks.run, VD trước và sau một thay đổi:
+#   python -m benchmarks.compare before.json after.json
+#   python -m benchmarks.compare before.json after.json --threshold 0.15 --fail-on-regression
+# Chỉ số *_mb_s càng cao càng tốt, *_ms / seconds càng thấp càng tốt.
+import argparse
+import json
+import sys
+
+# Chỉ so các chỉ số này (bỏ qua n, bytes...)
+HIGHER_IS_BETTER = ("mb_s",)
+LOWER_IS_BETTER = ("_ms", "seconds")
+
+
+def flatten(data, prefix="") -> dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def direction(metric: str) -> int:
+    leaf = metric.rsplit(".", 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(before: dict, after: dict, threshold: float) -> tuple[list, int]:
+    old, new = flatten(before["results"]), flatten(after["results"])
+    rows, regressions = [], 0
+    for metric in sorted(old.keys() & new.keys()):
+        sign = direction(metric)
+        if sign == 0:
+            continue
+        change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+        # > 0: tốt hơn, < 0: tệ hơn
+        gain = change * sign
+        verdict = ""
+        if gain <= -threshold:
+            verdict = "REGRESSION"
+            regressions += 1
+        elif gain >= threshold:
+            verdict = "improved"
+        rows.append((metric, old[metric], new[metric], change, verdict))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh 2 lần chạy benchmarks.run")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Ngưỡng thay đổi tương đối (mặc định 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Thoát với mã 1 nếu có chỉ số tệ đi")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('git')} {before['meta'].get('started_at')}")
+    print(f"after:  {after['meta'].get('git')} {after['meta'].get('started_at')}")
+    rows, regressions = compare(before, after, args.threshold)
+    width = max((len(row[0]) for row in rows), default=10)
+    print(f"{'metric':{width}s} {'before':>12s} {'after':>12s} {'change':>8s}")
+    for metric, old, new, change, verdict in rows:
+        print(f"{metric:{width}s} {old:12.2f} {new:12.2f} {change:+8.1%} {verdict}")
+    print(f"{regressions} regression(s) vượt ngưỡng {args.threshold:.0%}")
+
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+# Bộ benchmark cho các đường nóng của storage, ghi kết quả ra JSON để so sánh giữa
+# các lần chạy (python -m benchmarks.compare cu.json moi.json).
+# App chạy ngay trong process qua httpx ASGITransport (có cả lifespan: GC, thumbnail...).
+#
+# Cần Postgres: DATABASE_URL trỏ tới một DB đã chạy create_table.sql (KHÔNG dùng DB thật
+# của gia đình). Không có bản SQLite vì schema/truy vấn dùng tính năng riêng của Postgres
+# (unnest, = ANY, set_bit, ON CONFLICT ... RETURNING xmax, collation "C"...).
+# File được ghi vào 1 thư mục tạm (--workdir), xóa khi chạy xong.
+#
+# Chạy từ thư mục Backend:
+#   python -m benchmarks.run --output results.json
+#   python -m benchmarks.run --scenarios list,content --list-sizes 100,10000
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import httpx
+import uuid6
+from sqlalchemy import insert, delete
+
+from app.main import app
+from app.core import blobcache
+from app.core.config import settings
+from app.core.tree import item_path, path_depth
+from app.db.base import engine, AsyncSessionLocal
+from app.db.models import User, FileItem
+
+API = "/api/v1"
+MB = 1024 * 1024
+SCENARIOS = ("upload", "chunked", "bulk", "list", "zip", "content", "login", "tree")
+# Không dùng image/*: dữ liệu ngẫu nhiên không phải ảnh, tránh kích hoạt tạo thumbnail
+MIME_MIX = ["video/mp4", "application/zip", "text/plain", "application/pdf"]
+
+
+def latency_summary(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": statistics.median(samples) * 1000,
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def throughput(nbytes: int, seconds: float) -> dict:
+    return {"bytes": nbytes, "seconds": seconds, "mb_s": nbytes / MB / seconds if seconds else 0.0}
+
+
+def payload(size: int, mime: str = "application/octet-stream") -> bytes:
+    # Văn bản nén được, còn lại là dữ liệu ngẫu nhiên (~ ảnh/video đã nén)
+    if mime == "text/plain":
+        return (b"family storage benchmark line\n" * (size // 30 + 1))[:size]
+    return os.urandom(size)
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.headers = {}
+        self.user_id = None
+        self.extra_user_ids = [] # Tài khoản phụ (scenario login), xóa khi chạy xong
+
+    async def login(self):
+        email = f"bench_{uuid6.uuid7().hex}@example.com"
+        r = await self.client.post(f"{API}/auth/register", json={"email": email, "username": "bench", "password": "benchmark"})
+        r.raise_for_status()
+        self.user_id = r.json()["id"]
+        r = await self.client.post(f"{API}/auth/token", data={"username": email, "password": "benchmark"})
+        r.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    async def folder(self, name: str, parent_id: str | None = None) -> str:
+        r = await self.client.post(f"{API}/files/create_folder", json={"name": name, "parent_id": parent_id}, headers=self.headers)
+        r.raise_for_status()
+        return r.json()["id"]
+
+    async def upload(self, parent_id: str, name: str, data: bytes, mime: str = "application/octet-stream") -> str:
+        r = await self.client.post(
+            f"{API}/files/upload", data={"parent_id": parent_id},
+            files={"file": (name, data, mime)}, headers=self.headers,
+        )
+        r.raise_for_status()
+        return r.json()["id"]
+
+    # 1. /upload: MB/s khi upload tuần tự và song song
+    async def bench_upload(self) -> dict:
+        folder_id = await self.folder("upload")
+        size = int(self.args.upload_mb * MB)
+        results = {}
+        for concurrency in (1, self.args.upload_concurrency):
+            blobs = [payload(size) for _ in range(concurrency)]
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                self.upload(folder_id, f"c{concurrency}_{i}.bin", blob) for i, blob in enumerate(blobs)
+            ))
+            results[f"concurrency_{concurrency}"] = throughput(size * concurrency, time.perf_counter() - start)
+        return results
+
+    # 2. Upload theo chunk: /upload_chunk (gộp file ở chunk cuối) và upload session
+    async def bench_chunked(self) -> dict:
+        folder_id = await self.folder("chunked")
+        chunk = int(self.args.chunk_mb * MB)
+        total = int(self.args.chunked_mb * MB)
+        data = payload(total)
+        parts = [data[i:i + chunk] for i in range(0, total, chunk)]
+
+        upload_id = uuid6.uuid7().hex
+        start = time.perf_counter()
+        for index, part in enumerate(parts[:-1]):
+            r = await self.client.post(f"{API}/files/upload_chunk", data={
+                "upload_id": upload_id, "chunk_index": index, "total_chunks": len(parts), "parent_id": folder_id,
+            }, files={"file": ("legacy.bin", part, "application/octet-stream")}, headers=self.headers)
+            r.raise_for_status()
+        merge_start = time.perf_counter()
+        r = await self.client.post(f"{API}/files/upload_chunk", data={
+            "upload_id": upload_id, "chunk_index": len(parts) - 1, "total_chunks": len(parts), "parent_id": folder_id,
+        }, files={"file": ("legacy.bin", parts[-1], "application/octet-stream")}, headers=self.headers)
+        r.raise_for_status()
+        end = time.perf_counter()
+        legacy = {**throughput(total, end - start), "last_chunk_and_merge_ms": (end - merge_start) * 1000}
+
+        data = payload(total)
+        start = time.perf_counter()
+        r = await self.client.post(f"{API}/uploads/sessions", json={
+            "filename": "session.bin", "total_size": total, "chunk_size": chunk, "parent_id": folder_id,
+        }, headers=self.headers)
+        r.raise_for_status()
+        session_id = r.json()["upload_id"]
+        # Gửi song song như client thật, chunk cuối gửi riêng để đo bước hoàn tất
+        semaphore = asyncio.Semaphore(self.args.chunk_concurrency)
+
+        async def put(index):
+            async with semaphore:
+                r = await self.client.put(f"{API}/uploads/sessions/{session_id}/chunks/{index}",
+                                          content=data[index * chunk:(index + 1) * chunk], headers=self.headers)
+                r.raise_for_status()
+
+        await asyncio.gather(*(put(i) for i in range(len(parts) - 1)))
+        finalize_start = time.perf_counter()
+        await put(len(parts) - 1)
+        end = time.perf_counter()
+        sessions = {**throughput(total, end - start), "last_chunk_and_finalize_ms": (end - finalize_start) * 1000}
+        return {"upload_chunk": legacy, "sessions": sessions}
+
+    # 2b. Nhiều file nhỏ (sao lưu ảnh): từng file qua /upload so với 1 file tar qua /uploads/bulk
+    async def bench_bulk(self) -> dict:
+        size = int(self.args.bulk_file_kb * 1024)
+        count = self.args.bulk_files
+        semaphore = asyncio.Semaphore(self.args.upload_concurrency)
+
+        folder_id = await self.folder("bulk_single")
+        blobs = [payload(size) for _ in range(count)]
+
+        async def upload_one(i, blob):
+            async with semaphore:
+                await self.upload(folder_id, f"IMG_{i}.bin", blob)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(upload_one(i, blob) for i, blob in enumerate(blobs)))
+        single = time.perf_counter() - start
+
+        folder_id = await self.folder("bulk_tar")
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for i in range(count):
+                info = tarfile.TarInfo(f"{i % 10}/IMG_{i}.bin")
+                info.size = size
+                tar.addfile(info, io.BytesIO(payload(size)))
+        body = buffer.getvalue()
+
+        # Gửi theo khúc như client đang đọc file tar từ đĩa
+        async def stream():
+            for i in range(0, len(body), 256 * 1024):
+                yield body[i:i + 256 * 1024]
+
+        start = time.perf_counter()
+        r = await self.client.post(f"{API}/uploads/bulk", params={"parent_id": folder_id}, content=stream(),
+                                   headers={**self.headers, "Content-Type": "application/x-tar"})
+        r.raise_for_status()
+        bulk = time.perf_counter() - start
+        assert r.json()["succeeded"] == count, r.json()["failed"]
+        return {
+            "upload": {**throughput(size * count, single), "files_s": count / single},
+            "bulk_tar": {**throughput(size * count, bulk), "files_s": count / bulk},
+        }
+
+    # 3. /list: độ trễ cả folder và từng trang, với nhiều cỡ folder (dòng files chèn thẳng vào DB)
+    async def bench_list(self) -> dict:
+        results = {}
+        for size in self.args.list_sizes:
+            folder_id = await self.folder(f"list_{size}")
+            async with AsyncSessionLocal() as db:
+                folder = await db.get(FileItem, folder_id)
+                rows = []
+                for i in range(size):
+                    item_id = uuid6.uuid7()
+                    path = item_path(folder.path, item_id)
+                    is_folder = i % 10 == 0
+                    rows.append(dict(
+                        id=item_id, owner_id=folder.owner_id, parent_id=folder.id, name=f"item_{i:07d}",
+                        type="folder" if is_folder else "file", mime_type=None if is_folder else "image/jpeg",
+                        size_bytes=0 if is_folder else 1024, path=path, depth=path_depth(path),
+                    ))
+                for i in range(0, len(rows), 5000):
+                    await db.execute(insert(FileItem), rows[i:i + 5000])
+                await db.commit()
+
+            full = []
+            for _ in range(self.args.repeat):
+                start = time.perf_counter()
+                r = await self.client.get(f"{API}/files/list", params={"folder_id": folder_id}, headers=self.headers)
+                r.raise_for_status()
+                full.append(time.perf_counter() - start)
+
+            pages, cursor = [], None
+            while True:
+                params = {"folder_id": folder_id, "limit": self.args.page_size}
+                if cursor:
+                    params["cursor"] = cursor
+                start = time.perf_counter()
+                r = await self.client.get(f"{API}/files/list", params=params, headers=self.headers)
+                r.raise_for_status()
+                pages.append(time.perf_counter() - start)
+                cursor = r.json()["next_cursor"]
+                if not cursor:
+                    break
+            results[f"items_{size}"] = {"full": latency_summary(full), "page": latency_summary(pages)}
+        return results
+
+    # 4. Tải folder dạng ZIP: thời gian tới byte đầu tiên và MB/s
+    async def bench_zip(self) -> dict:
+        folder_id = await self.folder("zip")
+        size = int(self.args.zip_file_mb * MB)
+        total = 0
+        for i in range(self.args.zip_files):
+            mime = MIME_MIX[i % len(MIME_MIX)]
+            await self.upload(folder_id, f"{i}.bin", payload(size, mime), mime)
+            total += size
+
+        start = time.perf_counter()
+        ttfb = None
+        received = 0
+        async with self.client.stream("GET", f"{API}/files/download_folder/{folder_id}", headers=self.headers) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                received += len(chunk)
+        elapsed = time.perf_counter() - start
+        return {**throughput(total, elapsed), "zip_bytes": received, "ttfb_ms": (ttfb or elapsed) * 1000}
+
+    # 5. /content: Range request ngẫu nhiên (tua video), request có điều kiện (304)
+    #    và mở đi mở lại vài ảnh nhỏ (blobcache; so sánh với BLOB_CACHE_BYTES=0)
+    async def bench_content(self) -> dict:
+        folder_id = await self.folder("content")
+        size = int(self.args.content_mb * MB)
+        file_id = await self.upload(folder_id, "video.mp4", payload(size), "video/mp4")
+        url = f"{API}/files/content/{file_id}"
+        span = int(self.args.range_kb * 1024)
+        rng = random.Random(42)
+
+        ranges = []
+        for _ in range(self.args.range_requests):
+            offset = rng.randrange(0, max(1, size - span))
+            start = time.perf_counter()
+            r = await self.client.get(url, headers={**self.headers, "Range": f"bytes={offset}-{offset + span - 1}"})
+            assert r.status_code == 206, r.status_code
+            ranges.append(time.perf_counter() - start)
+
+        r = await self.client.get(url, headers={**self.headers, "Range": "bytes=0-0"})
+        etag = r.headers.get("etag")
+        conditional = []
+        if etag:
+            for _ in range(self.args.range_requests):
+                start = time.perf_counter()
+                r = await self.client.get(url, headers={**self.headers, "If-None-Match": etag})
+                assert r.status_code == 304, r.status_code
+                conditional.append(time.perf_counter() - start)
+
+        hot_size = int(self.args.hot_file_kb * 1024)
+        hot_urls = []
+        for index in range(self.args.hot_files):
+            hot_id = await self.upload(folder_id, f"hot_{index}.bin", payload(hot_size), "application/octet-stream")
+            hot_urls.append(f"{API}/files/content/{hot_id}")
+        hot = []
+        for index in range(self.args.hot_requests):
+            start = time.perf_counter()
+            r = await self.client.get(hot_urls[index % len(hot_urls)], headers=self.headers)
+            assert r.status_code == 200, r.status_code
+            hot.append(time.perf_counter() - start)
+
+        result = {"range": latency_summary(ranges)}
+        if conditional:
+            result["not_modified"] = latency_summary(conditional)
+        if hot:
+            result["hot_small"] = {**latency_summary(hot), "cache": blobcache.stats()}
+        return result
+
+    # 6. Đăng nhập (bcrypt): số lượt/giây khi nhiều tài khoản đăng nhập cùng lúc, và độ trễ
+    #    của 1 route khác (/list) trong lúc đó so với lúc rảnh
+    async def bench_login(self) -> dict:
+        emails = []
+        for _ in range(self.args.login_concurrency):
+            email = f"bench_{uuid6.uuid7().hex}@example.com"
+            r = await self.client.post(f"{API}/auth/register", json={"email": email, "username": "bench", "password": "benchmark"})
+            r.raise_for_status()
+            self.extra_user_ids.append(r.json()["id"])
+            emails.append(email)
+
+        async def probe(stop: asyncio.Event) -> list[float]:
+            samples = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                r = await self.client.get(f"{API}/files/list", headers=self.headers)
+                r.raise_for_status()
+                samples.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+            return samples
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(stop))
+        await asyncio.sleep(1)
+        stop.set()
+        idle = await task
+
+        # Mỗi tài khoản đăng nhập tuần tự (không chạm giới hạn đăng nhập song song / tài khoản)
+        logins = []
+
+        async def login_loop(email):
+            for _ in range(max(1, self.args.login_requests // len(emails))):
+                start = time.perf_counter()
+                r = await self.client.post(f"{API}/auth/token", data={"username": email, "password": "benchmark"})
+                r.raise_for_status()
+                logins.append(time.perf_counter() - start)
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(login_loop(email) for email in emails))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        busy = await task
+        return {
+            "logins_per_s": len(logins) / elapsed,
+            "login": latency_summary(logins),
+            "other_route_idle": latency_summary(idle),
+            "other_route_during_login": latency_summary(busy),
+        }
+
+    # 7. Cả cây folder: gọi /list cho từng folder so với 1 lần /tree (JSON và msgpack)
+    async def bench_tree(self) -> dict:
+        root_id = await self.folder("tree")
+        folders = 0
+        async with AsyncSessionLocal() as db:
+            root = await db.get(FileItem, root_id)
+            rows = []
+            level = [(root.id, root.path)]
+            for _ in range(self.args.tree_depth):
+                next_level = []
+                for parent_id, parent_path in level:
+                    for i in range(self.args.tree_fanout + self.args.tree_files):
+                        item_id = uuid6.uuid7()
+                        path = item_path(parent_path, item_id)
+                        is_folder = i < self.args.tree_fanout
+                        rows.append(dict(
+                            id=item_id, owner_id=root.owner_id, parent_id=parent_id, name=f"item_{i:05d}",
+                            type="folder" if is_folder else "file", mime_type=None if is_folder else "image/jpeg",
+                            size_bytes=0 if is_folder else 1024, path=path, depth=path_depth(path),
+                        ))
+                        if is_folder:
+                            next_level.append((item_id, path))
+                folders += len(next_level)
+                level = next_level
+            for i in range(0, len(rows), 5000):
+                await db.execute(insert(FileItem), rows[i:i + 5000])
+            await db.commit()
+
+        # Client cũ: duyệt từng folder bằng /list
+        crawl, crawl_bytes = [], 0
+        for _ in range(max(1, self.args.repeat // 5)):
+            start = time.perf_counter()
+            pending, crawl_bytes = [root_id], 0
+            while pending:
+                r = await self.client.get(f"{API}/files/list", params={"folder_id": pending.pop()}, headers=self.headers)
+                r.raise_for_status()
+                crawl_bytes += len(r.content)
+                pending.extend(item["id"] for item in r.json() if item["type"] == "folder")
+            crawl.append(time.perf_counter() - start)
+
+        results = {"items": len(rows), "list_crawl": {**latency_summary(crawl), "requests": folders + 1, "bytes": crawl_bytes}}
+        for name, accept in (("tree_json", "application/json"), ("tree_msgpack", "application/msgpack")):
+            samples, size, content_type = [], 0, None
+            for _ in range(self.args.repeat):
+                start = time.perf_counter()
+                r = await self.client.get(f"{API}/files/tree", params={"folder_id": root_id}, headers={**self.headers, "Accept": accept})
+                r.raise_for_status()
+                samples.append(time.perf_counter() - start)
+                size, content_type = len(r.content), r.headers["content-type"]
+            results[name] = {**latency_summary(samples), "bytes": size, "content_type": content_type}
+        return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "workdir")},
+            "settings": {
+                "UPLOAD_BUFFER_SIZE": settings.UPLOAD_BUFFER_SIZE,
+                "UPLOAD_IO_WORKERS": settings.UPLOAD_IO_WORKERS,
+                "UPLOAD_CHUNK_SIZE": settings.UPLOAD_CHUNK_SIZE,
+                "BCRYPT_ROUNDS": settings.BCRYPT_ROUNDS,
+                "PASSWORD_HASH_WORKERS": settings.PASSWORD_HASH_WORKERS,
+                "BLOB_CACHE_BYTES": settings.BLOB_CACHE_BYTES,
+            },
+        },
+        "results": {},
+    }
+
+    # Đường dẫn storage/ là tương đối -> chạy trong thư mục tạm
+    workdir = args.workdir or tempfile.mkdtemp(prefix="family_bench_")
+    cwd = os.getcwd()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    bench = None
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                bench = Bench(client, args)
+                await bench.login()
+                for name in args.scenarios:
+                    print(f"-- {name}", flush=True)
+                    start = time.perf_counter()
+                    report["results"][name] = await getattr(bench, f"bench_{name}")()
+                    print(f"   {time.perf_counter() - start:.1f}s", flush=True)
+    finally:
+        os.chdir(cwd)
+        if bench and bench.user_id:
+            async with AsyncSessionLocal() as db:
+                for user_id in [bench.user_id, *bench.extra_user_ids]:
+                    await db.execute(delete(FileItem).where(FileItem.owner_id == user_id, FileItem.parent_id.is_(None)))
+                    await db.execute(delete(User).where(User.id == user_id))
+                await db.commit()
+        await engine.dispose()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    csv = lambda cast: (lambda value: [cast(v) for v in value.split(",") if v])
+    parser = argparse.ArgumentParser(description="Benchmark các đường nóng của storage")
+    parser.add_argument("--scenarios", type=csv(str), default=list(SCENARIOS), help=",".join(SCENARIOS))
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file (mặc định in ra màn hình)")
+    parser.add_argument("--workdir", help="Thư mục chứa storage/ khi chạy (mặc định: thư mục tạm)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--upload-mb", type=float, default=32)
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--chunked-mb", type=float, default=64)
+    parser.add_argument("--chunk-mb", type=float, default=8)
+    parser.add_argument("--chunk-concurrency", type=int, default=4)
+    parser.add_argument("--bulk-files", type=int, default=500)
+    parser.add_argument("--bulk-file-kb", type=float, default=256)
+    parser.add_argument("--list-sizes", type=csv(int), default=[100, 1000, 10000])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--zip-files", type=int, default=100)
+    parser.add_argument("--zip-file-mb", type=float, default=1)
+    parser.add_argument("--content-mb", type=float, default=64)
+    parser.add_argument("--range-kb", type=float, default=1024)
+    parser.add_argument("--range-requests", type=int, default=200)
+    parser.add_argument("--hot-files", type=int, default=20)
+    parser.add_argument("--hot-file-kb", type=float, default=512)
+    parser.add_argument("--hot-requests", type=int, default=400)
+    parser.add_argument("--login-requests", type=int, default=64)
+    parser.add_argument("--login-concurrency", type=int, default=8)
+    parser.add_argument("--tree-depth", type=int, default=3)
+    parser.add_argument("--tree-fanout", type=int, default=8)
+    parser.add_argument("--tree-files", type=int, default=10)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"scenario không hợp lệ: {', '.join(sorted(unknown))}")
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Đã ghi {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
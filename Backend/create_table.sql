@@ -1,5 +1,13 @@
+-- Tìm theo tên (chứa chuỗi con) dùng index trigram
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Xóa bảng cũ
+DROP TABLE IF EXISTS blob_blocks CASCADE;
+DROP TABLE IF EXISTS file_versions CASCADE;
+DROP TABLE IF EXISTS changes CASCADE;
+DROP TABLE IF EXISTS upload_sessions CASCADE;
 DROP TABLE IF EXISTS files CASCADE;
+DROP TABLE IF EXISTS blobs CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
 
 -- 1. Bảng USERS
@@ -10,10 +18,45 @@ CREATE TABLE users (
     hashed_password VARCHAR(255) NOT NULL,
     root_folder_id UUID, -- Trỏ đến bảng files
     is_active BOOLEAN DEFAULT TRUE,
+    -- Dung lượng đã dùng, cộng trừ cùng transaction với bảng files (xem app/core/usage.py)
+    used_bytes BIGINT NOT NULL DEFAULT 0,
+    file_count BIGINT NOT NULL DEFAULT 0,
+    quota_bytes BIGINT, -- NULL = dùng quota mặc định trong cấu hình
+    change_seq BIGINT NOT NULL DEFAULT 0, -- seq của thay đổi gần nhất trong bảng changes
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
--- 2. Bảng FILES (Gộp chung File và Folder)
+-- User bị sửa/khóa/xóa bằng bất kỳ cách nào (ORM, SQL tay, worker khác) -> NOTIFY để mọi worker
+-- bỏ user khỏi cache xác thực (xem app/core/deps.py). Bỏ qua used_bytes / change_seq... đổi liên tục.
+CREATE OR REPLACE FUNCTION notify_user_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('user_changes', OLD.id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_auth_changed
+    AFTER UPDATE ON users FOR EACH ROW
+    WHEN ((OLD.email, OLD.username, OLD.hashed_password, OLD.root_folder_id, OLD.is_active)
+          IS DISTINCT FROM (NEW.email, NEW.username, NEW.hashed_password, NEW.root_folder_id, NEW.is_active))
+    EXECUTE FUNCTION notify_user_changed();
+CREATE TRIGGER users_auth_deleted
+    AFTER DELETE ON users FOR EACH ROW
+    EXECUTE FUNCTION notify_user_changed();
+
+-- 2. Bảng BLOBS (Nội dung file, định danh bằng SHA-256, dùng chung giữa các file)
+CREATE TABLE blobs (
+    sha256 VARCHAR(64) PRIMARY KEY, -- File vật lý: storage/blobs/<ab>/<cd>/<sha256> (đã nén: <sha256>.zst)
+    size_bytes BIGINT NOT NULL, -- Kích thước nội dung gốc
+    ref_count INTEGER NOT NULL DEFAULT 1, -- Số dòng files đang trỏ tới, về 0 thì xóa
+    encoding VARCHAR(16), -- NULL = nguyên bản (chưa xét nén), 'identity' = đã thử, nén không lợi, 'zstd'
+    stored_bytes BIGINT, -- Kích thước thật trong kho khi đã nén
+    compression_level SMALLINT,
+    compressed_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 3. Bảng FILES (Gộp chung File và Folder)
 CREATE TABLE files (
     id UUID PRIMARY KEY, -- Đây cũng chính là tên file vật lý trên đĩa
     
@@ -26,17 +69,91 @@ CREATE TABLE files (
     
     type VARCHAR(20) NOT NULL, -- 'file' hoặc 'folder'
     
+    -- Materialized path: id (hex) của các tổ tiên + chính nó, VD "<root>/<folder>/<file>/"
+    -- Collation "C" để so sánh theo byte: cây con = 1 khoảng [path, path + "0")
+    path VARCHAR COLLATE "C" NOT NULL,
+    depth INTEGER NOT NULL DEFAULT 0, -- Home = 0
+    
     -- Đã BỎ physical_path
     
     mime_type VARCHAR(100), -- Để trình duyệt biết là ảnh hay video
     size_bytes BIGINT DEFAULT 0,
     
+    -- Nội dung file (NULL = folder hoặc file cũ lưu ở storage/completed/<owner_id>/<id>)
+    blob_hash VARCHAR(64) REFERENCES blobs(sha256),
+    version INTEGER NOT NULL DEFAULT 1, -- Tăng mỗi lần nội dung được thay (upload delta), bản cũ ở file_versions
+    
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
 
     UNIQUE(owner_id, parent_id, name)
 );
 
--- 3. Index
+-- 4. Bảng UPLOAD_SESSIONS (Upload theo chunk, có thể resume)
+CREATE TABLE upload_sessions (
+    id UUID PRIMARY KEY, -- File tạm: storage/temp/<id>.upload (cấp phát trước đủ total_size)
+    owner_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    parent_id UUID, -- Folder đích
+
+    filename VARCHAR(255) NOT NULL,
+    mime_type VARCHAR(100),
+    total_size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    total_chunks INTEGER NOT NULL,
+
+    received BYTEA NOT NULL, -- Bitmap chunk đã nhận (bit i = chunk i, cập nhật bằng set_bit)
+    received_count INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'uploading', -- uploading | finalizing | completed
+    file_id UUID, -- File được tạo khi hoàn tất
+
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- 5. Bảng CHANGES (Nhật ký thay đổi cho client đồng bộ delta, xem app/core/changes.py)
+CREATE TABLE changes (
+    owner_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    seq BIGINT NOT NULL, -- Tăng dần, liên tục theo từng user (cấp từ users.change_seq)
+    file_id UUID NOT NULL, -- Không khóa ngoại: item có thể đã bị xóa
+    action VARCHAR(10) NOT NULL, -- 'upsert' (tạo / đổi tên / di chuyển) | 'delete' (cả cây con)
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (owner_id, seq)
+);
+
+-- 6. Bảng FILE_VERSIONS (Nội dung cũ của file, giữ 1 tham chiếu tới blob cũ)
+CREATE TABLE file_versions (
+    id UUID PRIMARY KEY,
+    file_id UUID NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    owner_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL, -- files.version lúc nội dung này còn là bản hiện tại
+    blob_hash VARCHAR(64) NOT NULL REFERENCES blobs(sha256),
+    size_bytes BIGINT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL, -- Lúc nội dung này được ghi (files.updated_at khi đó)
+    replaced_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(file_id, version)
+);
+
+-- 7. Bảng BLOB_BLOCKS (Danh sách block chia theo nội dung của blob, cho upload delta, xem app/core/delta.py)
+CREATE TABLE blob_blocks (
+    blob_hash VARCHAR(64) NOT NULL REFERENCES blobs(sha256) ON DELETE CASCADE,
+    idx INTEGER NOT NULL, -- Thứ tự block trong blob
+    offset_bytes BIGINT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    block_hash VARCHAR(64) NOT NULL, -- SHA-256 của block
+    PRIMARY KEY (blob_hash, idx)
+);
+
+-- 8. Index
 CREATE INDEX idx_files_parent ON files(parent_id);
-CREATE INDEX idx_files_type ON files(type);
\ No newline at end of file
+CREATE INDEX idx_files_type ON files(type);
+CREATE INDEX idx_files_blob ON files(blob_hash);
+-- /list: lọc theo folder + phân trang keyset theo (type, name, id), không cần sort
+CREATE INDEX idx_files_listing ON files(owner_id, parent_id, type, name, id);
+-- Cây con, dung lượng folder, di chuyển: range query trên path
+CREATE INDEX idx_files_path ON files(owner_id, path);
+-- /search: lower(name) LIKE '%...%' dùng index trigram thay vì quét cả bảng
+CREATE INDEX idx_files_name_trgm ON files USING gin (lower(name) gin_trgm_ops);
+CREATE INDEX idx_upload_sessions_owner ON upload_sessions(owner_id);
+CREATE INDEX idx_file_versions_blob ON file_versions(blob_hash);
+-- Dọn nhật ký cũ (CHANGES_RETENTION_DAYS)
+CREATE INDEX idx_changes_created ON changes(created_at);
\ No newline at end of file
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import json
+import os
+import uuid
+
+import pytest
+
+# Cần Postgres đã chạy create_table.sql (giống benchmarks): DATABASE_URL=... python -m pytest tests
+if not os.environ.get("DATABASE_URL"):
+    pytest.skip("Cần DATABASE_URL trỏ tới Postgres để chạy", allow_module_level=True)
+os.environ.setdefault("SECRET_KEY", "test")
+
+import httpx
+from sqlalchemy import text
+
+from app.core import delta
+from app.core.config import settings
+from app.db.base import AsyncSessionLocal, engine
+from app.main import app
+
+# Sau mỗi API thay đổi dữ liệu: blobs.ref_count = số dòng files + file_versions trỏ tới blob,
+# users.used_bytes / file_count = tổng trên bảng files của user
+
+A = settings.API_V1_STR
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "FILE_VERSIONS_KEEP", 1)
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+                email = f"acc-{uuid.uuid4().hex}@test.com"
+                r = await c.post(A + "/auth/register", json={"email": email, "username": "acc", "password": "secret1"})
+                assert r.status_code == 200, r.text
+                owner_id = r.json()["id"]
+                r = await c.post(A + "/auth/token", data={"username": email, "password": "secret1"})
+                c.headers["Authorization"] = "Bearer " + r.json()["access_token"]
+                yield c, owner_id
+    finally:
+        await engine.dispose()
+
+
+async def check_accounting(owner_id, contents):
+    hashes = [hashlib.sha256(data).hexdigest() for data in contents]
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(text("""
+            SELECT u.used_bytes, u.file_count, f.bytes, f.n
+            FROM users u, LATERAL (
+                SELECT coalesce(sum(size_bytes), 0) AS bytes, count(*) AS n
+                FROM files WHERE owner_id = u.id AND type = 'file'
+            ) f
+            WHERE u.id = CAST(:owner_id AS uuid)
+        """), {"owner_id": owner_id})
+        row = result.one()
+        assert (row.used_bytes, row.file_count) == (row.bytes, row.n)
+
+        result = await db.execute(text("""
+            SELECT h.sha256, b.ref_count,
+                   (SELECT count(*) FROM files WHERE blob_hash = h.sha256)
+                 + (SELECT count(*) FROM file_versions WHERE blob_hash = h.sha256) AS refs
+            FROM unnest(CAST(:hashes AS varchar[])) AS h(sha256)
+            LEFT JOIN blobs b ON b.sha256 = h.sha256
+        """), {"hashes": hashes})
+        # Blob hết tham chiếu thì dòng blobs phải bị xóa (ref_count NULL)
+        counts = {sha256: (ref_count, refs) for sha256, ref_count, refs in result.all()}
+    for sha256 in hashes:
+        ref_count, refs = counts[sha256]
+        assert ref_count == (refs or None), (sha256, ref_count, refs)
+    return row.used_bytes, row.file_count
+
+
+async def upload(c, parent_id, name, data: bytes) -> str:
+    r = await c.post(A + "/files/upload", data={"parent_id": parent_id}, files={"file": (name, data, "application/octet-stream")})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+async def upload_session(c, parent_id, name, data: bytes, chunk_size: int) -> str:
+    r = await c.post(A + "/uploads/sessions", json={
+        "filename": name, "total_size": len(data), "chunk_size": chunk_size, "parent_id": parent_id,
+    })
+    assert r.status_code == 200, r.text
+    session = r.json()
+    for i in range(session["total_chunks"]):
+        r = await c.put(A + f"/uploads/sessions/{session['upload_id']}/chunks/{i}", content=data[i * chunk_size:(i + 1) * chunk_size])
+        assert r.status_code == 200, r.text
+    assert r.json()["status"] == "completed", r.json()
+    return r.json()["file_id"]
+
+
+async def upload_delta(c, file_id, version: int, data: bytes):
+    blocks = delta.chunk_stream(io.BytesIO(data))
+    r = await c.post(A + f"/uploads/delta/{file_id}/missing", json={"blocks": [h for _, h in blocks]})
+    missing = set(r.json()["missing"])
+    body, offset = b"", 0
+    for size, block_hash in blocks:
+        if block_hash in missing:
+            body += data[offset:offset + size]
+            missing.discard(block_hash)
+        offset += size
+    manifest = {"base_version": version, "blocks": [[h, size] for size, h in blocks]}
+    r = await c.post(A + f"/uploads/delta/{file_id}", data={"manifest": json.dumps(manifest)},
+                     files={"data": ("data", body, "application/octet-stream")})
+    assert r.status_code == 200, r.text
+    assert r.json()["version"] == version + 1
+
+
+async def versions(c, file_id) -> list[dict]:
+    r = await c.get(A + f"/files/items/{file_id}/versions")
+    assert r.status_code == 200, r.text
+    return r.json()["versions"]
+
+
+@pytest.mark.anyio
+async def test_refcount_and_usage_after_each_mutation(client):
+    c, owner_id = client
+    a, b, s = os.urandom(1000), os.urandom(2000), os.urandom(3000)
+    b2, b3 = b[:1000] + os.urandom(1500), os.urandom(500)
+    contents = [a, b, s, b2, b3]
+
+    r = await c.post(A + "/files/create_folder", json={"name": "F"})
+    folder_id = r.json()["id"]
+    a_id = await upload(c, folder_id, "a.bin", a)
+    b_id = await upload(c, "root", "b.bin", b)
+    assert await check_accounting(owner_id, contents) == (3000, 2)
+
+    # Upload theo chunk, cùng nội dung với a trong folder F: dùng chung blob
+    s_id = await upload_session(c, folder_id, "s.bin", s, chunk_size=1024)
+    await upload_session(c, folder_id, "a-again.bin", a, chunk_size=512)
+    assert await check_accounting(owner_id, contents) == (7000, 4)
+
+    # Copy cả folder: thêm tham chiếu blob, không ghi thêm blob
+    r = await c.post(A + f"/files/items/{folder_id}/copy", json={"parent_id": "root", "name": "F2"})
+    assert r.status_code == 200 and r.json()["status"] == "completed", r.text
+    copy_id = r.json()["id"]
+    assert await check_accounting(owner_id, contents) == (12000, 7)
+
+    r = await c.delete(A + f"/files/items/{a_id}")
+    assert r.status_code == 204, r.text
+    assert await check_accounting(owner_id, contents) == (11000, 6)
+
+    r = await c.post(A + "/files/items/batch", json={"operations": [
+        {"op": "delete", "id": copy_id},
+        {"op": "delete", "id": s_id},
+    ]})
+    assert r.json()["succeeded"] == 2, r.json()
+    assert await check_accounting(owner_id, contents) == (3000, 2)
+
+    # Phiên bản: bản cũ giữ tham chiếu blob nhưng không tính vào used_bytes (FILE_VERSIONS_KEEP = 1)
+    await upload_delta(c, b_id, 1, b2)
+    assert await check_accounting(owner_id, contents) == (3500, 2)
+    assert len(await versions(c, b_id)) == 1
+
+    old = (await versions(c, b_id))[0]
+    r = await c.post(A + f"/files/items/{b_id}/versions/{old['id']}/restore")
+    assert r.status_code == 200, r.text
+    # b2 thành bản cũ, bản cũ b bị dọn (quá FILE_VERSIONS_KEEP) nhưng vẫn là nội dung hiện tại
+    assert await check_accounting(owner_id, contents) == (3000, 2)
+    assert [v["size"] for v in await versions(c, b_id)] == [len(b2)]
+
+    await upload_delta(c, b_id, 3, b3)
+    # b2 bị dọn, hết tham chiếu -> dòng blobs bị xóa
+    assert await check_accounting(owner_id, contents) == (1500, 2)
+
+    r = await c.delete(A + f"/files/items/{b_id}")
+    assert r.status_code == 204, r.text
+    assert await check_accounting(owner_id, contents) == (1000, 1)
+
+
+# Khôi phục bản cũ có nội dung trùng bản hiện tại: không tạo phiên bản mới, không tăng version
+@pytest.mark.anyio
+async def test_restore_same_content_is_noop(client, monkeypatch):
+    c, owner_id = client
+    monkeypatch.setattr(settings, "FILE_VERSIONS_KEEP", 2)
+    x, y = os.urandom(1000), os.urandom(1200)
+
+    file_id = await upload(c, "root", "x.bin", x)
+    await upload_delta(c, file_id, 1, y)
+    await upload_delta(c, file_id, 2, x)
+    before = await versions(c, file_id)
+    assert [v["version"] for v in before] == [2, 1]
+
+    r = await c.post(A + f"/files/items/{file_id}/versions/{before[1]['id']}/restore")
+    assert r.status_code == 200, r.text
+    assert r.json()["status"] == "unchanged" and r.json()["version"] == 3, r.json()
+    assert await versions(c, file_id) == before
+    assert await check_accounting(owner_id, [x, y]) == (1000, 1)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import time
+from unittest import mock
+
+import pytest
+
+# S3 giả lập trong process bằng moto: pip install boto3 moto
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+# Settings bắt buộc có DATABASE_URL / SECRET_KEY; test này không kết nối DB
+with mock.patch.dict(os.environ, {
+    "DATABASE_URL": os.environ.get("DATABASE_URL", "postgresql+asyncpg://localhost/test"),
+    "SECRET_KEY": os.environ.get("SECRET_KEY", "test"),
+}):
+    from app.core import storage
+    from app.core.storage import S3Backend
+
+BUCKET = "family-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setattr(storage.settings, "S3_BUCKET", BUCKET)
+    monkeypatch.setattr(storage.settings, "S3_PREFIX", "blobs/")
+    monkeypatch.setattr(storage.settings, "S3_REGION", "us-east-1")
+    monkeypatch.setattr(storage.settings, "S3_ENDPOINT_URL", "")
+    monkeypatch.setattr(storage.settings, "S3_ACCESS_KEY", "test")
+    monkeypatch.setattr(storage.settings, "S3_SECRET_KEY", "test")
+    with moto.mock_aws():
+        backend = S3Backend()
+        backend.client.create_bucket(Bucket=BUCKET)
+        yield backend
+
+
+def write_temp(tmp_path, data: bytes) -> tuple[str, str]:
+    path = str(tmp_path / "upload.tmp")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, hashlib.sha256(data).hexdigest()
+
+
+def test_put_read_delete(s3, tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    path, key = write_temp(tmp_path, data)
+
+    assert not s3.exists(key)
+    s3.put(key, path)
+    assert not os.path.exists(path)
+    assert s3.exists(key)
+    assert s3.client.head_object(Bucket=BUCKET, Key=f"blobs/{key[:2]}/{key[2:4]}/{key}")["ContentLength"] == len(data)
+    assert s3.stat(key)[0] == len(data)
+
+    assert b"".join(s3.read_range(key, 0, len(data) - 1)) == data
+    assert b"".join(s3.read_range(key, 100, 199)) == data[100:200]
+    assert s3.read_at(key, len(data) - 5, 5) == data[-5:]
+    with s3.open_random(key) as read_at:
+        assert read_at(10, 4) == data[10:14]
+    body = s3.open(key)
+    assert body.read(8) == data[:8]
+    body.close()
+
+    dest = str(tmp_path / "download")
+    s3.download(key, dest)
+    with open(dest, "rb") as f:
+        assert f.read() == data
+
+    assert [name for page in s3.scan(time.time() + 60) for name, _ in page] == [key]
+    assert s3.delete(key) == len(data)
+    assert not s3.exists(key)
+    assert s3.delete(key) == 0
+
+
+def test_put_keep_leaves_source(s3, tmp_path):
+    path, key = write_temp(tmp_path, b"giu lai file nguon")
+    s3.put(key, path, keep=True)
+    assert os.path.exists(path)
+    assert s3.exists(key)
+
+
+def test_missing_key(s3, tmp_path):
+    key = "0" * 64
+    with pytest.raises(FileNotFoundError):
+        s3.stat(key)
+    with pytest.raises(FileNotFoundError):
+        list(s3.read_range(key, 0, 9))
+    with pytest.raises(FileNotFoundError):
+        s3.download(key, str(tmp_path / "missing"))
@@ -0,0 +1,81 @@
+import hashlib
+import os
+
+import pytest
+
+# Cần Postgres đã chạy create_table.sql (giống benchmarks): DATABASE_URL=... python -m pytest tests
+if not os.environ.get("DATABASE_URL"):
+    pytest.skip("Cần DATABASE_URL trỏ tới Postgres để chạy", allow_module_level=True)
+os.environ.setdefault("SECRET_KEY", "test")
+
+from app.core import storage_gc
+from app.core.blobstore import new_temp_path, prepare_blob, store_blob, release_blobs
+from app.core.storage import backend
+from app.db.base import AsyncSessionLocal, engine
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def upload(data: bytes, sha256: str):
+    temp_path = new_temp_path()
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    blob = await prepare_blob(temp_path, sha256, len(data))
+    async with AsyncSessionLocal() as db:
+        await store_blob(db, blob)
+        await db.commit()
+
+
+async def release(sha256: str):
+    async with AsyncSessionLocal() as db:
+        freed = await release_blobs(db, {sha256: 1})
+        await db.commit()
+    storage_gc.enqueue_blob_delete(freed)
+
+
+# Xóa file cuối cùng dùng blob rồi upload lại đúng nội dung đó trước khi hàng đợi GC chạy:
+# GC không được xóa blob vừa sống lại
+@pytest.mark.anyio
+async def test_reupload_before_drain_keeps_blob(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage_gc.settings, "CONTENT_CACHE_TTL_SECONDS", 0)
+    data = os.urandom(4096)
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        await upload(data, sha256)
+        await release(sha256)
+        await upload(data, sha256)
+        await storage_gc.drain(limit_rate=False)
+        assert backend.exists(sha256)
+
+        # Không ai upload lại: lần này blob bị xóa thật
+        await release(sha256)
+        await storage_gc.drain(limit_rate=False)
+        assert not backend.exists(sha256)
+    finally:
+        await engine.dispose()
+
+
+# Blob hết tham chiếu được giữ thêm CONTENT_CACHE_TTL_SECONDS (cache /content của worker khác
+# còn trỏ tới), hết hạn mới bị xóa
+@pytest.mark.anyio
+async def test_delete_waits_for_content_cache_ttl(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage_gc.settings, "CONTENT_CACHE_TTL_SECONDS", 60)
+    data = os.urandom(4096)
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        await upload(data, sha256)
+        await release(sha256)
+        await storage_gc.drain(limit_rate=False)
+        assert backend.exists(sha256)
+
+        # Hết hạn
+        storage_gc._queue[:] = [(0, kind, path) for _, kind, path in storage_gc._queue]
+        await storage_gc.drain(limit_rate=False)
+        assert not backend.exists(sha256)
+    finally:
+        await engine.dispose()
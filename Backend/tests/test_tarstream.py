@@ -0,0 +1,62 @@
+import tarfile
+
+import pytest
+
+from app.core.tarstream import MAX_HEADER_SIZE, TarStreamError, iter_tar
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def block(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % tarfile.BLOCKSIZE)
+
+
+def header(name: str, type=tarfile.REGTYPE, size: int = 0, fmt=tarfile.USTAR_FORMAT) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.type = type
+    info.size = size
+    return info.tobuf(fmt, "utf-8", "surrogateescape")
+
+
+async def chunks(data: bytes, size: int = 1000):
+    for pos in range(0, len(data), size):
+        yield data[pos:pos + size]
+
+
+async def read_all(data: bytes) -> list[tuple[str, bytes]]:
+    entries = []
+    async for info, content in iter_tar(chunks(data)):
+        entries.append((info.name, b"".join([part async for part in content])))
+    return entries
+
+
+@pytest.mark.anyio
+async def test_non_regular_entry_data_is_skipped():
+    # Symlink có header khai báo size > 0 (kèm dữ liệu) không được làm lệch entry kế tiếp
+    data = (
+        header("link", tarfile.SYMTYPE, size=700) + block(b"x" * 700)
+        + header("a.txt", size=5) + block(b"hello")
+        + b"\0" * 1024
+    )
+    assert await read_all(data) == [("link", b""), ("a.txt", b"hello")]
+
+
+@pytest.mark.anyio
+async def test_long_names():
+    name = "thu-muc/" * 40 + "anh.jpg"
+    data = (
+        header(name, size=3, fmt=tarfile.PAX_FORMAT) + block(b"pax")
+        + header(name, size=3, fmt=tarfile.GNU_FORMAT) + block(b"gnu")
+        + b"\0" * 1024
+    )
+    assert await read_all(data) == [(name, b"pax"), (name, b"gnu")]
+
+
+@pytest.mark.anyio
+async def test_oversized_long_name_header():
+    data = header("././@LongLink", tarfile.GNUTYPE_LONGNAME, size=MAX_HEADER_SIZE + 1) + b"\0" * 1024
+    with pytest.raises(TarStreamError):
+        await read_all(data)